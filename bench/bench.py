@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for jsongit.
+
+Each benchmark runs in its own process against a freshly populated repo, so
+that peak RSS figures are not polluted by earlier runs.  Results are written
+as JSON.
+
+    $ python bench/bench.py --output bench_output.txt
+    $ python bench/bench.py --preset full --ops show,log
+
+Values are generated from a fixed seed and committed with a fixed time, so
+repeated runs do equivalent work.
+"""
+
+import sys
+import os
+import json
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import multiprocessing
+import Queue
+from optparse import OptionParser
+from time import time as curtime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import jsongit
+from jsongit.version import __version__
+
+SEED = 1332438935
+TIME = 1332438935
+
+PRESETS = {
+    'quick': {
+        'keys': [1000],
+        'depths': [10],
+        'value_sizes': [1024],
+        'samples': 200,
+        'max_bytes': 1 << 30
+    },
+    # combinations that would commit more than max_bytes of values are
+    # skipped, which leaves large values only with few keys
+    'full': {
+        'keys': [1000, 10000, 100000, 1000000],
+        'depths': [10, 100, 1000],
+        'value_sizes': [1024, 64 * 1024, 1024 * 1024],
+        'samples': 1000,
+        'max_bytes': 1 << 30
+    }
+}
+
+#: Seconds to wait between checks that a benchmark process is still alive.
+POLL_INTERVAL = 5
+
+def make_value(r, size):
+    """A dict that dumps to roughly `size` bytes.
+    """
+    return {'id': r.randint(0, sys.maxint),
+            'payload': ''.join(r.choice('abcdefghijklmnopqrstuvwxyz')
+                               for i in xrange(min(size, 64))) * (size / 64 or 1)}
+
+def key_name(i):
+    return 'key%08d' % i
+
+def populate(repo, r, num_keys, value_size):
+    """Import num_keys keys at once.  Adding them one by one would rewrite
+    the whole index for every key, which takes hours for a million keys;
+    the cost of :func:`add` on a filled repo is what `bench_add` measures.
+    """
+    jsongit.bulk_import(repo, ((key_name(i), make_value(r, value_size), TIME)
+                               for i in xrange(num_keys)))
+
+def deepen(repo, r, key, depth, value_size):
+    """Give key a history of depth commits.
+    """
+    for i in xrange(depth):
+        repo.commit(key, make_value(r, value_size), time=TIME + i)
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+def summarize(latencies, units):
+    """Latency percentiles in milliseconds plus throughput in units/second.
+    """
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        'count': len(ordered),
+        'seconds': total,
+        'throughput': units / total if total else None,
+        'latency_ms': dict(('p%s' % p, percentile(ordered, p) * 1000)
+                           for p in (50, 90, 99)) if ordered else {},
+        'max_ms': ordered[-1] * 1000 if ordered else None
+    }
+
+def timed(func, *args, **kwargs):
+    start = curtime()
+    func(*args, **kwargs)
+    return curtime() - start
+
+def bench_add(repo, r, params):
+    keys, samples, size = params['keys'], params['samples'], params['value_size']
+    return [timed(repo.add, key_name(r.randrange(keys)), make_value(r, size))
+            for i in xrange(samples)], samples
+
+def bench_commit(repo, r, params):
+    keys, samples, size = params['keys'], params['samples'], params['value_size']
+    return [timed(repo.commit, key_name(r.randrange(keys)),
+                  make_value(r, size), time=TIME)
+            for i in xrange(samples)], samples
+
+def bench_show(repo, r, params):
+    keys, samples = params['keys'], params['samples']
+    return [timed(repo.show, key_name(r.randrange(keys)))
+            for i in xrange(samples)], samples
+
+def bench_staged(repo, r, params):
+    keys, samples = params['keys'], params['samples']
+    return [timed(repo.staged, key_name(r.randrange(keys)))
+            for i in xrange(samples)], samples
+
+def bench_head_back(repo, r, params):
+    depth, samples = params['depth'], params['samples']
+    deepen(repo, r, key_name(0), depth, params['value_size'])
+    return [timed(repo.head, key_name(0), back=r.randrange(depth))
+            for i in xrange(samples)], samples
+
+def bench_log(repo, r, params):
+    depth, size = params['depth'], params['value_size']
+    deepen(repo, r, key_name(0), depth, size)
+    walks = max(1, params['samples'] / depth)
+    latencies = []
+    for i in xrange(walks):
+        latencies.append(timed(lambda: sum(1 for c in repo.log(key_name(0)))))
+    return latencies, walks * (depth + 1)
+
+def bench_merge(repo, r, params):
+    keys, samples, size = params['keys'], params['samples'], params['value_size']
+    latencies = []
+    for i in xrange(min(samples, keys)):
+        source = key_name(i)
+        dest = 'merge%08d' % i
+        repo.checkout(source, dest)
+        value = repo.show(source)
+        value['source'] = i
+        repo.commit(source, value, time=TIME)
+        value = repo.show(dest)
+        value['dest'] = i
+        repo.commit(dest, value, time=TIME)
+        latencies.append(timed(repo.merge, dest, source))
+    return latencies, len(latencies)
+
+BENCHMARKS = {
+    'add': bench_add,
+    'commit': bench_commit,
+    'show': bench_show,
+    'staged': bench_staged,
+    'head_back': bench_head_back,
+    'log': bench_log,
+    'merge': bench_merge
+}
+
+def run_one(op, params, queue):
+    """Populate a fresh repo, run one benchmark, and report through queue.
+    """
+    path = tempfile.mkdtemp(prefix='jsongit-bench-')
+    try:
+        repo = jsongit.init(os.path.join(path, 'repo'))
+        r = random.Random(SEED)
+        start = curtime()
+        populate(repo, r, params['keys'], params['value_size'])
+        setup = curtime() - start
+        latencies, units = BENCHMARKS[op](repo, r, params)
+        result = summarize(latencies, units)
+        result.update(params)
+        result['op'] = op
+        result['setup_seconds'] = setup
+        result['peak_rss_kb'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+        queue.put(result)
+    except Exception as e:
+        queue.put({'op': op, 'error': repr(e)})
+        raise
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def wait_for(proc, queue, op, timeout=None):
+    """The result a benchmark process puts on queue, or an error if the
+    process dies without one or runs for longer than timeout seconds.
+    """
+    deadline = None if timeout is None else curtime() + timeout
+    while True:
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except Queue.Empty:
+            pass
+        if not proc.is_alive():
+            try:
+                return queue.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                return {'op': op,
+                        'error': 'exited with code %s' % proc.exitcode}
+        if deadline is not None and curtime() > deadline:
+            proc.terminate()
+            return {'op': op, 'error': 'timed out after %ss' % timeout}
+
+def run(ops, preset, timeout=None):
+    results = []
+    for op in ops:
+        for keys in preset['keys']:
+            # only history-walking benchmarks vary by depth
+            depths = preset['depths'] if op in ('head_back', 'log') else [None]
+            for depth in depths:
+                for value_size in preset['value_sizes']:
+                    values = keys + (depth or 0)
+                    if values * value_size > preset['max_bytes']:
+                        continue
+                    params = {'keys': keys, 'depth': depth,
+                              'value_size': value_size,
+                              'samples': preset['samples']}
+                    queue = multiprocessing.Queue()
+                    proc = multiprocessing.Process(target=run_one,
+                                                   args=(op, params, queue))
+                    proc.start()
+                    result = wait_for(proc, queue, op, timeout)
+                    proc.join()
+                    sys.stderr.write('%s\n' % json.dumps(result))
+                    results.append(result)
+    return results
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--preset', default='quick', choices=PRESETS.keys(),
+                      help='parameter grid to run: %s' % ', '.join(PRESETS))
+    parser.add_option('--ops', default=','.join(sorted(BENCHMARKS)),
+                      help='comma-separated benchmarks to run')
+    parser.add_option('--keys', help='comma-separated key counts')
+    parser.add_option('--depths', help='comma-separated history depths')
+    parser.add_option('--value-sizes', help='comma-separated value sizes')
+    parser.add_option('--samples', type='int', help='operations per run')
+    parser.add_option('--max-bytes', type='int',
+                      help='skip runs that would commit more bytes of values')
+    parser.add_option('--timeout', type='int',
+                      help='seconds to let each run take before stopping it')
+    parser.add_option('--output', help='write JSON results here')
+    options, args = parser.parse_args()
+
+    preset = dict(PRESETS[options.preset])
+    for name in ('keys', 'depths', 'value_sizes'):
+        override = getattr(options, name)
+        if override:
+            preset[name] = [int(v) for v in override.split(',')]
+    if options.samples:
+        preset['samples'] = options.samples
+    if options.max_bytes:
+        preset['max_bytes'] = options.max_bytes
+    ops = options.ops.split(',')
+    for op in ops:
+        if op not in BENCHMARKS:
+            parser.error('unknown benchmark %s' % op)
+
+    report = {
+        'jsongit': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'preset': preset,
+        'results': run(ops, preset, options.timeout)
+    }
+    out = open(options.output, 'w') if options.output else sys.stdout
+    json.dump(report, out, indent=2, sort_keys=True)
+    out.write('\n')
+
+if __name__ == '__main__':
+    main()
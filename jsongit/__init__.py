@@ -5,7 +5,9 @@ __author__ = 'John Krauss'
 __license__ = 'BSD'
 __copyright__ = 'Copyright 2012 John Krauss'
 
-from .api import init
+from .api import init, bulk_import
+from .sharding import ShardedRepository
+from .store import MemoryStore, SqliteStore
 from .utils import signature, global_config
 from .exceptions import (
     NotJsonError, InvalidKeyError, DifferentRepoError, NoGlobalSettingError,
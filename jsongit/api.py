@@ -8,6 +8,11 @@ import os
 import pygit2
 
 from .models import Repository
+from .sharding import ShardedRepository
+import heads
+import odb
+import sharding
+import store
 import utils
 
 def init(path=None, repo=None, **kwargs):
@@ -39,12 +44,75 @@ def init(path=None, repo=None, **kwargs):
         (optional) An alternate function to use when loading data.  Defaults
         to :func:`json.loads`.
     :type loads: func
+    :param on_metric:
+        (optional) Called as `on_metric(kind, name, value)` for every
+        counter increment and timing the repository records.  See
+        :class:`Stats <jsongit.metrics.Stats>`.
+    :type on_metric: func
+    :param gc_auto:
+        (optional) Run :func:`gc <jsongit.models.Repository.gc>` after a
+        commit once there are roughly this many loose objects.  Defaults to
+        None, which never collects automatically.
+    :type gc_auto: int
+    :param head_table:
+        (optional) Whether to keep a table of every key's head commit and
+        blob beside the repository, so that :func:`show
+        <jsongit.models.Repository.show>`, :func:`committed
+        <jsongit.models.Repository.committed>` and :func:`staged
+        <jsongit.models.Repository.staged>` skip resolving references,
+        commits and trees.  Once created, the table is used and maintained
+        whenever the repository is opened, and is rebuilt from the
+        references when it is read if the repo-level HEAD has moved since
+        it was last updated.  After a crash or changes to the references made outside
+        jsongit, call :func:`verify_heads
+        <jsongit.models.Repository.verify_heads>`.
+        Defaults to False.
+    :type head_table: boolean
+    :param defer_index:
+        (optional) Whether to keep what :func:`add
+        <jsongit.models.Repository.add>` stages in memory, writing the index
+        only on :func:`commit <jsongit.models.Repository.commit>` or
+        :func:`flush <jsongit.models.Repository.flush>`.  Other processes
+        do not see staged values until then.  Defaults to False.
+    :type defer_index: boolean
+    :param store:
+        (optional) A store to keep the repository's objects, references
+        and index in, instead of a git directory, such as a
+        :class:`SqliteStore <jsongit.store.SqliteStore>`.  Objects are
+        hashed exactly as git would, so histories are the same in any store.
+        No path or repo may be given.
+    :type store: :class:`SqliteStore <jsongit.store.SqliteStore>` or
+        :class:`MemoryStore <jsongit.store.MemoryStore>`
+    :param memory:
+        (optional) Whether to keep the repository in a :class:`MemoryStore
+        <jsongit.store.MemoryStore>`, where it lasts only as long as the
+        process.  Use :func:`persist <jsongit.models.Repository.persist>`
+        to save it to disk.  Defaults to False.
+    :type memory: boolean
+    :param shards:
+        (optional) Create a :class:`ShardedRepository
+        <jsongit.sharding.ShardedRepository>` with this many shards at path.
+        A path that already holds a sharded repository is opened as one
+        without this.
+    :type shards: int
 
     :returns: A repository reference
     :rtype: :class:`Repository <jsongit.models.Repository>`
     """
     if repo and path:
         raise TypeError("Cannot define repo and path")
+    backing = kwargs.pop('store', None)
+    if kwargs.pop('memory', False):
+        if backing is not None:
+            raise TypeError("Cannot define memory and store")
+        backing = store.MemoryStore()
+    if backing is not None:
+        if repo or path:
+            raise TypeError("Cannot define a store and repo or path")
+        repo = store.StoreRepository(backing)
+    shards = kwargs.pop('shards', None)
+    if path and (shards or os.path.isfile(os.path.join(path, sharding.MANIFEST))):
+        return _init_sharded(path, shards, kwargs)
     if path:
         if os.path.isdir(path):
             repo = pygit2.Repository(path)
@@ -55,4 +123,175 @@ def init(path=None, repo=None, **kwargs):
         raise TypeError("Missing repo or path")
     dumps = kwargs.pop('dumps', utils.import_json().dumps)
     loads = kwargs.pop('loads', utils.import_json().loads)
-    return Repository(repo, dumps, loads)
+    on_metric = kwargs.pop('on_metric', None)
+    gc_auto = kwargs.pop('gc_auto', None)
+    head_table = kwargs.pop('head_table', False)
+    defer_index = kwargs.pop('defer_index', False)
+    # a repository in a store has no git directory to keep the table in
+    head_table = None if isinstance(repo, store.StoreRepository) else \
+            heads.open_table(repo.path, head_table)
+    jsongit_repo = Repository(repo, dumps, loads, on_metric=on_metric,
+                              gc_auto=gc_auto, head_table=head_table,
+                              defer_index=defer_index)
+    jsongit_repo._sync_head_table()
+    return jsongit_repo
+
+def _init_sharded(path, shards, kwargs):
+    """Open or create the sharded repository at path, with each shard opened
+    by :func:`init` with kwargs.
+    """
+    if os.path.isfile(os.path.join(path, sharding.MANIFEST)):
+        manifest = sharding.read_manifest(path)
+        if shards and shards != len(manifest['shards']):
+            raise ValueError("%s has %s shards, not %s" % (
+                path, len(manifest['shards']), shards))
+    elif os.path.exists(path):
+        raise ValueError("%s exists and is not a sharded repository" % path)
+    else:
+        manifest = sharding.write_manifest(path, shards)
+    return ShardedRepository(path, [init(os.path.join(path, name), **dict(kwargs))
+                                    for name in manifest['shards']])
+
+def _parse_record(record):
+    """Normalize an import record to `(key, value, time, author)`.
+    """
+    if isinstance(record, basestring):
+        record = utils.import_json().loads(record)
+    if isinstance(record, dict):
+        return (record['key'], record['value'], record.get('time'),
+                record.get('author'))
+    record = tuple(record)
+    if not 2 <= len(record) <= 4:
+        raise ValueError("Import record must have 2 to 4 fields: %s" % (record,))
+    return record + (None,) * (4 - len(record))
+
+def bulk_import(repo, stream, message=''):
+    """Load many values at once, writing every object into a single pack and
+    every key reference with a single write of `packed-refs`.  This is much
+    faster than calling :func:`commit <jsongit.models.Repository.commit>`
+    for each record.
+
+    >>> records = ['{"key": "foo", "value": 1, "time": 1332438935}',
+    ...            '{"key": "foo", "value": 2, "time": 1332439935}',
+    ...            '{"key": "bar", "value": 3}']
+    >>> jsongit.bulk_import(repo, records)
+    {'records': 3, 'keys': 2, 'objects': 10}
+    >>> repo.show('foo', back=1)
+    1
+
+    Each record becomes a commit for its key, parented on the key's previous
+    commit, so several records for the same key become that key's history.
+    All the keys are then recorded in a single repo-level commit, and their
+    index entries are replaced with the imported values.  Secondary indexes
+    are updated once, at the end.
+
+    The import should not run concurrently with other writers to the
+    repository.  If a record cannot be imported, nothing is: the objects
+    written so far are discarded and no reference is changed.
+
+    :param repo: the repository to import into
+    :type repo: :class:`Repository <jsongit.models.Repository>`
+    :param stream:
+        An iterable of records.  Each record is either a line of JSON or an
+        already parsed object, and is a `[key, value, time, author]` list
+        (the last two are optional) or a dict with `key`, `value` and
+        optional `time` and `author` fields.  The time is in UTC seconds.
+        The author is a :class:`pygit2.Signature` or a dict with `name` and
+        `email`.  Without an author the repository's :func:`signature
+        <jsongit.models.Repository.signature>` is used.  A record's time
+        replaces the time of its author, whichever kind it is.
+    :type stream: iterable
+    :param message:
+        (optional) The message for every commit.  Defaults to ''.
+    :type message: string
+
+    :returns: the number of records, keys and objects imported
+    :rtype: dict
+    :raises:
+        :class:`NotJsonError <jsongit.NotJsonError>`
+        :class:`InvalidKeyError <jsongit.InvalidKeyError>`
+    """
+    git = repo._repo
+    writer = repo._object_writer()
+    head_ids = {}
+    blobs = {}
+    old_blobs = {}
+    records = 0
+    try:
+        for record in stream:
+            key, value, time, author = _parse_record(record)
+            ref = repo._key2ref(key) # throw InvalidKeyError
+            if isinstance(author, dict):
+                author = utils.signature(author['name'], author['email'], time)
+            elif author is None:
+                author = repo.signature(time)
+            elif time is not None:
+                author = utils.signature(author.name, author.email, time,
+                                         author.offset)
+            if key not in head_ids:
+                try:
+                    head_ids[key] = git.lookup_reference(ref).oid
+                    old_blobs[key] = git[head_ids[key]].tree[0].oid
+                except KeyError:
+                    head_ids[key] = old_blobs[key] = None
+
+            with repo._stats.timer('phase.odb_write'):
+                blob_id = writer.add(pygit2.GIT_OBJ_BLOB, repo._encode(value))
+                tree_id = writer.add(pygit2.GIT_OBJ_TREE, odb.tree_data(
+                    [(odb.BLOB_MODE, key, blob_id)]))
+                parents = [head_ids[key]] if head_ids[key] else []
+                head_ids[key] = writer.add(pygit2.GIT_OBJ_COMMIT,
+                                           odb.commit_data(tree_id, parents,
+                                                           author, author,
+                                                           message))
+            blobs[key] = blob_id
+            records += 1
+
+        # one repo-level commit covering everything imported
+        if blobs:
+            repo_head = repo._repo_head()
+            paths = dict((repo._key2path(key, write=True), blob_id)
+                         for key, blob_id in blobs.iteritems())
+            with repo._stats.timer('phase.tree_build'):
+                root_id = repo._update_tree(repo_head.tree.oid if repo_head
+                                            else None, paths, write=writer.add)
+                index_tree_id = repo._update_tree(git.index.write_tree(), paths,
+                                                  write=writer.add)
+            signature = repo.signature()
+            root_commit = writer.add(pygit2.GIT_OBJ_COMMIT, odb.commit_data(
+                root_id, [repo_head.oid] if repo_head else [], signature,
+                signature, message))
+    except:
+        writer.abort()
+        raise
+    writer.close()
+    if not blobs:
+        return {'records': 0, 'keys': 0, 'objects': 0}
+
+    with repo._stats.timer('phase.ref_update'):
+        if isinstance(git, store.StoreRepository):
+            for key, oid in head_ids.iteritems():
+                git.create_reference(repo._key2ref(key), oid)
+        else:
+            odb.update_packed_refs(git.path, dict(
+                (repo._key2ref(key), oid) for key, oid in head_ids.iteritems()))
+            # reopen so libgit2 sees the new pack and packed references
+            repo._reopen()
+            git = repo._repo
+        try:
+            git.lookup_reference(repo._head_target()).oid = root_commit
+        except KeyError:
+            git.create_reference(repo._head_target(), root_commit)
+    git.index.read_tree(index_tree_id)
+    repo._write_index(flush=True)
+    repo._record_heads(dict((key, (head_ids[key], blobs[key]))
+                            for key in head_ids))
+
+    changes = [(key, repo._blob_value(old_blobs[key]), repo._blob_value(blob_id))
+               for key, blob_id in blobs.iteritems()
+               if old_blobs[key] != blob_id] if repo._index_defs() else []
+    if changes:
+        repo._update_indexes(changes, repo.signature(), message)
+
+    repo._stats.count('import.records', records)
+    return {'records': records, 'keys': len(head_ids), 'objects': len(writer)}
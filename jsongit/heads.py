@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""
+jsongit.heads
+
+A :class:`HeadTable` keeps the head commit and blob of every key in a SQLite
+database beside the repository, so that reading a key's current value takes
+one lookup in the table and one blob read, instead of resolving its
+reference, commit and tree first.
+"""
+
+import os
+import sqlite3
+import threading
+
+#: The file, inside the git directory, holding the head table.
+FILENAME = 'jsongit-heads.sqlite'
+
+class HeadTable(object):
+    """A persistent table of keys to `(head commit oid, blob oid)`.  It is
+    kept up to date by the :class:`Repository <jsongit.models.Repository>`
+    that owns it, and records the repo-level HEAD it was last updated with,
+    so that a table left behind by another writer can be detected and
+    rebuilt from the references.  A crash between a key's reference update
+    and the repo-level commit, or references changed outside jsongit, leave
+    the repo-level HEAD where it was, so they are only caught by
+    :func:`verify_heads <jsongit.models.Repository.verify_heads>`.
+
+    :param path: the database file, which is created if it does not exist
+    :type path: string
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = str
+        with self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS heads ('
+                             'key TEXT PRIMARY KEY, commit_id BLOB NOT NULL, '
+                             'blob_id BLOB NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                             'name TEXT PRIMARY KEY, value TEXT)')
+
+    def get(self, key):
+        """The raw head commit and blob oids of key.
+
+        :returns: `(commit oid, blob oid)`, or None if key is not in the table
+        :rtype: tuple
+        """
+        with self._lock:
+            row = self._db.execute('SELECT commit_id, blob_id FROM heads '
+                                   'WHERE key = ?', (key,)).fetchone()
+        return None if row is None else (str(row[0]), str(row[1]))
+
+    def items(self):
+        """Every row of the table, in key order.
+
+        :returns: `(key, commit oid, blob oid)` tuples
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT key, commit_id, blob_id FROM heads '
+                                    'ORDER BY key').fetchall()
+        return [(key, str(commit_id), str(blob_id))
+                for key, commit_id, blob_id in rows]
+
+    @property
+    def repo_head(self):
+        """The hex of the repo-level HEAD as of the last update, or None.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta "
+                                   "WHERE name = 'repo_head'").fetchone()
+        return None if row is None else row[0]
+
+    def update(self, heads, removed=(), repo_head=None, replace=False):
+        """Change rows in a single transaction.
+
+        :param heads: a dict of keys to `(commit oid, blob oid)`
+        :type heads: dict
+        :param removed: (optional) keys to drop from the table
+        :type removed: iterable
+        :param repo_head: (optional) the hex of the repo-level HEAD to record
+        :type repo_head: string
+        :param replace:
+            (optional) Whether to drop every other row first.  Defaults to
+            False.
+        :type replace: boolean
+        """
+        with self._lock:
+            with self._db:
+                if replace:
+                    self._db.execute('DELETE FROM heads')
+                self._db.executemany('DELETE FROM heads WHERE key = ?',
+                                     ((key,) for key in removed))
+                self._db.executemany('INSERT OR REPLACE INTO heads VALUES (?, ?, ?)',
+                                     ((key, sqlite3.Binary(commit_id),
+                                       sqlite3.Binary(blob_id))
+                                      for key, (commit_id, blob_id)
+                                      in heads.iteritems()))
+                self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                 ('repo_head', repo_head))
+
+    def close(self):
+        """Close the database.
+        """
+        with self._lock:
+            self._db.close()
+
+def open_table(git_path, create=False):
+    """Open the head table of the repository at git_path.
+
+    :param create:
+        (optional) Whether to create the table if there is none.  Defaults
+        to False.
+    :type create: boolean
+
+    :returns: the table, or None if there is none and create is False
+    :rtype: :class:`HeadTable`
+    """
+    path = os.path.join(git_path, FILENAME)
+    if create or os.path.isfile(path):
+        return HeadTable(path)
+    return None
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+jsongit.metrics
+
+Counters and timing histograms kept by each
+:class:`Repository <jsongit.models.Repository>`.
+"""
+
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from time import time as curtime
+
+#: Upper bounds, in seconds, of the timing histogram buckets.  Anything slower
+#: than the last bound lands in a final overflow bucket.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+class Stats(object):
+    """Thread-safe counters and timing histograms.  Timings are recorded
+    both for public :class:`Repository <jsongit.models.Repository>` methods
+    (named `method.<name>`) and for the internal phases they are made of
+    (named `phase.<name>`):
+
+    * `serialize` -- running values through `dumps`
+    * `decode` -- running stored data through `loads`
+    * `odb_write` -- writing objects to the object database
+    * `tree_build` -- building trees, whether in the index or directly
+    * `index_flush` -- writing and re-reading the index file
+    * `ref_update` -- creating commits and moving references
+
+    :param callback:
+        (optional) Called as `callback(kind, name, value)` for every
+        observation, where kind is `'count'` or `'time'`.  Useful for
+        exporting to an external metrics system.
+    :type callback: func
+    """
+
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timers = {}
+
+    def count(self, name, n=1):
+        """Increment counter name by n.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+        if self._callback:
+            self._callback('count', name, n)
+
+    def record(self, name, seconds):
+        """Record a single timing, in seconds, for name.
+        """
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = {
+                    'count': 0, 'total': 0.0, 'max': 0.0,
+                    'buckets': [0] * (len(BUCKETS) + 1)}
+            timer['count'] += 1
+            timer['total'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            timer['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+        if self._callback:
+            self._callback('time', name, seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager recording how long its body takes under name.
+        Nothing is recorded if the body raises.
+        """
+        start = curtime()
+        yield
+        self.record(name, curtime() - start)
+
+    def snapshot(self, reset=False):
+        """A copy of the current counters and timers.
+
+        :param reset:
+            (optional) Whether to start counting afresh.  Fresh counters and
+            timers are swapped in under the same lock the copy is taken
+            under, so no observation is lost or counted twice.  Defaults to
+            False.
+        :type reset: boolean
+
+        :returns:
+            `{'counters': {name: count}, 'timers': {name: {'count', 'total',
+            'max', 'buckets'}}}`, where buckets is a list of
+            `(upper bound, count)` pairs and the final bound is `None`.
+        :rtype: dict
+        """
+        bounds = list(BUCKETS) + [None]
+        with self._lock:
+            counters, timers = self._counters, self._timers
+            if reset:
+                self._counters = {}
+                self._timers = {}
+            return {
+                'counters': dict(counters),
+                'timers': dict((name, {
+                    'count': t['count'],
+                    'total': t['total'],
+                    'max': t['max'],
+                    'buckets': zip(bounds, t['buckets'])
+                }) for name, t in timers.iteritems())
+            }
+
+    def reset(self):
+        """Discard all counters and timers.
+        """
+        with self._lock:
+            self._counters = {}
+            self._timers = {}
+
+def instrumented(meth):
+    """Decorator timing a :class:`Repository <jsongit.models.Repository>`
+    method as `method.<name>`.
+    """
+    name = 'method.%s' % meth.__name__
+
+    @functools.wraps(meth)
+    def wrapped(self, *args, **kwargs):
+        start = curtime()
+        retval = meth(self, *args, **kwargs)
+        self._stats.record(name, curtime() - start)
+        return retval
+    return wrapped
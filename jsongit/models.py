@@ -8,25 +8,83 @@ The meat of jsongit code, particularly the Repository, resides here.
 
 import pygit2
 # import collections
-# import functools
+import functools
+import errno
+import os
+import bisect
+import multiprocessing
+from hashlib import sha1
 import shutil
 import itertools
+from contextlib import contextmanager
+from binascii import hexlify, unhexlify
+from time import time as curtime, sleep
 
 from .exceptions import (
     NotJsonError, InvalidKeyError, DifferentRepoError, StagedDataError)
-from .wrappers import Commit, Diff, Conflict, Merge
+from .wrappers import Commit, Diff, Conflict, Merge, Change
+from .metrics import Stats, instrumented
 import constants
+import heads
+import odb
+import scan
+import store
 import utils
 
+#: How old, in seconds, an unreachable object must be before :func:`gc
+#: <Repository.gc>` prunes it by default.  Matches git's two weeks.
+PRUNE_GRACE = 14 * 24 * 60 * 60
+
+#: How many times a commit is retried onto a HEAD that other writers keep
+#: moving.
+HEAD_RETRIES = 100
+
+#: Every key is a reference under this namespace.
+REF_PREFIX = 'refs/heads/jsongit/'
+
+#: Every secondary index is a reference under this namespace.
+INDEX_PREFIX = 'refs/jsongit-indexes/'
+
+#: The configuration setting recording how keys are laid out in repo-level
+#: trees.
+LAYOUT_SETTING = 'jsongit.layout'
+
+#: The layout putting each key under two levels of hash prefix directories.
+FANOUT = 'fanout'
+
+def _transactional(meth):
+    """Decorator running a :class:`Repository` method in one transaction,
+    for a repository in a store that supports them.
+    """
+    @functools.wraps(meth)
+    def wrapped(self, *args, **kwargs):
+        with self._transaction():
+            return meth(self, *args, **kwargs)
+    return wrapped
+
 class Repository(object):
-    def __init__(self, repo, dumps, loads):
+    def __init__(self, repo, dumps, loads, on_metric=None, gc_auto=None,
+                 head_table=None, defer_index=False):
         self._repo = repo
-        self._global_name = utils.global_config('user.name')
-        self._global_email = utils.global_config('user.email')
+        self._stats = Stats(on_metric)
+        self._gc_auto = gc_auto
+        self._head_table = head_table # a heads.HeadTable, or None
+        self._unrecorded_head = None # hex of HEAD committed, not yet in table
+        self._defer_index = defer_index
+        self._index_dirty = False # whether there are changes to flush
+        self._index_stamp = None # of the index file when last read or written
+        self._time_index = {} # key -> (head oid, sorted times, oids)
+        self._index_paths = {} # secondary index _meta blob oid -> path
+        self._index_defs_cache = None # (odb.refs_stamp, defs), on disk
+        self._identity = None # resolved lazily, see signature
+        self._layout_name = None # resolved lazily, see _layout
+        self._last_signature = None
         self._dumps = dumps
         self._loads = loads
 
     def __eq__(self, other):
+        if self._repo.path is None:
+            return self._repo is other._repo
         return self._repo.path == other._repo.path
 
     def _key2ref(self, key):
@@ -41,22 +99,630 @@ class Repository(object):
         elif key[-1] == '.' or key[-1] == '/' or key[0] == '/' or key[0] == '.':
             raise InvalidKeyError("Key '%s' should not start or end in . or /" % key)
         else:
-            return 'refs/heads/jsongit/%s' % key
+            return REF_PREFIX + key
 
     def _navigate_tree(self, oid, path):
         """Find an OID inside a nested tree.
+
+        :raises:
+            KeyError if there is nothing at path, :class:`InvalidKeyError`
+            if part of path is not a directory.
         """
         steps = path.split('/')
         for step in steps:
-            oid = self._repo[oid][step].oid
+            tree = self._repo[oid]
+            if tree.type != pygit2.GIT_OBJ_TREE:
+                raise InvalidKeyError("'%s' is not a directory" % path)
+            oid = tree[step].oid
         return oid
 
+    def _update_tree(self, oid, changes, write=None):
+        """Write a new tree that is the tree at oid with changes applied.
+        Only the subtrees that changes touch are rewritten.
+
+        :param oid: the tree to start from, or None for an empty tree.
+        :param changes:
+            a dict mapping slash-separated paths to blob oids, or to None to
+            remove the path.
+        :param write:
+            (optional) the function to write objects with.  Defaults to
+            :func:`_write`.
+
+        :returns: the oid of the new tree, or None if it is empty.
+        :raises: :class:`InvalidKeyError` if a path overlaps another.
+        """
+        write = write or self._write
+        entries = {}
+        if oid is not None:
+            for mode, name, entry_oid in odb.parse_tree(self._repo[oid].read_raw()):
+                entries[name] = (mode, entry_oid)
+
+        nested = {}
+        for path, blob_id in changes.iteritems():
+            name, sep, rest = path.partition('/')
+            if sep:
+                nested.setdefault(name, {})[rest] = blob_id
+            elif blob_id is None:
+                entries.pop(name, None)
+            elif entries.get(name, (None,))[0] == odb.TREE_MODE:
+                raise InvalidKeyError("'%s' is a directory" % path)
+            else:
+                entries[name] = (odb.BLOB_MODE, blob_id)
+        for name, subchanges in nested.iteritems():
+            mode, sub_oid = entries.get(name, (odb.TREE_MODE, None))
+            if mode != odb.TREE_MODE:
+                raise InvalidKeyError("'%s' is not a directory" % name)
+            sub_oid = self._update_tree(sub_oid, subchanges, write)
+            if sub_oid is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = (odb.TREE_MODE, sub_oid)
+
+        if not entries:
+            return None
+        return write(pygit2.GIT_OBJ_TREE, odb.tree_data(
+            (mode, name, entry_oid) for name, (mode, entry_oid) in entries.iteritems()))
+
+    def _stage(self, path, blob_id):
+        """Put a blob at path in the index.  A store's index takes the single
+        entry, so no trees are written until commit.  pygit2 0.17 cannot add
+        an entry for a blob that is not in the working directory, so on
+        disk the index is still round-tripped through a tree.  Writing the
+        index file directly would not help: libgit2 0.17 only re-reads an
+        index whose mtime has moved by a whole second, so it would go on
+        committing what it last read.
+        """
+        index = self._repo.index
+        if isinstance(index, store.Index):
+            index.add(store.IndexEntry(path, blob_id))
+        else:
+            with self._stats.timer('phase.tree_build'):
+                tree_id = self._update_tree(index.write_tree(), {path: blob_id})
+            index.read_tree(tree_id)
+
+    def _tree_items(self, oid, prefix=None, path=''):
+        """Walk a nested tree in tree order, yielding `(path, blob oid)` for
+        every blob whose path starts with prefix.
+        """
+        for mode, name, entry_oid in odb.parse_tree(self._repo[oid].read_raw()):
+            entry_path = path + name
+            if mode == odb.TREE_MODE:
+                entry_path += '/'
+                if prefix is None or entry_path.startswith(prefix) or \
+                   prefix.startswith(entry_path):
+                    for item in self._tree_items(entry_oid, prefix, entry_path):
+                        yield item
+            elif prefix is None or entry_path.startswith(prefix):
+                yield entry_path, entry_oid
+
+    def _layout(self, write=False):
+        """How keys are laid out in repo-level trees.  New repositories use
+        :data:`FANOUT`, which is recorded in the configuration when the first
+        key is written, so that reading never writes.  Repositories that
+        already had keys without the setting keep every key at the root of
+        the tree.
+
+        :param write: (optional) Whether a key is about to be written.
+        :type write: boolean
+        """
+        if self._layout_name is None:
+            try:
+                self._layout_name = self._repo.config[LAYOUT_SETTING]
+            except KeyError:
+                if self._repo_head() is not None or len(self._repo.index):
+                    self._layout_name = 'flat'
+                elif not write:
+                    return FANOUT
+                else:
+                    self._repo.config[LAYOUT_SETTING] = FANOUT
+                    self._layout_name = FANOUT
+        return self._layout_name
+
+    def _key2path(self, key, write=False):
+        """The path of a key in a repo-level tree.  With the :data:`FANOUT`
+        layout, a key is put under directories named for the first two bytes
+        of its sha1, so that adding a key rewrites three small trees rather
+        than one holding every key.
+
+        >>> repo._key2path('foo')
+        '0b/ee/foo'
+
+        :param write: (optional) Whether a key is about to be written there.
+        :type write: boolean
+        """
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        if self._layout(write) != FANOUT:
+            return key
+        digest = sha1(key).hexdigest()
+        return '%s/%s/%s' % (digest[:2], digest[2:4], key)
+
+    def _path2key(self, path):
+        """The key stored at a path in a repo-level tree.
+        """
+        if self._layout() != FANOUT:
+            return path
+        return path[6:]
+
+    def _tree_keys(self, oid, prefix=None):
+        """Yield `(key, blob oid)` for every key starting with prefix in a
+        repo-level tree, in tree order.
+        """
+        if self._layout() != FANOUT:
+            return self._tree_items(oid, prefix)
+        items = ((self._path2key(path), blob_id) for path, blob_id
+                 in self._tree_items(oid))
+        return ((key, blob_id) for key, blob_id in items
+                if prefix is None or key.startswith(prefix))
+
+    def _diff_trees(self, old_id, new_id, path=''):
+        """Compare two trees by oid, without reading any blobs.  Subtrees with
+        the same oid are skipped entirely.
+
+        :returns:
+            a generator of `(path, old blob oid, new blob oid)` for every
+            blob that differs, where a missing blob is None.
+        """
+        if old_id == new_id:
+            return
+        old = dict((name, (mode, oid)) for mode, name, oid in
+                   odb.parse_tree(self._repo[old_id].read_raw())) if old_id else {}
+        new = dict((name, (mode, oid)) for mode, name, oid in
+                   odb.parse_tree(self._repo[new_id].read_raw())) if new_id else {}
+        for name in sorted(set(old) | set(new)):
+            old_mode, old_oid = old.get(name, (None, None))
+            new_mode, new_oid = new.get(name, (None, None))
+            if old_oid == new_oid:
+                continue
+            old_tree = old_oid if old_mode == odb.TREE_MODE else None
+            new_tree = new_oid if new_mode == odb.TREE_MODE else None
+            if old_tree or new_tree:
+                for change in self._diff_trees(old_tree, new_tree,
+                                               path + name + '/'):
+                    yield change
+            old_blob = None if old_tree else old_oid
+            new_blob = None if new_tree else new_oid
+            if old_blob or new_blob:
+                yield path + name, old_blob, new_blob
+
+    def _encode(self, value):
+        """Run a value through dumps.
+
+        :raises: :class:`NotJsonError <jsongit.NotJsonError>`
+        """
+        with self._stats.timer('phase.serialize'):
+            try:
+                return self._dumps(value)
+            except ValueError as e:
+                raise NotJsonError(e)
+            except TypeError as e:
+                raise NotJsonError(e)
+
+    def _decode(self, raw):
+        """Run stored data through loads.
+        """
+        with self._stats.timer('phase.decode'):
+            return self._loads(raw)
+
+    def _write(self, type, data):
+        """Write a raw object to the object database, returning its oid.
+        """
+        with self._stats.timer('phase.odb_write'):
+            return self._repo.write(type, data)
+
+    def _object_writer(self):
+        """Obtain a writer for many objects at once: a new pack, or a single
+        transaction for a repository in a store.
+        """
+        if isinstance(self._repo, store.StoreRepository):
+            return self._repo.writer()
+        return odb.PackWriter(odb.objects_dir(self._repo))
+
+    @contextmanager
+    def _transaction(self):
+        """Group the writes made in the body, for a repository in a store
+        that supports transactions.
+        """
+        if isinstance(self._repo, store.StoreRepository):
+            with self._repo.transaction():
+                yield
+        else:
+            yield
+
+    def _reopen(self):
+        """Reopen the underlying repository, so that libgit2 sees packs and
+        packed references written behind its back.
+        """
+        if not isinstance(self._repo, store.StoreRepository):
+            self.flush()
+            self._repo = pygit2.Repository(self._repo.path)
+            self._index_stamp = None
+
+    def _stat_index(self):
+        """The trailing SHA-1 checksum of the index file, which git computes
+        over its whole content, or None if there is no file to check.
+        """
+        if isinstance(self._repo, store.StoreRepository):
+            return None
+        try:
+            with open(os.path.join(self._repo.path, 'index'), 'rb') as f:
+                f.seek(-20, os.SEEK_END)
+                return f.read(20)
+        except (IOError, OSError):
+            return None
+
+    def _read_index(self):
+        """Re-read the index, unless it has changes that are not yet flushed,
+        or its file has the same checksum as when it was last read or
+        written.
+        """
+        if self._index_dirty:
+            return
+        stamp = self._stat_index()
+        if stamp is None or stamp != self._index_stamp:
+            with self._stats.timer('phase.index_flush'):
+                self._repo.index.read()
+            self._index_stamp = stamp
+
+    def _write_index(self, flush=False):
+        """Write the index, or with a deferred index only note that it needs
+        writing, unless flush is true.
+        """
+        if self._defer_index and not flush:
+            self._index_dirty = True
+            return
+        with self._stats.timer('phase.index_flush'):
+            self._repo.index.write()
+        self._index_dirty = False
+        self._index_stamp = self._stat_index()
+
     def _build_commit(self, pygit2_commit):
         #assert key in pygit2_commit.tree
-        key = pygit2_commit.tree[0].name
-        raw = self._repo[pygit2_commit.tree[0].oid].data
-        value = self._loads(raw)
-        return Commit(self, key, value, pygit2_commit)
+        entry = pygit2_commit.tree[0]
+        return Commit(self, entry.name, None, pygit2_commit, blob_id=entry.oid)
+
+    def _times(self, key):
+        """The time index for key: its commit times in ascending order and
+        the commit oids alongside them.  Built from the log the first time
+        it is needed, and kept up to date by :func:`commit`.
+        """
+        head_id = self._repo.lookup_reference(self._key2ref(key)).oid
+        cached = self._time_index.get(key)
+        if cached is not None and cached[0] == head_id:
+            return cached[1], cached[2]
+        order = constants.GIT_SORT_TOPOLOGICAL | constants.GIT_SORT_REVERSE
+        # a stable sort keeps later commits after earlier ones at equal times
+        history = sorted(((c.commit_time, c.oid) for c in
+                          self._repo.walk(head_id, order)), key=lambda t: t[0])
+        times = [t for t, oid in history]
+        oids = [oid for t, oid in history]
+        self._time_index[key] = (head_id, times, oids)
+        self._stats.count('time_index.builds')
+        return times, oids
+
+    def _index_time(self, key, parent_ids, commit_id, time):
+        """Add a new commit to key's time index, if the index is current.
+        Merges bring in history of their own, so they drop the index instead.
+        """
+        cached = self._time_index.get(key)
+        if cached is None:
+            return
+        if parent_ids != [cached[0]]:
+            del self._time_index[key]
+            return
+        head_id, times, oids = cached
+        idx = bisect.bisect_right(times, time)
+        times.insert(idx, time)
+        oids.insert(idx, commit_id)
+        self._time_index[key] = (commit_id, times, oids)
+
+    def _head_ids(self, key):
+        """The oids of the head commit of key and of the blob in it, from the
+        head table if there is one.
+
+        :returns: `(commit oid, blob oid)`, or None if key is not committed.
+        :raises: :class:`InvalidKeyError`
+        """
+        ref_name = self._key2ref(key)
+        if self._head_table is not None:
+            self._sync_head_table()
+            return self._head_table.get(key)
+        try:
+            oid = self._repo.lookup_reference(ref_name).oid
+        except KeyError:
+            return None
+        return oid, self._repo[oid].tree[0].oid
+
+    def _resolve_refs(self, keys):
+        """Find the head commit oids of many keys in one pass over the
+        references.  On disk, `packed-refs` is read once, and only loose
+        references are read one by one.
+
+        :returns: a dict of the committed keys to commit oids
+        :rtype: dict
+        :raises: :class:`InvalidKeyError`
+        """
+        names = {}
+        for key in keys:
+            name = self._key2ref(key)
+            names[key] = name.encode('utf-8') if isinstance(name, unicode) else name
+        oids = {}
+        if isinstance(self._repo, store.StoreRepository):
+            for key, name in names.iteritems():
+                try:
+                    oids[key] = self._repo.lookup_reference(name).oid
+                except KeyError:
+                    continue
+            return oids
+        packed = odb.read_packed_refs(self._repo.path)
+        for key, name in names.iteritems():
+            loose = os.path.join(self._repo.path, name)
+            if os.path.isfile(loose):
+                with open(loose) as f:
+                    hex = f.read(40)
+            else:
+                hex = packed.get(name)
+            if hex is not None:
+                oids[key] = unhexlify(hex)
+        return oids
+
+    def _head_ids_many(self, keys):
+        """Find :func:`_head_ids` for many keys, reading commits in oid
+        order.
+
+        :returns:
+            a dict of the committed keys to `(commit oid, blob oid)`
+        :rtype: dict
+        :raises: :class:`InvalidKeyError`
+        """
+        if self._head_table is None:
+            refs = sorted(self._resolve_refs(keys).iteritems(),
+                          key=lambda item: item[1])
+            return dict((key, (oid, self._repo[oid].tree[0].oid))
+                        for key, oid in refs)
+        self._sync_head_table()
+        head_ids = {}
+        for key in keys:
+            self._key2ref(key) # throw InvalidKeyError
+            ids = self._head_table.get(key)
+            if ids is not None:
+                head_ids[key] = ids
+        return head_ids
+
+    def _head_blob(self, key):
+        """The oid of the blob at the head of key, or None if key has not been
+        committed.
+        """
+        ids = self._head_ids(key)
+        return None if ids is None else ids[1]
+
+    def _sync_head_table(self):
+        """Rebuild the head table, if there is one, when the repo-level HEAD
+        has moved since it was last updated, other than by a commit of this
+        handle that is still being recorded.  This is checked before every
+        read of the table, at the cost of one reference lookup, so that
+        writes from handles that do not keep the table are seen.  Staleness
+        is only detected through the repo-level HEAD, so a table left behind
+        by a crash between a key's reference update and the repo-level
+        commit, or by references changed outside jsongit, needs
+        :func:`verify_heads`.
+        """
+        if self._head_table is None:
+            return
+        try:
+            repo_head = hexlify(
+                self._repo.lookup_reference(self._head_target()).oid)
+        except KeyError:
+            repo_head = None
+        if repo_head != self._head_table.repo_head and \
+           repo_head != self._unrecorded_head:
+            self.verify_heads(repair=True)
+
+    def _record_heads(self, head_ids, removed=()):
+        """Bring the head table, if there is one, up to date with new heads
+        and removed keys, in one transaction.
+
+        :param head_ids: a dict of keys to `(commit oid, blob oid)`
+        """
+        if self._head_table is None:
+            return
+        repo_head = self._repo_head()
+        self._head_table.update(head_ids, removed,
+                                repo_head.hex if repo_head else None)
+        self._unrecorded_head = None
+
+    def _blob_value(self, blob_id):
+        """Decode a blob, or return :const:`utils.MISSING` if blob_id is None.
+        """
+        if blob_id is None:
+            return utils.MISSING
+        return self._decode(self._repo[blob_id].data)
+
+    def _blobs_differ(self, old, new):
+        """Whether two blobs, either of which may be None, hold different
+        values.  The same blob never does.  Different blobs are decoded to be
+        sure, since dumps may encode equal values differently.
+        """
+        if old == new:
+            return False
+        if old is None or new is None:
+            return True
+        return self._blob_value(old) != self._blob_value(new)
+
+    def _ref_names(self, prefix):
+        """The names of the references under a prefix, listed without
+        walking every reference in the repository.
+        """
+        if isinstance(self._repo, store.StoreRepository):
+            return self._repo.ref_names(prefix)
+        return odb.ref_names(self._repo.path, prefix)
+
+    def _index_defs(self):
+        """The secondary indexes of this repository, as a dict of names to
+        paths.  Listed afresh on every call, so that indexes created or
+        dropped by another handle are seen; each definition is only decoded
+        once.  On disk they are only listed again once packed-refs or a loose
+        index reference has changed, since parsing packed-refs costs as much
+        as there are keys.
+        """
+        json = utils.import_json()
+        stamp = None
+        if not isinstance(self._repo, store.StoreRepository):
+            # taken before listing, so a change meanwhile is listed next time
+            stamp = odb.refs_stamp(self._repo.path, INDEX_PREFIX)
+            cached = self._index_defs_cache
+            if cached is not None and cached[0] == stamp:
+                return dict(cached[1])
+        defs = {}
+        for ref_name in self._ref_names(INDEX_PREFIX):
+            try:
+                commit = self._repo[self._repo.lookup_reference(ref_name).oid]
+            except KeyError:
+                continue # dropped since it was listed
+            meta_id = commit.tree['_meta'].oid
+            if meta_id not in self._index_paths:
+                self._index_paths[meta_id] = json.loads(
+                    self._repo[meta_id].data)['path']
+            defs[ref_name[len(INDEX_PREFIX):]] = self._index_paths[meta_id]
+        if stamp is not None:
+            self._index_defs_cache = stamp, dict(defs)
+        return defs
+
+    def _bucket(self, value, key=None):
+        """The path, inside a secondary index's tree, of the bucket of keys
+        for an indexed value.  A bucket is a tree of shards split by the hash
+        of the key, laid out like keys in the fanout layout, so that a write
+        only rewrites the few keys of one shard however many share the value.
+
+        :param key: (optional) the key whose shard to find, rather than the
+            whole bucket.
+        """
+        json = utils.import_json()
+        digest = sha1(json.dumps(value, sort_keys=True)).hexdigest()
+        path = '%s/%s' % (digest[:2], digest[2:])
+        if key is None:
+            return path
+        digest = sha1(key).hexdigest()
+        return '%s/%s/%s' % (path, digest[:2], digest[2:4])
+
+    def _update_indexes(self, changes, signature, message):
+        """Move keys between buckets of every secondary index, with one commit
+        per index that changed.
+
+        :param changes:
+            `(key, old value, new value)` tuples, where a value is
+            :const:`utils.MISSING` if the key did not or does not exist.
+        """
+        json = utils.import_json()
+        for name, path in self._index_defs().iteritems():
+            moves = {}
+            for key, old, new in changes:
+                old = utils.get_path(old, path)
+                new = utils.get_path(new, path)
+                # buckets, not values, are compared, since 1 == True but
+                # they are indexed apart
+                old_bucket = None if old is utils.MISSING else \
+                    self._bucket(old, key)
+                new_bucket = None if new is utils.MISSING else \
+                    self._bucket(new, key)
+                if old_bucket == new_bucket:
+                    continue
+                if old_bucket is not None:
+                    moves.setdefault(old_bucket, (old, set(), set()))[2].add(key)
+                if new_bucket is not None:
+                    moves.setdefault(new_bucket, (new, set(), set()))[1].add(key)
+            if not moves:
+                continue
+
+            ref_name = INDEX_PREFIX + name
+            index_commit = self._repo[self._repo.lookup_reference(ref_name).oid]
+            root_id = index_commit.tree.oid
+            blobs = {}
+            for bucket, (value, added, removed) in moves.iteritems():
+                try:
+                    raw = self._repo[self._navigate_tree(root_id, bucket)].data
+                    keys = set(json.loads(raw)['keys'])
+                except KeyError:
+                    keys = set()
+                keys = sorted((keys - removed) | added)
+                blobs[bucket] = self._write(pygit2.GIT_OBJ_BLOB, json.dumps(
+                    {'value': value, 'keys': keys})) if keys else None
+            with self._stats.timer('phase.ref_update'):
+                self._repo.create_commit(ref_name, signature, signature, message,
+                                         self._update_tree(root_id, blobs),
+                                         [index_commit.oid])
+            self._stats.count('index.updates')
+
+    def _advance_head(self, blobs, author, committer, message):
+        """Commit onto the repo-level HEAD a tree that is HEAD's with only
+        some paths changed.  HEAD is only moved if no other writer has moved
+        it since it was read; if one has, the tree is rebuilt on the new HEAD
+        and the commit retried, so that concurrent writers keep each other's
+        keys.
+
+        :param blobs:
+            a dict mapping paths to blob oids, or to None to remove the path.
+        :type blobs: dict
+
+        :returns:
+            the oid of the new tree, or None if there was no HEAD to remove
+            paths from.
+        :raises: :class:`pygit2.GitError` if HEAD kept moving.
+        """
+        ref_name = self._head_target()
+        for attempt in xrange(HEAD_RETRIES):
+            repo_head = self._repo_head()
+            if repo_head is None and not any(blobs.itervalues()):
+                return None
+            with self._stats.timer('phase.tree_build'):
+                tree_id = self._update_tree(repo_head.tree.oid if repo_head
+                                            else None, blobs)
+                if tree_id is None:
+                    tree_id = self._write(pygit2.GIT_OBJ_TREE, odb.tree_data([]))
+            parents = [repo_head.oid] if repo_head else []
+            with self._stats.timer('phase.ref_update'):
+                commit_id = self._write(pygit2.GIT_OBJ_COMMIT, odb.commit_data(
+                    tree_id, parents, author, committer, message))
+                try:
+                    self._swap_ref(ref_name, commit_id,
+                                   repo_head.oid if repo_head else None)
+                    self._unrecorded_head = hexlify(commit_id)
+                    return tree_id
+                except pygit2.GitError:
+                    pass # moved since it was read
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                    # locked by another writer
+            self._stats.count('head.retries')
+            sleep(0.001 * attempt)
+        raise pygit2.GitError("Reference '%s' kept moving" % ref_name)
+
+    def _swap_ref(self, name, oid, expected):
+        """Point a reference at oid, provided it still points at expected.
+
+        :param expected:
+            the raw oid the reference must point at, or None if it must not
+            exist yet.
+
+        :raises:
+            :class:`pygit2.GitError` if the reference has moved, OSError if
+            another writer holds its lock.
+        """
+        if not isinstance(self._repo, store.StoreRepository):
+            odb.update_ref(self._repo.path, name, oid, expected)
+            return
+        with self._transaction():
+            try:
+                ref = self._repo.lookup_reference(name)
+            except KeyError:
+                ref = None
+            if (None if ref is None else ref.oid) != expected:
+                raise pygit2.GitError("Reference '%s' has moved" % name)
+            if ref is None:
+                self._repo.create_reference(name, oid)
+            else:
+                ref.oid = oid
 
     def _head_target(self):
         return self._repo.lookup_reference('HEAD').target
@@ -67,6 +733,8 @@ class Repository(object):
         except KeyError:
             return None
 
+    @instrumented
+    @_transactional
     def add(self, key, value):
         """Add a value for a key to the working tree, staging it for commit.
 
@@ -76,6 +744,12 @@ class Repository(object):
         >>> repo.show('added')
         KeyError: 'There is no key at added'
 
+        In a repository kept in a store, staging writes a single index entry.
+        In a git directory, pygit2 cannot insert one entry, so every add
+        rewrites the whole index and costs as much as there are staged keys.
+        To write many keys there, use :func:`commit` with `direct`, or
+        :func:`bulk_import <jsongit.bulk_import>`, neither of which stages.
+
         :param key: The key to add
         :type key: string
         :param value: The value to insert
@@ -86,23 +760,94 @@ class Repository(object):
             :class:`InvalidKeyError <jsongit.InvalidKeyError>`
         """
         self._key2ref(key) # throw InvalidKeyError
-        try:
-            blob_id = self._repo.write(pygit2.GIT_OBJ_BLOB, self._dumps(value))
-        except ValueError as e:
-            raise NotJsonError(e)
-        except TypeError as e:
-            raise NotJsonError(e)
-
-        if key in self._repo.index:
-            del self._repo.index[key]
-        working_tree_id = self._repo.index.write_tree()
-        working_tree = self._repo[working_tree_id]
-        new_entry = b"100644 %s\x00%s" % (key, blob_id)
-        tree_data = working_tree.read_raw() + new_entry
-        working_tree_id = self._repo.write(pygit2.GIT_OBJ_TREE, tree_data)
-        self._repo.index.read_tree(working_tree_id)
-        self._repo.index.write()
+        blob_id = self._write(pygit2.GIT_OBJ_BLOB, self._encode(value))
+
+        self._stage(self._key2path(key, write=True), blob_id)
+        self._write_index()
+
+    def changes(self, since=None, until=None):
+        """Yield every change to a key recorded in the repo-level history,
+        oldest first.  Every :func:`commit` adds to this history, so it is an
+        ordered log of changes.  Changes are found by comparing the trees of
+        successive repo-level commits, without decoding any values.
+
+        >>> repo.commit('foo', 'bar')
+        >>> for change in repo.changes():
+        ...     print(change)
+        ...
+        'foo' 0000000000..ba0e162e1c@9a9a7d4c2e
+
+        :param since:
+            (optional) The hex of a repo-level commit; only changes after it
+            are yielded.  Defaults to the start of history.
+        :type since: string
+        :param until:
+            (optional) The hex of a repo-level commit; only changes up to and
+            including it are yielded.  Defaults to the current HEAD.
+        :type until: string
 
+        :returns:
+            a generator of :class:`Change <jsongit.wrappers.Change>`, which
+            unpacks as `(key, old blob hex, new blob hex, commit hex)`.
+        :rtype: generator
+        """
+        if until is None:
+            repo_head = self._repo_head()
+            if repo_head is None:
+                return
+            until = repo_head.hex
+        order = constants.GIT_SORT_TOPOLOGICAL | constants.GIT_SORT_REVERSE
+        walker = self._repo.walk(unhexlify(until), order)
+        if since is not None:
+            walker.hide(unhexlify(since))
+        for commit in walker:
+            parent_tree = commit.parents[0].tree.oid if commit.parents else None
+            for path, old, new in self._diff_trees(parent_tree, commit.tree.oid):
+                self._stats.count('changes.yielded')
+                yield Change(self._path2key(path), old and hexlify(old),
+                             new and hexlify(new), commit.hex)
+
+    def watch(self, since=None, interval=1.0, timeout=None):
+        """Block, yielding each change from :func:`changes` as the repo-level
+        HEAD moves.  The HEAD reference is polled, which costs one reference
+        lookup per poll no matter how many keys there are.
+
+        >>> for change in repo.watch():
+        ...     invalidate(change.key)
+
+        :param since:
+            (optional) The hex of the repo-level commit to watch from.
+            Defaults to the current HEAD, so that only new changes are
+            yielded.
+        :type since: string
+        :param interval:
+            (optional) Seconds between polls.  Defaults to 1.
+        :type interval: number
+        :param timeout:
+            (optional) Stop after this many seconds.  Defaults to None,
+            which watches forever.
+        :type timeout: number
+
+        :returns: a generator of :class:`Change <jsongit.wrappers.Change>`
+        :rtype: generator
+        """
+        if since is None:
+            repo_head = self._repo_head()
+            since = repo_head.hex if repo_head else None
+        deadline = None if timeout is None else curtime() + timeout
+        while deadline is None or curtime() < deadline:
+            repo_head = self._repo_head()
+            if repo_head is not None and repo_head.hex != since:
+                # up to the head seen, so that a commit landing meanwhile is
+                # yielded by the next poll, and only by it
+                for change in self.changes(since=since, until=repo_head.hex):
+                    yield change
+                since = repo_head.hex
+            else:
+                sleep(interval if deadline is None else
+                      max(0, min(interval, deadline - curtime())))
+
+    @instrumented
     def checkout(self, source, dest, **kwargs):
         """ Replace the HEAD reference for dest with a commit that points back
         to the value at source.
@@ -129,6 +874,8 @@ class Repository(object):
         commit = self.head(source)
         self.commit(dest, commit.data, message=message, parents=[commit])
 
+    @instrumented
+    @_transactional
     def commit(self, key=None, value=None, add=True, **kwargs):
         """Commit the index to the working tree.
 
@@ -157,8 +904,14 @@ class Repository(object):
         :type message: string
         :param author:
             (optional) The signature for the committer of the first commit.
-            Defaults to git's `--global` `author.name` and `author.email`.
+            Defaults to :func:`signature`, which uses git's configured
+            `user.name` and `user.email`.
         :type author: pygit2.Signature
+        :param time:
+            (optional) A fixed time, in UTC seconds, for the default author
+            signature.  Useful for reproducible bulk loads.  Ignored if an
+            author is given.
+        :type time: int
         :param committer:
             (optional) The signature for the committer of the first commit.
             Defaults to author.
@@ -167,54 +920,181 @@ class Repository(object):
             (optional) The parents of this commit.  Defaults to the last commit
             for this key if it already exists, or an empty list if not.
         :type parents: list of :class:`Commit <jsongit.wrappers.Commit>`
+        :param direct:
+            (optional) Whether to commit the key and value straight onto the
+            repo-level HEAD, without staging them.  The index is only written
+            if it already has an entry for key, which is replaced by value;
+            other staged keys are left staged.  This avoids contending for
+            the index between writers.  Defaults to False.
+        :type direct: boolean
+        :param skip_unchanged:
+            (optional) Whether to write nothing if value is exactly what is
+            already committed for key, as found by comparing blob oids.  Such
+            commits are counted as `commits.suppressed` in :func:`stats`.
+            Commits with explicit parents are never skipped.  Defaults to
+            direct.
+        :type skip_unchanged: boolean
 
         :raises:
             :class:`NotJsonError <jsongit.NotJsonError>`
             :class:`InvalidKeyError <jsongit.InvalidKeyError>`
+            TypeError if direct is true without a key and value.
         """
-        keys = [key] if key is not None else [e.path for e in self._repo.index]
+        keys = [key] if key is not None else [self._path2key(e.path)
+                                              for e in self._repo.index]
         message = kwargs.pop('message', '')
         parents = kwargs.pop('parents', None)
-        author = kwargs.pop('author', utils.signature(self._global_name,
-                                                      self._global_email))
+        time = kwargs.pop('time', None)
+        author = kwargs.pop('author', None) or self.signature(time)
         committer = kwargs.pop('committer', author)
+        direct = kwargs.pop('direct', False)
+        skip_unchanged = kwargs.pop('skip_unchanged', direct)
         if kwargs:
             raise TypeError("Unknown keyword args %s" % kwargs)
         if key is None and value is not None:
             raise InvalidKeyError()
+        if direct and (key is None or value is None):
+            raise TypeError("A direct commit needs a key and a value")
 
         if parents is not None:
             for parent in parents:
                 if parent.repo != self:
                     raise DifferentRepoError()
 
-        if add is True and key is not None and value is not None:
-            self.add(key, value)
-
-        repo_head = self._repo_head()
-        tree_id = self._repo.index.write_tree()
-        self._repo.create_commit(self._head_target(), author, committer,
-                                 message, tree_id,
-                                [repo_head.oid] if repo_head else [])
+        unchanged = False
+        if key is not None and value is not None and (direct or add is True):
+            self._key2ref(key) # throw InvalidKeyError
+            data = self._encode(value)
+            if skip_unchanged and parents is None:
+                blob_id = odb.hash_object(pygit2.GIT_OBJ_BLOB, data)
+                unchanged = blob_id == self._head_blob(key)
+            if not unchanged:
+                blob_id = self._write(pygit2.GIT_OBJ_BLOB, data)
+            path = self._key2path(key, write=True)
+            index = self._repo.index
+            if direct:
+                # only an existing entry is touched, so that it is not left
+                # behind to be committed over this value later
+                stage = path in index and index[path].oid != blob_id
+            else:
+                stage = not unchanged or path not in index or \
+                        index[path].oid != blob_id
+            if stage:
+                self._stage(path, blob_id)
+                self._write_index()
+        if not direct:
+            self.flush()
+        if unchanged:
+            self._stats.count('commits.suppressed')
+            return
+
+        # the repo-level tree is HEAD's with only the committed keys changed
+        if direct:
+            blobs = {self._key2path(key): blob_id}
+        else:
+            paths = [self._key2path(k) for k in keys]
+            blobs = dict((path, self._repo.index[path].oid) for path in paths)
+        tree_id = self._advance_head(blobs, author, committer, message)
 
+        indexed = bool(self._index_defs())
+        index_changes = []
+        new_heads = {}
         # TODO This will create some keys but not others if there is a bad key
+        try:
+            self._commit_keys(keys, tree_id, parents, author, committer,
+                              message, index_changes if indexed else None,
+                              new_heads)
+        finally:
+            self._record_heads(new_heads)
+        if index_changes:
+            self._update_indexes(index_changes, committer, message)
+
+        if self._gc_auto is not None and \
+           not isinstance(self._repo, store.StoreRepository) and \
+           odb.estimate_loose_objects(odb.objects_dir(self._repo)) > self._gc_auto:
+            self.gc()
+
+    def _commit_keys(self, keys, tree_id, parents, author, committer, message,
+                     index_changes, new_heads):
+        """Commit each key's entry in the tree at tree_id to its own history.
+        Changes for secondary indexes are appended to index_changes, unless it
+        is None, and each new head is put in new_heads.
+        """
         for key in keys:
             if parents is None:
-                parents = [self.head(key)] if self.committed(key) else []
+                key_parents = [self.head(key)] if self.committed(key) else []
+            else:
+                key_parents = parents
             try:
                 # create a single-entry tree for the commit.
-                blob_id = self._navigate_tree(tree_id, key)
+                blob_id = self._navigate_tree(tree_id, self._key2path(key))
                 key_tree_data = b"100644 %s\x00%s" % (key, blob_id)
-                key_tree_id = self._repo.write(pygit2.GIT_OBJ_TREE, key_tree_data)
-                self._repo.create_commit(self._key2ref(key), author,
-                                         committer, message, key_tree_id,
-                                         [parent.oid for parent in parents])
+                key_tree_id = self._write(pygit2.GIT_OBJ_TREE, key_tree_data)
+                parent_ids = [parent.oid for parent in key_parents]
+                if index_changes is not None:
+                    old_blob = self._head_blob(key)
+                    if old_blob != blob_id:
+                        index_changes.append((key, self._blob_value(old_blob),
+                                              self._blob_value(blob_id)))
+                with self._stats.timer('phase.ref_update'):
+                    commit_id = self._repo.create_commit(
+                        self._key2ref(key), author, committer, message,
+                        key_tree_id, parent_ids)
+                self._index_time(key, parent_ids, commit_id, committer.time)
+                new_heads[key] = (commit_id, blob_id)
             except pygit2.GitError as e:
                 if str(e).startswith('Failed to create reference'):
                     raise InvalidKeyError(e)
                 else:
                     raise e
 
+    @instrumented
+    @_transactional
+    def create_index(self, name, path):
+        """Declare a secondary index on a field of the values in this
+        repository, so that :func:`find` can look up keys by that field.  The
+        index is built from the current values, then kept up to date by
+        :func:`commit` and :func:`remove`.  It is stored in the repository,
+        with its own history, under `refs/jsongit-indexes/`.
+
+        >>> repo.commit('job1', {'status': 'failed'})
+        >>> repo.create_index('status', path='status')
+        >>> repo.find('status', 'failed')
+        ['job1']
+
+        :param name: the name of the index
+        :type name: string
+        :param path:
+            the field to index, with dots separating the steps into nested
+            dicts and lists, for example 'result.errors.0'.  Values without
+            the field are not indexed.
+        :type path: string
+
+        :raises:
+            :class:`InvalidKeyError <jsongit.InvalidKeyError>` if the name is
+            invalid, ValueError if there is already an index with the name.
+        """
+        self._key2ref(name) # throw InvalidKeyError
+        if name in self._index_defs():
+            raise ValueError("There is already an index named %s" % name)
+        json = utils.import_json()
+        buckets = {}
+        for key in self.keys():
+            value = utils.get_path(self._blob_value(self._head_blob(key)), path)
+            if value is not utils.MISSING:
+                buckets.setdefault(self._bucket(value, key),
+                                   (value, []))[1].append(key)
+        blobs = dict((bucket, self._write(pygit2.GIT_OBJ_BLOB, json.dumps(
+            {'value': value, 'keys': keys})))
+            for bucket, (value, keys) in buckets.iteritems())
+        blobs['_meta'] = self._write(pygit2.GIT_OBJ_BLOB,
+                                     json.dumps({'path': path}))
+        signature = self.signature()
+        self._repo.create_commit(INDEX_PREFIX + name, signature, signature,
+                                 "Create index %s on %s" % (name, path),
+                                 self._update_tree(None, blobs), [])
+
+    @instrumented
     def committed(self, key):
         """Determine whether there is a commit for a key.
 
@@ -230,11 +1110,7 @@ class Repository(object):
         :returns: whether there is a commit for the key.
         :rtype: boolean
         """
-        try:
-            self._repo.lookup_reference(self._key2ref(key))
-            return True
-        except KeyError:
-            return False
+        return self._head_ids(key) is not None
 
     def destroy(self):
         """Erase this Git repository entirely.  This will remove its directory.
@@ -245,10 +1121,319 @@ class Repository(object):
         >>> repo.commit('foo', 'bar')
         AttributeError: 'NoneType' object has no attribute 'write'
         """
-        shutil.rmtree(self._repo.path)
+        if self._head_table is not None:
+            self._head_table.close()
+        if isinstance(self._repo, store.StoreRepository):
+            self._repo.destroy()
+        else:
+            shutil.rmtree(self._repo.path)
         self._repo = None
 
-    def head(self, key, back=0):
+    @instrumented
+    def export(self, stream, at=None, prefix=None, raw=False):
+        """Write the value of every key to stream as lines of JSON, one key
+        at a time, so memory use does not grow with the size of the repo.
+
+        >>> repo.commit('foo', 'bar')
+        >>> repo.export(sys.stdout)
+        {"key": "foo", "value": "bar", "commit": "44e4b7a85ac2d2cd2ac1bf4e6e1e9ba8b4b5e1d3"}
+        1
+
+        By default this exports each key's head, in key order.  If `at` is
+        given, it exports the values recorded in that repo-level commit
+        instead, in tree order, and the `commit` field is the repo-level
+        commit.
+
+        :param stream: where to write
+        :type stream: file-like object
+        :param at:
+            (optional) The hex of a repo-level commit to export from.
+        :type at: string
+        :param prefix: (optional) Only export keys starting with prefix.
+        :type prefix: string
+        :param raw:
+            (optional) Whether to write values exactly as they are stored,
+            without decoding and re-encoding them.  Only valid if values are
+            dumped as JSON.  Defaults to False.
+        :type raw: boolean
+
+        :returns: the number of keys exported
+        :rtype: int
+        """
+        if at is None:
+            entries = self._head_entries(self.keys(prefix))
+        else:
+            commit = self._repo[unhexlify(at)]
+            entries = ((key, commit.oid, blob_id) for key, blob_id
+                       in self._tree_keys(commit.tree.oid, prefix))
+        return self._export_entries(stream, entries, raw)
+
+    def _head_entries(self, keys):
+        """Yield `(key, head commit oid, blob oid)` for keys.
+        """
+        for key in keys:
+            oid, blob_id = self._head_ids(key)
+            yield key, oid, blob_id
+
+    def _export_entries(self, stream, entries, raw):
+        """Write `(key, commit oid, blob oid)` entries as lines of JSON.
+        """
+        json = utils.import_json()
+        count = 0
+        for key, commit_id, blob_id in entries:
+            data = self._repo[blob_id].data
+            if not raw:
+                data = json.dumps(self._decode(data))
+            stream.write('{"key": %s, "value": %s, "commit": "%s"}\n' % (
+                json.dumps(key), data, hexlify(commit_id)))
+            count += 1
+        self._stats.count('export.keys', count)
+        return count
+
+    @instrumented
+    def export_history(self, stream, prefix=None, since=None):
+        """Write every version of every key to stream as lines of JSON.  Each
+        key's history is written oldest first: the first version in full,
+        and every later version as a diff against the one before it.
+
+        >>> repo.commit('foo', {'roses': 'red'})
+        >>> repo.commit('foo', {'roses': 'red', 'violets': 'blue'})
+        >>> watermarks = repo.export_history(sys.stdout)
+        {"key": "foo", "commit": "5d55214e4f...", "time": 1332438935, "value": {"roses": "red"}}
+        {"key": "foo", "commit": "dbde44bada...", "time": 1332438936, "diff": {"_append": {"violets": "blue"}}}
+
+        A line with a `diff` can be applied to the previous value with
+        :func:`DiffWrapper.apply <jsongit.wrappers.DiffWrapper.apply>`.  An
+        empty diff means the value did not change, and is written without
+        decoding anything.
+
+        The export can be resumed by passing the watermarks returned by an
+        earlier export as `since`; only versions after the watermark are
+        written, the first of them as a diff against the watermark.
+
+        :param stream: where to write
+        :type stream: file-like object
+        :param prefix: (optional) Only export keys starting with prefix.
+        :type prefix: string
+        :param since:
+            (optional) A dict of keys to the hex of the last commit already
+            exported for them.
+        :type since: dict
+
+        :returns: a dict of keys to the hex of the last commit exported.
+        :rtype: dict
+        """
+        json = utils.import_json()
+        since = since or {}
+        watermarks = {}
+        order = constants.GIT_SORT_TOPOLOGICAL | constants.GIT_SORT_REVERSE
+        for key in self.keys(prefix):
+            head_id = self._repo.lookup_reference(self._key2ref(key)).oid
+            commits = self._repo.walk(head_id, order)
+            prev_blob, prev_value = None, None
+            watermark = since.get(key)
+            if watermark is not None:
+                if hexlify(head_id) == watermark:
+                    watermarks[key] = watermark
+                    continue
+                history = list(commits)
+                hexes = [c.hex for c in history]
+                if watermark in hexes:
+                    start = hexes.index(watermark)
+                    prev_blob = history[start].tree[0].oid
+                    history = history[start + 1:]
+                commits = iter(history)
+
+            for c in commits:
+                blob_id = c.tree[0].oid
+                line = {'key': key, 'commit': c.hex, 'time': c.commit_time}
+                if blob_id == prev_blob:
+                    line['diff'] = {}
+                else:
+                    value = self._decode(self._repo[blob_id].data)
+                    if prev_blob is not None and prev_value is None:
+                        prev_value = self._decode(self._repo[prev_blob].data)
+                    if prev_blob is None:
+                        line['value'] = value
+                    else:
+                        diff = Diff(prev_value, value).to_json_diff()
+                        if Diff.is_json_diff(diff):
+                            line['diff'] = diff
+                        elif value == prev_value:
+                            line['diff'] = {}
+                        else:
+                            line['value'] = value
+                    prev_blob, prev_value = blob_id, value
+                stream.write(json.dumps(line) + '\n')
+                watermarks[key] = c.hex
+                self._stats.count('export.versions')
+        return watermarks
+
+    @instrumented
+    def find(self, index, value):
+        """Find the keys whose indexed field has a value.
+
+        >>> repo.create_index('status', path='status')
+        >>> repo.commit('job1', {'status': 'failed'})
+        >>> repo.commit('job2', {'status': 'ok'})
+        >>> repo.find('status', 'failed')
+        ['job1']
+
+        :param index: the name of an index made by :func:`create_index`
+        :type index: string
+        :param value: the value to look for
+
+        :returns: the matching keys, sorted
+        :rtype: list
+        :raises: KeyError if there is no such index
+        """
+        if index not in self._index_defs():
+            raise KeyError("There is no index named %s" % index)
+        commit = self._repo[self._repo.lookup_reference(INDEX_PREFIX + index).oid]
+        try:
+            trees = [self._navigate_tree(commit.tree.oid, self._bucket(value))]
+        except KeyError:
+            return []
+        json = utils.import_json()
+        keys = []
+        while trees:
+            tree = self._repo[trees.pop()]
+            for mode, name, oid in odb.parse_tree(tree.read_raw()):
+                if mode == odb.TREE_MODE:
+                    trees.append(oid)
+                else:
+                    keys.extend(json.loads(self._repo[oid].data)['keys'])
+        return sorted(keys)
+
+    def _reachable(self):
+        """Find the raw oids of every object reachable from a reference or
+        the index.
+        """
+        roots = [e.oid for e in self._repo.index]
+        for name in self._repo.listall_references():
+            try:
+                roots.append(self._repo.lookup_reference(name).resolve().oid)
+            except KeyError:
+                continue # a symbolic reference to nothing yet
+        seen = set()
+        while roots:
+            oid = roots.pop()
+            if oid in seen:
+                continue
+            seen.add(oid)
+            obj = self._repo[oid]
+            if obj.type == pygit2.GIT_OBJ_COMMIT:
+                roots.append(obj.tree.oid)
+                roots.extend(parent.oid for parent in obj.parents)
+            elif obj.type == pygit2.GIT_OBJ_TREE:
+                for mode, name, entry_oid in odb.parse_tree(obj.read_raw()):
+                    if mode == odb.TREE_MODE:
+                        roots.append(entry_oid)
+                    else:
+                        seen.add(entry_oid) # blobs need not be loaded
+        return seen
+
+    @instrumented
+    def flush(self):
+        """Write changes staged in a deferred index to disk.  A repository
+        opened with `defer_index` keeps what :func:`add` stages in memory
+        until the next :func:`commit` or flush, so that many adds cost one
+        index write.  Other repositories write the index on every add, and
+        flushing them does nothing.
+
+        >>> repo = jsongit.init('path/to/repo', defer_index=True)
+        >>> repo.add('foo', 'bar')
+        >>> repo.flush()
+        """
+        if self._index_dirty:
+            self._write_index(flush=True)
+
+    @instrumented
+    def gc(self, prune_older_than=PRUNE_GRACE, repack=True):
+        """Pack loose objects and prune unreachable ones, such as the history
+        of removed keys and the intermediate trees left behind by
+        :func:`add`.
+
+        >>> repo.remove('foo')
+        >>> repo.gc(prune_older_than=0)
+        {'packed': 12, 'pruned': 3, 'reclaimed_bytes': 1733}
+
+        Unreachable objects younger than `prune_older_than` are left alone,
+        so that objects written by a concurrent writer that are not yet
+        referenced are not pruned out from under it.
+
+        The underlying :class:`pygit2.Repository` is reopened afterwards so
+        that it sees the new pack.  A repository in a store has nothing to
+        pack, and the age of its objects is when they were last written.
+
+        :param prune_older_than:
+            (optional) Minimum age, in seconds, of an unreachable loose object
+            before it is pruned.  Defaults to two weeks.
+        :type prune_older_than: number
+        :param repack:
+            (optional) Whether to move reachable loose objects into a new
+            pack.  Defaults to True.
+        :type repack: boolean
+
+        :returns:
+            the number of objects packed and pruned, and the bytes
+            reclaimed on disk.
+        :rtype: dict
+        """
+        reachable = self._reachable()
+        if isinstance(self._repo, store.StoreRepository):
+            pruned, reclaimed = self._repo.prune(reachable, prune_older_than)
+            self._stats.count('gc.pruned', pruned)
+            return {'packed': 0, 'pruned': pruned, 'reclaimed_bytes': reclaimed}
+
+        path = odb.objects_dir(self._repo)
+        writer = odb.PackWriter(path) if repack else None
+        now = curtime()
+        packed, pruned, doomed = 0, 0, []
+        for hex, file_path in odb.loose_objects(path):
+            if unhexlify(hex) in reachable:
+                if writer is not None:
+                    writer.add(*odb.read_loose(file_path))
+                    packed += 1
+                    doomed.append(file_path)
+            elif now - os.path.getmtime(file_path) >= prune_older_than:
+                pruned += 1
+                doomed.append(file_path)
+
+        # loose copies may only go once the pack holding them is in place
+        reclaimed = 0
+        if writer is not None:
+            writer.close()
+            reclaimed -= writer.size
+        for file_path in doomed:
+            reclaimed += os.path.getsize(file_path)
+            os.remove(file_path)
+            try:
+                os.rmdir(os.path.dirname(file_path))
+            except OSError:
+                pass # fanout directory still has objects
+
+        self._stats.count('gc.packed', packed)
+        self._stats.count('gc.pruned', pruned)
+        self._reopen()
+        return {'packed': packed, 'pruned': pruned,
+                'reclaimed_bytes': reclaimed}
+
+    @instrumented
+    def drop_index(self, name):
+        """Remove a secondary index made by :func:`create_index`.
+
+        :param name: the name of the index
+        :type name: string
+
+        :raises: KeyError if there is no such index
+        """
+        if name not in self._index_defs():
+            raise KeyError("There is no index named %s" % name)
+        self._repo.lookup_reference(INDEX_PREFIX + name).delete()
+
+    @instrumented
+    def head(self, key, back=0, at=None):
         """Get the head commit for a key.
 
         >>> repo.commit('foo', 'bar', message="leveraging fu")
@@ -260,19 +1445,43 @@ class Repository(object):
         >>> commit.time
         1332438935L
 
+        Or the commit that was the head at a certain time:
+
+        >>> repo.head('foo', at=datetime.datetime(2012, 3, 22, 14, 0)).time
+        1332438935L
+
         :param key: The key to look up.
         :type key: string
         :param back:
             (optional) How many steps back from head to get the commit.
             Defaults to 0 (the current head).
         :type back: integer
-
-        :returns: the data
-        :rtype: int, float, NoneType, unicode, boolean, list, or dict
+        :param at:
+            (optional) Get the latest commit at or before this time, instead
+            of counting back.  Found by binary search over an index of commit
+            times that is built for the key on first use.
+        :type at: :class:`datetime.datetime` or UTC seconds
+
+        :returns: the commit
+        :rtype: :class:`Commit <jsongit.wrappers.Commit>`
         :raises:
             KeyError if there is no entry for key, IndexError if too many steps
-            back are specified.
+            back are specified or there was no commit by the time.
         """
+        if at is not None:
+            try:
+                times, oids = self._times(key)
+            except KeyError:
+                raise KeyError("There is no key at %s" % key)
+            idx = bisect.bisect_right(times, utils.to_epoch(at)) - 1
+            if idx < 0:
+                raise IndexError("%s has no commits as of %s" % (key, at))
+            return self._build_commit(self._repo[oids[idx]])
+        if back == 0:
+            ids = self._head_ids(key)
+            if ids is None:
+                raise KeyError("There is no key at %s" % key)
+            return Commit(self, key, None, self._repo[ids[0]], blob_id=ids[1])
         try:
             return itertools.islice(self.log(key), back, back + 1).next()
         except KeyError:
@@ -280,6 +1489,29 @@ class Repository(object):
         except StopIteration:
             raise IndexError("%s has fewer than %s commits" % (key, back))
 
+    @instrumented
+    def head_many(self, keys):
+        """Get the head commits for many keys at once.  References are
+        resolved in one pass, rather than key by key as with :func:`head`.
+
+        >>> repo.commit('foo', 'bar')
+        >>> repo.head_many(['foo', 'missing'])
+        {'foo': <jsongit.wrappers.Commit object at 0x10a8c4e50>}
+
+        :param keys: The keys to look up.
+        :type keys: list of strings
+
+        :returns:
+            a dict of keys to commits.  Keys that have not been committed are
+            left out, rather than raising KeyError.
+        :rtype: dict
+        """
+        return dict((key, Commit(self, key, None, self._repo[commit_id],
+                                 blob_id=blob_id))
+                    for key, (commit_id, blob_id)
+                    in self._head_ids_many(keys).iteritems())
+
+    @instrumented
     def index(self, key):
         """Pull the current data for key from the index.
 
@@ -293,10 +1525,30 @@ class Repository(object):
         :returns: a value
         :rtype: None, unicode, float, int, dict, list, or boolean
         """
-        self._repo.index.read()
-        raw = self._repo[self._repo.index[key].oid].data
-        return self._loads(raw)
+        self._read_index()
+        raw = self._repo[self._repo.index[self._key2path(key)].oid].data
+        return self._decode(raw)
 
+    def keys(self, prefix=None):
+        """List the keys that have been committed, in sorted order.
+
+        >>> repo.commit('foo', 'bar')
+        >>> repo.commit('path/to', 'baz')
+        >>> repo.keys()
+        ['foo', 'path/to']
+
+        :param prefix: (optional) Only list keys starting with prefix.
+        :type prefix: string
+
+        :returns: the keys
+        :rtype: list
+        """
+        start = REF_PREFIX + (prefix or '')
+        return sorted(name[len(REF_PREFIX):]
+                      for name in self._repo.listall_references()
+                      if name.startswith(start))
+
+    @instrumented
     def merge(self, dest, key=None, commit=None, **kwargs):
         """Try to merge two commits together.
 
@@ -330,12 +1582,23 @@ class Repository(object):
 
         :returns: The results of the merge operation
         :rtype: :class:`Merge <jsongit.wrappers.Merge>`
+        :raises:
+            ValueError if neither key nor commit is given, or if the source
+            is a commit of dest.
         """
+        if key is None and commit is None:
+            raise ValueError('Either a key or a commit must be given')
         if commit is None:
             commit = self.head(key)
         if commit.key == dest:
             raise ValueError('Cannot merge a key with itself')
+        return self._merge_commit(dest, commit, **kwargs)
 
+    def _merge_commit(self, dest, commit, **kwargs):
+        """Merge commit into dest, as :func:`merge` does, even if commit is
+        one of dest's own, as when pulling another repository's head of the
+        same key.
+        """
         dest_head = self.head(dest)
         # No difference
         if commit.oid == dest_head.oid:
@@ -406,8 +1669,230 @@ class Repository(object):
         elif commit is None:
             c = self._repo[self._repo.lookup_reference(self._key2ref(key)).oid]
             commit = self._build_commit(c)
-        return (self._build_commit(c) for c in self._repo.walk(commit.oid, order))
+        return (self._walked(c) for c in self._repo.walk(commit.oid, order))
 
+    def _walked(self, pygit2_commit):
+        self._stats.count('walk.commits')
+        return self._build_commit(pygit2_commit)
+
+    def _copy_objects(self, other, oid, writer, type=pygit2.GIT_OBJ_COMMIT):
+        """Copy the commit (or object of another type) at oid, and everything
+        it refers to that other does not already have, from this repository
+        into writer.  Anything other has is assumed to come with its whole
+        history, as in git.
+        """
+        stack = [(oid, type)]
+        while stack:
+            oid, type = stack.pop()
+            if oid in writer or oid in other._repo:
+                continue
+            if type == pygit2.GIT_OBJ_BLOB:
+                writer.add(type, self._repo[oid].data)
+                continue
+            obj = self._repo[oid]
+            writer.add(type, obj.read_raw())
+            if type == pygit2.GIT_OBJ_COMMIT:
+                stack.append((obj.tree.oid, pygit2.GIT_OBJ_TREE))
+                stack.extend((parent.oid, pygit2.GIT_OBJ_COMMIT)
+                             for parent in obj.parents)
+            else:
+                stack.extend((entry_oid, pygit2.GIT_OBJ_TREE if mode == odb.TREE_MODE
+                              else pygit2.GIT_OBJ_BLOB)
+                             for mode, name, entry_oid in odb.parse_tree(obj.read_raw()))
+
+    def _descends(self, oid, ancestor):
+        """Whether the commit at oid has ancestor in its history.
+        """
+        return any(c.oid == ancestor for c in self._repo.walk(oid, constants.GIT_SORT_NONE))
+
+    @_transactional
+    def _set_heads(self, commit_ids, message):
+        """Point keys at new head commits that are already in the repository,
+        recording their values in the index and in one repo-level commit.
+
+        :param commit_ids: a dict of keys to commit oids
+        """
+        signature = self.signature()
+        blobs = {}
+        changes = []
+        new_heads = {}
+        for key, oid in commit_ids.iteritems():
+            blobs[key] = self._repo[oid].tree[0].oid
+            if self._index_defs():
+                changes.append((key, self._blob_value(self._head_blob(key)),
+                                self._blob_value(blobs[key])))
+            with self._stats.timer('phase.ref_update'):
+                try:
+                    self._repo.lookup_reference(self._key2ref(key)).oid = oid
+                except KeyError:
+                    self._repo.create_reference(self._key2ref(key), oid)
+            self._time_index.pop(key, None)
+            new_heads[key] = (oid, blobs[key])
+
+        paths = dict((self._key2path(key, write=True), blob_id)
+                     for key, blob_id in blobs.iteritems())
+        with self._stats.timer('phase.tree_build'):
+            index_tree_id = self._update_tree(self._repo.index.write_tree(),
+                                              paths)
+        self._repo.index.read_tree(index_tree_id)
+        self._write_index(flush=True)
+        self._advance_head(paths, signature, signature, message)
+        self._record_heads(new_heads)
+        if changes:
+            self._update_indexes(changes, signature, message)
+
+    def _transfer(self, other, keys):
+        """Bring other up to date with this repository's heads for keys.
+        """
+        writer = other._object_writer()
+        wanted = {}
+        try:
+            for key in keys:
+                head_id = self._repo.lookup_reference(self._key2ref(key)).oid
+                other_id = other._repo_ref_oid(key)
+                if head_id != other_id:
+                    self._copy_objects(other, head_id, writer)
+                    wanted[key] = (head_id, other_id)
+        finally:
+            writer.close()
+        self._stats.count('transfer.objects', len(writer))
+        # reopen so libgit2 sees the new pack
+        other._reopen()
+
+        results = dict((key, 'up-to-date') for key in keys if key not in wanted)
+        fast_forward = {}
+        for key, (head_id, other_id) in wanted.iteritems():
+            if other_id is None:
+                fast_forward[key] = head_id
+                results[key] = 'created'
+            elif other._descends(head_id, other_id):
+                fast_forward[key] = head_id
+                results[key] = 'fast-forward'
+            elif other._descends(other_id, head_id):
+                results[key] = 'ahead'
+        if fast_forward:
+            other._set_heads(fast_forward, "Replicate %s keys from %s" % (
+                len(fast_forward), self._repo.path))
+
+        for key, (head_id, other_id) in wanted.iteritems():
+            if key not in results:
+                merge = other._merge_commit(key, other._build_commit(
+                    other._repo[head_id]))
+                results[key] = 'merged' if merge.success else 'conflict'
+        return results
+
+    def _repo_ref_oid(self, key):
+        """The oid of key's head commit, or None if key is not committed.
+        """
+        ids = self._head_ids(key)
+        return None if ids is None else ids[0]
+
+    def _open_other(self, other):
+        if isinstance(other, Repository):
+            return other
+        git = pygit2.Repository(other)
+        other = Repository(git, self._dumps, self._loads,
+                           head_table=heads.open_table(git.path))
+        other._sync_head_table()
+        return other
+
+    @instrumented
+    def persist(self, path):
+        """Save a copy of this repository as a new bare repository on disk,
+        with every object reachable from a reference or the index written
+        into a single pack, and every reference into `packed-refs`.  This is
+        how a repository made with `memory=True` is kept.
+
+        >>> repo = jsongit.init(memory=True)
+        >>> repo.commit('foo', 'bar')
+        >>> repo.persist('path/to/repo')
+        {'objects': 3, 'refs': 2}
+        >>> jsongit.init('path/to/repo').show('foo')
+        u'bar'
+
+        :param path: where to create the new repository
+        :type path: string
+
+        :returns: the number of objects and references saved
+        :rtype: dict
+        :raises: ValueError if path exists
+        """
+        if os.path.exists(path):
+            raise ValueError("%s already exists" % path)
+        target = Repository(pygit2.init_repository(path, True), self._dumps,
+                            self._loads)
+        target._repo.config[LAYOUT_SETTING] = self._layout()
+        writer = target._object_writer()
+        refs = {}
+        try:
+            for name in self._repo.listall_references():
+                try:
+                    refs[name] = self._repo.lookup_reference(name).resolve().oid
+                except KeyError:
+                    continue # a symbolic reference to nothing yet
+                self._copy_objects(target, refs[name], writer)
+            index_tree = self._repo.index.write_tree()
+            self._copy_objects(target, index_tree, writer, pygit2.GIT_OBJ_TREE)
+        finally:
+            writer.close()
+        odb.update_packed_refs(target._repo.path, refs)
+        target._reopen()
+        target._repo.index.read_tree(index_tree)
+        target._repo.index.write()
+        return {'objects': len(writer), 'refs': len(refs)}
+
+    @instrumented
+    def pull(self, other, keys=None):
+        """Bring this repository up to date with the keys of another.  See
+        :func:`push`, which this is the mirror of.
+
+        >>> replica.pull('path/to/primary')
+        {u'foo': 'fast-forward', u'bar': 'up-to-date'}
+
+        :param other: the repository to pull from, or its path
+        :type other: :class:`Repository` or string
+        :param keys: (optional) The keys to pull.  Defaults to all of them.
+        :type keys: list
+
+        :returns: a dict of keys to what happened to them
+        :rtype: dict
+        """
+        other = self._open_other(other)
+        return other._transfer(self, other.keys() if keys is None else keys)
+
+    @instrumented
+    def push(self, other, keys=None):
+        """Bring another repository up to date with the keys of this one.
+        Only the commits, trees and blobs the other repository is missing are
+        copied, into a single pack.  Then, for each key:
+
+        * `'created'` -- the key was new to the other repository.
+        * `'fast-forward'` -- the other repository's head was in this one's
+          history, so it was moved forward.
+        * `'up-to-date'` or `'ahead'` -- the other repository already had
+          this head, or a later one.
+        * `'merged'` or `'conflict'` -- the histories had diverged, so this
+          head was merged in with :func:`merge`, which may have failed.
+
+        Created and fast-forwarded keys are recorded in one repo-level commit
+        in the other repository.
+
+        >>> primary.push('path/to/replica')
+        {u'foo': 'fast-forward', u'bar': 'up-to-date'}
+
+        :param other: the repository to push to, or its path
+        :type other: :class:`Repository` or string
+        :param keys: (optional) The keys to push.  Defaults to all of them.
+        :type keys: list
+
+        :returns: a dict of keys to what happened to them
+        :rtype: dict
+        """
+        return self._transfer(self._open_other(other),
+                              self.keys() if keys is None else keys)
+
+    @instrumented
+    @_transactional
     def remove(self, key, force=False):
         """Remove the head reference to this key, so that it is no longer
         visible in the repo.  Prior commits and blobs remain in the repo, but
@@ -428,14 +1913,105 @@ class Repository(object):
             is true, the index entry will be removed as well.
         :type force: boolean
 
-        :raises: :class:`StagedDataError jsongit.StagedDataError`
+        :raises:
+            :class:`StagedDataError jsongit.StagedDataError`, KeyError if
+            key is not committed.
         """
-        if force is True or self.staged(key) is False:
-            del self._repo.index[key]
-        elif force is False and self.staged(key):
-            raise StagedDataError("There is data staged for %s" % key)
-        self._repo.lookup_reference(self._key2ref(key)).delete()
+        self.remove_many([key], force=force)
+
+    @instrumented
+    @_transactional
+    def remove_many(self, keys, force=False):
+        """Remove many keys at once, as with :func:`remove`.  The index is
+        written once, references are deleted in one batch, and a single
+        repo-level commit records the removal.  Nothing is removed if any
+        key is missing or, without force, staged.
+
+        >>> repo.commit('expired1', 'foo')
+        >>> repo.commit('expired2', 'bar')
+        >>> repo.remove_many(['expired1', 'expired2'])
+        >>> repo.keys()
+        []
+
+        :param keys: The keys to remove
+        :type keys: list of strings
+        :param force:
+            (optional) Whether to remove keys even if there is data staged
+            for them.  See :func:`remove`.
+        :type force: boolean
 
+        :raises:
+            :class:`StagedDataError jsongit.StagedDataError`, KeyError if a
+            key is not committed.
+        """
+        keys = sorted(set(keys))
+        head_ids = self._head_ids_many(keys)
+        missing = [key for key in keys if key not in head_ids]
+        if missing:
+            raise KeyError("There is no key at %s" % ', '.join(missing))
+
+        self._read_index()
+        index = self._repo.index
+        paths = dict((key, self._key2path(key)) for key in keys)
+        indexed = [key for key in keys if paths[key] in index]
+        if force is False:
+            staged = [key for key in indexed if self._blobs_differ(
+                head_ids[key][1], index[paths[key]].oid)]
+            if staged:
+                raise StagedDataError("There is data staged for %s" %
+                                      ', '.join(staged))
+        # the references go first, so that nothing else is changed if one
+        # has moved since it was read
+        with self._stats.timer('phase.ref_update'):
+            self._delete_refs(dict((self._key2ref(key), head_ids[key][0])
+                                   for key in keys))
+        # deleting may have reopened the repository, and with it the index
+        index = self._repo.index
+        for key in indexed:
+            del index[paths[key]]
+        if indexed:
+            self._write_index()
+
+        message = "Remove %s" % keys[0] if len(keys) == 1 else \
+                "Remove %s keys" % len(keys)
+        signature = self.signature()
+        if self._index_defs():
+            self._update_indexes([(key, self._blob_value(head_ids[key][1]),
+                                   utils.MISSING) for key in keys],
+                                 signature, message)
+        if keys:
+            self._advance_head(dict((path, None) for path in paths.itervalues()),
+                               signature, signature, message)
+        self._record_heads({}, keys)
+        for key in keys:
+            self._time_index.pop(key, None)
+
+    def _delete_refs(self, expected):
+        """Delete references, provided each still points at the oid it was
+        read with.  On disk, more than one is deleted with a single write of
+        `packed-refs`, rather than a rewrite per reference.
+
+        :param expected: a dict of reference names to raw oids
+
+        :raises: :class:`pygit2.GitError` if a reference has moved
+        """
+        if len(expected) > 1 and \
+                not isinstance(self._repo, store.StoreRepository):
+            odb.update_packed_refs(self._repo.path,
+                                   dict((name, None) for name in expected),
+                                   expected)
+            self._reopen()
+            return
+        with self._transaction():
+            refs = dict((name, self._repo.lookup_reference(name))
+                        for name in expected)
+            for name, ref in refs.iteritems():
+                if ref.oid != expected[name]:
+                    raise pygit2.GitError("Reference '%s' has moved" % name)
+            for ref in refs.itervalues():
+                ref.delete()
+
+    @instrumented
     def reset(self, key):
         """Reset the value in the index to its HEAD value.
 
@@ -450,7 +2026,82 @@ class Repository(object):
         """
         self.add(key, self.head(key).data)
 
-    def show(self, key, back=0):
+    def scan(self, predicate=None, projection=None, prefix=None, workers=None,
+             ordered=True, chunk_size=1000):
+        """Find every key whose head value matches predicate, decoding and
+        filtering values in a pool of worker processes.  Each worker opens
+        the repository and reads blobs from the object store itself, so only
+        the keys and the matching, projected values pass between processes.
+
+        >>> def failed(value):
+        ...     return value.get('status') == 'failed'
+        ...
+        >>> for key, value in repo.scan(failed, projection=['owner'], workers=4):
+        ...     print(key, value)
+        ...
+        job1 {'owner': u'sally'}
+        job7 {'owner': u'bob'}
+
+        :param predicate:
+            (optional) Called with each decoded value; values for which it
+            returns true are yielded.  Defaults to matching everything.
+        :type predicate: func
+        :param projection:
+            (optional) Dotted paths (see :func:`create_index`) to yield from
+            each match, as a dict of paths to values, instead of the whole
+            value.  Missing paths map to None.
+        :type projection: list
+        :param prefix: (optional) Only scan keys starting with prefix.
+        :type prefix: string
+        :param workers:
+            (optional) The number of worker processes.  Defaults to None,
+            which scans in this process.  Workers are sent the predicate and
+            the repository's loads, so both must be picklable, for instance
+            module-level functions; if either is not, or the repository is in
+            a store, such as in memory, the scan runs in this process.
+        :type workers: int
+        :param ordered:
+            (optional) Whether to yield matches in key order, rather than as
+            workers finish with them.  Defaults to True.
+        :type ordered: boolean
+        :param chunk_size:
+            (optional) How many keys to give a worker at a time.  Defaults to
+            1000.
+        :type chunk_size: int
+
+        :returns: a generator of `(key, value)` tuples
+        :rtype: generator
+        """
+        keys = self.keys(prefix)
+        chunks = (keys[i:i + chunk_size] for i in xrange(0, len(keys), chunk_size))
+        if workers is None or isinstance(self._repo, store.StoreRepository) or \
+                not (utils.picklable(self._loads) and
+                     utils.picklable(predicate)):
+            results = (scan.match(self._repo, REF_PREFIX, self._loads,
+                                  predicate, projection, chunk)
+                       for chunk in chunks)
+            for matches in results:
+                self._stats.count('scan.matches', len(matches))
+                for match in matches:
+                    yield match
+            return
+
+        pool = multiprocessing.Pool(workers, scan.init_worker, (
+            self._repo.path, REF_PREFIX, self._loads, predicate, projection))
+        try:
+            results = pool.imap(scan.scan_keys, chunks) if ordered else \
+                pool.imap_unordered(scan.scan_keys, chunks)
+            for matches in results:
+                self._stats.count('scan.matches', len(matches))
+                for match in matches:
+                    yield match
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @instrumented
+    def show(self, key, back=0, at=None):
         """Obtain the data at HEAD, or a certain number of steps back, for key.
 
         >>> repo.commit('president', 'washington')
@@ -467,15 +2118,119 @@ class Repository(object):
             (optional) How many steps back from head to get the commit.
             Defaults to 0 (the current head).
         :type back: integer
+        :param at:
+            (optional) Get the data as it was at this time, instead of
+            counting back.  See :func:`head`.
+        :type at: :class:`datetime.datetime` or UTC seconds
 
         :returns: the data
         :rtype: int, float, NoneType, unicode, boolean, list, or dict
         :raises:
             KeyError if there is no entry for key, IndexError if too many steps
-            back are specified.
+            back are specified or there was no commit by the time.
+        """
+        if back == 0 and at is None:
+            blob_id = self._head_blob(key)
+            if blob_id is None:
+                raise KeyError("There is no key at %s" % key)
+            return self._blob_value(blob_id)
+        return self.head(key, back=back, at=at).data
+
+    @instrumented
+    def show_many(self, keys, workers=None, chunk_size=1000):
+        """Obtain the data at HEAD for many keys at once.  References are
+        resolved in one pass, and blobs are read in oid order.
+
+        >>> repo.commit('president', 'madison')
+        >>> repo.commit('vice', 'clinton')
+        >>> repo.show_many(['president', 'vice', 'treasurer'])
+        {'president': u'madison', 'vice': u'clinton'}
+
+        :param keys: The keys to look up.
+        :type keys: list of strings
+        :param workers:
+            (optional) The number of worker processes to decode values in.
+            Workers are sent the repository's loads, so it must be
+            picklable, for instance a module-level function; if it is not,
+            values are decoded in this process.  Defaults to None, which
+            decodes in this process.
+        :type workers: int
+        :param chunk_size:
+            (optional) How many values to give a worker at a time.  Defaults
+            to 1000.
+        :type chunk_size: int
+
+        :returns:
+            a dict of keys to data.  Keys that have not been committed are
+            left out, rather than raising KeyError.
+        :rtype: dict
+        """
+        blobs = sorted((blob_id, key) for key, (commit_id, blob_id)
+                       in self._head_ids_many(keys).iteritems())
+        raws = [self._repo[blob_id].data for blob_id, key in blobs]
+        with self._stats.timer('phase.decode'):
+            if workers is None or not utils.picklable(self._loads):
+                values = map(self._loads, raws)
+            else:
+                pool = multiprocessing.Pool(workers)
+                try:
+                    values = pool.map(self._loads, raws, chunk_size)
+                    pool.close()
+                finally:
+                    pool.terminate()
+                    pool.join()
+        return dict(zip((key for blob_id, key in blobs), values))
+
+    def signature(self, time=None):
+        """Obtain a signature for the configured git user, which is what
+        commits use when no author is specified.  The name and email are only
+        looked up the first time a signature is needed; after that only the
+        timestamp is refreshed.
+
+        >>> repo.signature().name
+        u'Jon Q. User'
+        >>> repo.signature(time=1332438935).time
+        1332438935L
+
+        :param time:
+            (optional) A fixed time for the signature, in UTC seconds.
+            Defaults to the current time.
+        :type time: int
+
+        :returns: a signature
+        :rtype: pygit2.Signature
+        :raises: :exc:`NoGlobalSettingError <jsongit.NoGlobalSettingError>`
         """
-        return self.head(key, back=back).data
+        if self._identity is None:
+            self._identity = (utils.global_config('user.name', self._repo),
+                              utils.global_config('user.email', self._repo))
+        time = int(curtime()) if time is None else time
+        last = self._last_signature
+        if last is None or last.time != time:
+            last = utils.signature(self._identity[0], self._identity[1], time)
+            self._last_signature = last
+        return last
+
+    def stats(self, reset=False):
+        """Obtain counters and timing histograms for this repository's
+        public methods and internal phases.  See :class:`Stats
+        <jsongit.metrics.Stats>` for the phases that are measured.
 
+        >>> repo.commit('foo', 'bar')
+        >>> repo.stats()['timers']['method.commit']['count']
+        1
+
+        :param reset:
+            (optional) Whether to clear the statistics after reading them.
+            Defaults to False.
+        :type reset: boolean
+
+        :returns: a snapshot of the statistics
+        :rtype: dict
+        """
+        return self._stats.snapshot(reset=reset)
+
+    @instrumented
     def staged(self, key):
         """Determine whether the value in the index differs from the committed
         value, if there is an entry in the index.
@@ -495,19 +2250,84 @@ class Repository(object):
         :returns: whether the entries are different.
         :rtype: boolean
         """
-        if key in self._repo.index:
-            if self.committed(key):
-                return self.index(key) != self.show(key)
-            else:
-                return True
-        else:
+        self._read_index()
+        path = self._key2path(key)
+        if path not in self._repo.index:
             return False
+        return self._blobs_differ(self._head_blob(key),
+                                  self._repo.index[path].oid)
         # try:
         #     self._repo.lookup_reference(self._key2ref(key))
         #     return True
         # except KeyError:
         #     return False
 
+    @instrumented
+    def status(self):
+        """Find every key whose value in the index differs from its committed
+        value.  Like :func:`staged`, this compares blob oids, and only
+        decodes values whose blobs differ.
+
+        >>> repo.commit('huey', 'short')
+        >>> repo.add('huey', 'long')
+        >>> repo.add('dewey', 'short')
+        >>> repo.status()
+        {'dewey': 'added', 'huey': 'modified'}
+
+        :returns:
+            a dict of the staged keys to `'added'` if the key has not been
+            committed, or `'modified'` if it has.
+        :rtype: dict
+        """
+        self._read_index()
+        entries = dict((self._path2key(entry.path), entry.oid)
+                       for entry in self._repo.index)
+        head_ids = self._head_ids_many(entries)
+        status = {}
+        for key, blob_id in entries.iteritems():
+            head_blob = head_ids[key][1] if key in head_ids else None
+            if self._blobs_differ(head_blob, blob_id):
+                status[key] = 'added' if head_blob is None else 'modified'
+        return status
+
+    def verify_heads(self, repair=True):
+        """Check the head table against the key references, which are always
+        authoritative.  See :func:`init <jsongit.init>` for how to keep a
+        head table.
+
+        The table is only rebuilt automatically when the repo-level HEAD has
+        moved since it was last updated, so this must be called after a
+        writer crashes mid-commit or references are changed outside jsongit.
+
+        >>> repo.verify_heads(repair=False)
+        []
+
+        :param repair:
+            (optional) Whether to rebuild the table from the references if
+            it is wrong.  Defaults to True.
+        :type repair: boolean
+
+        :returns: the keys whose rows were wrong or missing, sorted
+        :rtype: list
+        :raises: ValueError if this repository has no head table
+        """
+        if self._head_table is None:
+            raise ValueError("%s has no head table" % self._repo.path)
+        actual = {}
+        for key in self.keys():
+            oid = self._repo.lookup_reference(self._key2ref(key)).oid
+            actual[key] = (oid, self._repo[oid].tree[0].oid)
+        recorded = dict((key, (commit_id, blob_id)) for key, commit_id, blob_id
+                        in self._head_table.items())
+        wrong = sorted(key for key in set(actual) | set(recorded)
+                       if actual.get(key) != recorded.get(key))
+        repo_head = self._repo_head()
+        repo_head = repo_head.hex if repo_head else None
+        if repair and (wrong or self._head_table.repo_head != repo_head):
+            self._head_table.update(actual, repo_head=repo_head, replace=True)
+            self._stats.count('head_table.rebuilds')
+        return wrong
+
 # class Value(object):
 #     """Values are what exist behind a single key.  They provide convenience
 #     methods to their underlying repository.
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+
+"""
+jsongit.odb
+
+Helpers for working with the git object database directly: hashing and
+serializing raw objects, reading loose objects and writing packfiles.
+These let jsongit do bulk work without a round-trip through libgit2 for
+every object.
+"""
+
+import errno
+import os
+import struct
+import tempfile
+import zlib
+from hashlib import sha1
+from binascii import hexlify, unhexlify
+
+import pygit2
+
+TYPE_NAMES = {
+    pygit2.GIT_OBJ_COMMIT: 'commit',
+    pygit2.GIT_OBJ_TREE: 'tree',
+    pygit2.GIT_OBJ_BLOB: 'blob',
+    pygit2.GIT_OBJ_TAG: 'tag'
+}
+NAME_TYPES = dict((v, k) for k, v in TYPE_NAMES.iteritems())
+
+BLOB_MODE = '100644'
+TREE_MODE = '40000'
+
+def hash_object(type, data):
+    """The raw 20-byte oid git would give an object.
+
+    :param type: the object type, for example :const:`pygit2.GIT_OBJ_BLOB`
+    :type type: int
+    :param data: the object's content
+    :type data: string
+
+    :rtype: string
+    """
+    return sha1('%s %d\x00%s' % (TYPE_NAMES[type], len(data), data)).digest()
+
+def tree_data(entries):
+    """Serialize tree entries.  Entries are sorted the way git requires,
+    where subtrees sort as if their name ended in '/'.
+
+    :param entries: `(mode, name, raw oid)` tuples, where mode is an octal
+        string such as '100644' or '40000'.
+    :type entries: iterable
+
+    :rtype: string
+    """
+    entries = [(mode, name.encode('utf-8') if isinstance(name, unicode)
+                else name, oid) for mode, name, oid in entries]
+    def sort_key(entry):
+        mode, name, oid = entry
+        return name + '/' if mode == TREE_MODE else name
+    return ''.join('%s %s\x00%s' % entry for entry in sorted(entries, key=sort_key))
+
+def parse_tree(data):
+    """Parse serialized tree data.
+
+    :returns: `(mode, name, raw oid)` tuples
+    :rtype: list
+    """
+    entries = []
+    pos = 0
+    while pos < len(data):
+        space = data.index(' ', pos)
+        nul = data.index('\x00', space)
+        entries.append((data[pos:space], data[space + 1:nul],
+                        data[nul + 1:nul + 21]))
+        pos = nul + 21
+    return entries
+
+def format_signature(signature):
+    """Serialize a signature as it appears in a commit header.
+    """
+    offset = signature.offset
+    sign = '-' if offset < 0 else '+'
+    offset = abs(offset)
+    return '%s <%s> %d %s%02d%02d' % (
+        signature.name.encode('utf-8') if isinstance(signature.name, unicode)
+        else signature.name,
+        signature.email.encode('utf-8') if isinstance(signature.email, unicode)
+        else signature.email,
+        signature.time, sign, offset / 60, offset % 60)
+
+def commit_data(tree, parents, author, committer, message):
+    """Serialize a commit.
+
+    :param tree: raw oid of the commit's tree
+    :type tree: string
+    :param parents: raw oids of the commit's parents
+    :type parents: list
+    :param author: the author
+    :type author: :class:`pygit2.Signature`
+    :param committer: the committer
+    :type committer: :class:`pygit2.Signature`
+    :param message: the message
+    :type message: string
+
+    :rtype: string
+    """
+    lines = ['tree %s' % hexlify(tree)]
+    lines.extend('parent %s' % hexlify(parent) for parent in parents)
+    lines.append('author %s' % format_signature(author))
+    lines.append('committer %s' % format_signature(committer))
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+    return '\n'.join(lines) + '\n\n' + message
+
+def objects_dir(repo):
+    """The path to the objects directory of a :class:`pygit2.Repository`.
+    """
+    return os.path.join(repo.path, 'objects')
+
+def loose_objects(path):
+    """Find loose objects.
+
+    :param path: an objects directory
+    :type path: string
+
+    :returns: a generator of `(hex oid, file path)` tuples
+    :rtype: generator
+    """
+    for fanout in sorted(os.listdir(path)):
+        if len(fanout) != 2:
+            continue
+        fanout_path = os.path.join(path, fanout)
+        for name in os.listdir(fanout_path):
+            if len(name) == 38:
+                yield fanout + name, os.path.join(fanout_path, name)
+
+def estimate_loose_objects(path):
+    """Cheaply estimate how many loose objects there are by counting a
+    single fanout directory, the way `git gc --auto` does.
+
+    :param path: an objects directory
+    :type path: string
+
+    :rtype: int
+    """
+    try:
+        return len(os.listdir(os.path.join(path, '17'))) * 256
+    except OSError:
+        return 0
+
+def read_loose(file_path):
+    """Read a loose object file.
+
+    :returns: `(type, data)`
+    :rtype: tuple
+    """
+    with open(file_path, 'rb') as f:
+        raw = zlib.decompress(f.read())
+    nul = raw.index('\x00')
+    type_name, size = raw[:nul].split(' ')
+    return NAME_TYPES[type_name], raw[nul + 1:]
+
+def read_packed_refs(git_path):
+    """Parse the packed-refs file of a git directory.
+
+    :returns: a dict of reference names to hex oids
+    :rtype: dict
+    """
+    refs = {}
+    path = os.path.join(git_path, 'packed-refs')
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                if line.startswith('#') or line.startswith('^'):
+                    continue
+                hex, name = line.rstrip('\n').split(' ', 1)
+                refs[name] = hex
+    return refs
+
+def ref_names(git_path, prefix):
+    """The names of the references of a git directory under a prefix, both
+    loose and packed, without listing any others.
+
+    :param prefix: a reference name prefix ending in a slash
+    :type prefix: string
+
+    :rtype: list
+    """
+    names = set(name for name in read_packed_refs(git_path)
+                if name.startswith(prefix))
+    for dirpath, dirnames, filenames in os.walk(os.path.join(git_path, prefix)):
+        rel = os.path.relpath(dirpath, git_path).replace(os.sep, '/')
+        names.update('%s/%s' % (rel, name) for name in filenames
+                     if not name.endswith('.lock'))
+    return sorted(names)
+
+def refs_stamp(git_path, prefix):
+    """A stamp that changes whenever a reference under a prefix may have
+    changed: the identity of the packed-refs file, and of every loose
+    reference under the prefix.  Both are replaced by renaming, so a change
+    gives a new inode even within the resolution of mtime.
+
+    :param prefix: a reference name prefix ending in a slash
+    :type prefix: string
+
+    :rtype: tuple
+    """
+    def identity(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime, st.st_size
+    loose = []
+    for dirpath, dirnames, filenames in os.walk(os.path.join(git_path, prefix)):
+        loose.extend((os.path.join(dirpath, name),
+                      identity(os.path.join(dirpath, name)))
+                     for name in filenames if not name.endswith('.lock'))
+    return identity(os.path.join(git_path, 'packed-refs')), sorted(loose)
+
+def _lock(path):
+    """Take git's lock on a file, by creating `path.lock` exclusively.
+
+    :returns: the path of the lock
+    :raises: OSError if the lock is already held
+    """
+    lock_path = path + '.lock'
+    os.close(os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0644))
+    return lock_path
+
+def _read_ref(git_path, name, packed):
+    """The raw oid a reference points at, from its loose file or else from
+    the parsed packed-refs, or None if there is no such reference.
+    """
+    try:
+        with open(os.path.join(git_path, name)) as f:
+            return unhexlify(f.read().strip())
+    except IOError:
+        return unhexlify(packed[name]) if name in packed else None
+
+def update_ref(git_path, name, oid, expected):
+    """Point a loose reference of a git directory at an oid, provided it
+    still points at expected.  As in git, the reference is locked while it
+    is compared and written.
+
+    :param name: the name of the reference
+    :type name: string
+    :param oid: the raw oid to point it at
+    :type oid: string
+    :param expected:
+        the raw oid it must still point at, or None if it must not exist.
+    :type expected: string
+
+    :raises:
+        OSError if the lock is held by another writer,
+        :class:`pygit2.GitError` if the reference has moved.
+    """
+    path = os.path.join(git_path, name)
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    lock_path = _lock(path)
+    try:
+        # packed-refs is only parsed if there is no loose reference
+        current = _read_ref(git_path, name, {})
+        if current is None:
+            current = _read_ref(git_path, name, read_packed_refs(git_path))
+        if current != expected:
+            raise pygit2.GitError("Reference '%s' has moved" % name)
+        with open(lock_path, 'w') as lock:
+            lock.write(hexlify(oid) + '\n')
+    except:
+        os.remove(lock_path)
+        raise
+    os.rename(lock_path, path)
+
+def update_packed_refs(git_path, updates, expected=None):
+    """Set many references with a single write of the packed-refs file of a
+    git directory, removing the loose references that would shadow them.
+    As in git, the file and every loose reference being removed are locked
+    first, so that a loose reference is never removed while another writer
+    is updating it.
+
+    :param updates:
+        a dict of reference names to raw oids, or to None to delete the
+        reference.
+    :type updates: dict
+    :param expected:
+        (optional) a dict of reference names to the raw oids they must still
+        point at.  They are checked under the locks, and nothing is written
+        if one has moved.
+    :type expected: dict
+
+    :raises:
+        OSError if a lock is held by another writer,
+        :class:`pygit2.GitError` if a reference in expected has moved.
+    """
+    loose_locks = []
+    try:
+        for name in sorted(updates):
+            loose = os.path.join(git_path, name)
+            if os.path.isfile(loose):
+                loose_locks.append(_lock(loose))
+        path = os.path.join(git_path, 'packed-refs')
+        lock_path = _lock(path)
+        try:
+            refs = read_packed_refs(git_path)
+            for name, oid in (expected or {}).iteritems():
+                if _read_ref(git_path, name, refs) != oid:
+                    raise pygit2.GitError("Reference '%s' has moved" % name)
+            for name, oid in updates.iteritems():
+                if oid is None:
+                    refs.pop(name, None)
+                else:
+                    refs[name] = hexlify(oid)
+            with open(lock_path, 'w') as lock:
+                lock.write(''.join('%s %s\n' % (refs[name], name)
+                                   for name in sorted(refs)))
+        except:
+            os.remove(lock_path)
+            raise
+        os.rename(lock_path, path)
+        for loose_lock in loose_locks:
+            loose = loose_lock[:-len('.lock')]
+            if os.path.isfile(loose):
+                os.remove(loose)
+    finally:
+        for loose_lock in loose_locks:
+            os.remove(loose_lock)
+
+class PackWriter(object):
+    """Write objects into a single new packfile, with its index.  Objects
+    are stored whole (not deltified) and compressed.
+
+    >>> writer = PackWriter(odb.objects_dir(repo))
+    >>> oid = writer.add(pygit2.GIT_OBJ_BLOB, '"some json"')
+    >>> writer.close()
+
+    Call :func:`abort` instead of :func:`close` to leave no pack behind.
+
+    :param path: an objects directory
+    :type path: string
+    """
+
+    def __init__(self, path):
+        self._pack_dir = os.path.join(path, 'pack')
+        if not os.path.isdir(self._pack_dir):
+            os.makedirs(self._pack_dir)
+        fd, self._tmp_path = tempfile.mkstemp(prefix='tmp_pack_',
+                                              dir=self._pack_dir)
+        self._file = os.fdopen(fd, 'w+b')
+        self._file.write('\x00' * 12) # header, filled in on close
+        self._entries = {}
+        self.size = 0
+
+    def __contains__(self, oid):
+        return oid in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, type, data):
+        """Add an object to the pack, unless it is already in it.
+
+        :returns: the raw oid of the object
+        :rtype: string
+        """
+        oid = hash_object(type, data)
+        if oid in self._entries:
+            return oid
+        size = len(data)
+        header = [(type << 4) | (size & 0x0f)]
+        size >>= 4
+        while size:
+            header[-1] |= 0x80
+            header.append(size & 0x7f)
+            size >>= 7
+        entry = struct.pack('%dB' % len(header), *header) + zlib.compress(data)
+        self._entries[oid] = (self._file.tell(), zlib.crc32(entry) & 0xffffffff)
+        self._file.write(entry)
+        return oid
+
+    def abort(self):
+        """Discard the pack instead of finishing it.
+        """
+        self._file.close()
+        os.remove(self._tmp_path)
+
+    def close(self):
+        """Finish the pack and its index, moving them into place.  Nothing is
+        written if no objects were added.
+
+        :returns: the path of the new pack, or None
+        :rtype: string
+        """
+        f = self._file
+        if not self._entries:
+            f.close()
+            os.remove(self._tmp_path)
+            return None
+        f.seek(0)
+        f.write(struct.pack('>4sLL', 'PACK', 2, len(self._entries)))
+        f.seek(0)
+        digest = sha1()
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            digest.update(chunk)
+        pack_sha = digest.digest()
+        f.seek(0, os.SEEK_END)
+        f.write(pack_sha)
+        f.close()
+
+        base = os.path.join(self._pack_dir, 'pack-%s' % hexlify(pack_sha))
+        idx = self._index(pack_sha)
+        with open(base + '.idx.tmp', 'wb') as idx_file:
+            idx_file.write(idx)
+        # readers find packs through their index, so it moves in last
+        os.chmod(self._tmp_path, 0444)
+        os.chmod(base + '.idx.tmp', 0444)
+        os.rename(self._tmp_path, base + '.pack')
+        os.rename(base + '.idx.tmp', base + '.idx')
+        self.size = os.path.getsize(base + '.pack') + len(idx)
+        return base + '.pack'
+
+    def _index(self, pack_sha):
+        """Build a version 2 pack index.
+        """
+        oids = sorted(self._entries)
+        fanout = [0] * 256
+        for oid in oids:
+            fanout[ord(oid[0])] += 1
+        for i in xrange(1, 256):
+            fanout[i] += fanout[i - 1]
+        offsets, large = [], []
+        for oid in oids:
+            offset = self._entries[oid][0]
+            if offset < 0x80000000:
+                offsets.append(offset)
+            else:
+                offsets.append(0x80000000 | len(large))
+                large.append(offset)
+        parts = ['\xfftOc', struct.pack('>L', 2),
+                 struct.pack('>256L', *fanout),
+                 ''.join(oids),
+                 struct.pack('>%dL' % len(oids),
+                             *[self._entries[oid][1] for oid in oids]),
+                 struct.pack('>%dL' % len(oids), *offsets),
+                 struct.pack('>%dQ' % len(large), *large),
+                 pack_sha]
+        idx = ''.join(parts)
+        return idx + sha1(idx).digest()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+jsongit.scan
+
+Worker side of :func:`Repository.scan <jsongit.models.Repository.scan>`.
+Each worker process opens the repository itself and reads blobs straight
+from the object store, so that values never pass through the parent.
+"""
+
+import pygit2
+
+import utils
+
+_worker = {}
+
+def init_worker(path, ref_prefix, loads, predicate, projection):
+    """Set up a worker process.
+    """
+    _worker.update(repo=pygit2.Repository(path), ref_prefix=ref_prefix,
+                   loads=loads, predicate=predicate, projection=projection)
+
+def project(value, projection):
+    """Pick the paths in projection out of value, as a dict of paths to the
+    values found there.  Paths that are missing map to None.
+    """
+    if projection is None:
+        return value
+    projected = {}
+    for path in projection:
+        found = utils.get_path(value, path)
+        projected[path] = None if found is utils.MISSING else found
+    return projected
+
+def scan_keys(keys):
+    """Decode and filter the head values of keys in a worker set up by
+    :func:`init_worker`.
+    """
+    return match(_worker['repo'], _worker['ref_prefix'], _worker['loads'],
+                 _worker['predicate'], _worker['projection'], keys)
+
+def match(repo, ref_prefix, loads, predicate, projection, keys):
+    """Decode and filter the head values of keys.
+
+    :returns: `(key, projected value)` for every match, in the order of keys
+    :rtype: list
+    """
+    matches = []
+    for key in keys:
+        try:
+            ref = repo.lookup_reference(ref_prefix + key)
+        except KeyError:
+            continue # removed since the parent listed it
+        value = loads(repo[repo[ref.oid].tree[0].oid].data)
+        if predicate is None or predicate(value):
+            matches.append((key, project(value, projection)))
+    return matches
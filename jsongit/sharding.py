@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+
+"""
+jsongit.sharding
+
+A :class:`ShardedRepository` spreads one logical set of keys across several
+jsongit repositories, so that writes to different shards do not contend for
+the same index file and HEAD reference.
+"""
+
+import os
+import heapq
+import shutil
+import threading
+import itertools
+from hashlib import sha1
+from time import time as curtime, sleep
+
+from .exceptions import DifferentRepoError
+import utils
+
+#: The file describing a sharded repository's layout.
+MANIFEST = 'jsongit-shards.json'
+
+def route(key, shards):
+    """Find the shard for a key.  This depends only on the key and the number
+    of shards, so it is stable across processes and hosts.
+
+    :param key: the key
+    :type key: string
+    :param shards: the number of shards
+    :type shards: int
+
+    :returns: the index of the shard
+    :rtype: int
+    """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return int(sha1(key).hexdigest()[:8], 16) % shards
+
+def write_manifest(path, shards):
+    """Lay out a new sharded repository at path, returning its manifest.
+    """
+    manifest = {'version': 1, 'routing': 'sha1',
+                'shards': ['shard-%03d' % i for i in xrange(shards)]}
+    os.makedirs(path)
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        utils.import_json().dump(manifest, f, indent=2)
+    return manifest
+
+def read_manifest(path):
+    """Read the manifest of the sharded repository at path.
+    """
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = utils.import_json().load(f)
+    if manifest.get('version') != 1 or manifest.get('routing') != 'sha1':
+        raise ValueError("Unsupported shard manifest in %s" % path)
+    return manifest
+
+class ShardedRepository(object):
+    """Exposes the :class:`Repository <jsongit.models.Repository>` API over
+    keys hash-partitioned across several repositories.  Use :func:`init
+    <jsongit.init>` with `shards` to obtain one.
+
+    >>> repo = jsongit.init('path/to/repo', shards=8)
+    >>> repo.commit('foo', 'bar')
+    >>> repo.show('foo')
+    u'bar'
+
+    Operations on a key go to its shard, and hold only that shard's lock, so
+    threads writing to different shards proceed in parallel.  Operations
+    over all keys, like :func:`keys` and :func:`export`, merge the shards in
+    key order.
+
+    Histories cannot span shards: :func:`checkout` between shards copies the
+    value without linking history, and :func:`merge` between shards raises
+    :class:`DifferentRepoError <jsongit.DifferentRepoError>`.  :func:`push`
+    and :func:`pull` replicate to and from sharded and unsharded
+    repositories alike, routing every key to its shard.
+    """
+
+    def __init__(self, path, shards):
+        self._path = path
+        self._shards = shards
+        self._locks = [threading.RLock() for shard in shards]
+
+    def __eq__(self, other):
+        return isinstance(other, ShardedRepository) and \
+                self._path == other._path
+
+    def _route(self, key):
+        idx = route(key, len(self._shards))
+        return self._shards[idx], self._locks[idx]
+
+    def _on(self, meth, key, *args, **kwargs):
+        """Call meth on the shard for key, holding the shard's lock.
+        """
+        shard, lock = self._route(key)
+        with lock:
+            return getattr(shard, meth)(key, *args, **kwargs)
+
+    def _route_many(self, keys):
+        """Group keys by shard.
+
+        :returns: a list of `(shard, lock, keys)` for each shard with keys
+        :rtype: list
+        """
+        routed = {}
+        for key in keys:
+            routed.setdefault(route(key, len(self._shards)), []).append(key)
+        return [(self._shards[idx], self._locks[idx], shard_keys)
+                for idx, shard_keys in sorted(routed.iteritems())]
+
+    def _on_many(self, meth, keys, *args, **kwargs):
+        """Call meth on each shard with its share of keys, holding the
+        shard's lock, and merge the resulting dicts.
+        """
+        results = {}
+        for shard, lock, shard_keys in self._route_many(keys):
+            with lock:
+                results.update(getattr(shard, meth)(shard_keys, *args, **kwargs))
+        return results
+
+    def _each(self, meth, *args, **kwargs):
+        """Call meth on every shard in turn, returning the results.
+        """
+        results = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                results.append(getattr(shard, meth)(*args, **kwargs))
+        return results
+
+    @property
+    def shards(self):
+        """The underlying :class:`Repository
+        <jsongit.models.Repository>` objects.
+        """
+        return list(self._shards)
+
+    def add(self, key, value):
+        """See :func:`Repository.add <jsongit.models.Repository.add>`.
+        """
+        return self._on('add', key, value)
+
+    def changes(self, since=None, until=None):
+        """See :func:`Repository.changes <jsongit.models.Repository.changes>`.
+        Each shard has its own repo-level history, so changes are yielded
+        shard by shard, each shard's oldest first.
+
+        :param since:
+            (optional) A :func:`snapshot`; only changes after it are
+            yielded.  Defaults to the start of every shard's history.
+        :type since: dict
+        :param until:
+            (optional) A :func:`snapshot`; only changes up to it are
+            yielded.  Defaults to every shard's current HEAD.
+        :type until: dict
+        """
+        since = since or {}
+        for name, shard in zip(self._names(), self._shards):
+            if until is not None and until.get(name) is None:
+                continue # the shard had no history yet
+            for change in shard.changes(since=since.get(name),
+                                        until=until and until[name]):
+                yield change
+
+    def checkout(self, source, dest, **kwargs):
+        """See :func:`Repository.checkout
+        <jsongit.models.Repository.checkout>`.  If source and dest are in
+        different shards, dest gets source's value without its history.
+        """
+        source_shard, lock = self._route(source)
+        if source_shard is self._route(dest)[0]:
+            with lock:
+                return source_shard.checkout(source, dest, **kwargs)
+        message = "Checkout %s from %s" % (dest, source)
+        return self.commit(dest, self.show(source), message=message, **kwargs)
+
+    def commit(self, key=None, value=None, add=True, **kwargs):
+        """See :func:`Repository.commit <jsongit.models.Repository.commit>`.
+        Without a key, every shard commits its index.
+        """
+        if key is None:
+            if value is not None:
+                raise TypeError("Cannot commit a value without a key")
+            return self._each('commit', add=add, **kwargs)
+        return self._on('commit', key, value, add=add, **kwargs)
+
+    def committed(self, key):
+        """See :func:`Repository.committed
+        <jsongit.models.Repository.committed>`.
+        """
+        return self._on('committed', key)
+
+    def create_index(self, name, path):
+        """See :func:`Repository.create_index
+        <jsongit.models.Repository.create_index>`.
+        """
+        self._each('create_index', name, path)
+
+    def destroy(self):
+        """Erase every shard, and the sharded repository's directory.
+        """
+        self._each('destroy')
+        shutil.rmtree(self._path)
+
+    def drop_index(self, name):
+        """See :func:`Repository.drop_index
+        <jsongit.models.Repository.drop_index>`.  The index is dropped from
+        every shard.
+        """
+        self._each('drop_index', name)
+
+    def export(self, stream, at=None, prefix=None, raw=False):
+        """See :func:`Repository.export <jsongit.models.Repository.export>`.
+        Keys are exported in key order across all shards.
+
+        :param at:
+            (optional) A :func:`snapshot` to export from, instead of the
+            current heads.  Keys are then exported shard by shard.
+        :type at: dict
+        """
+        if at is not None:
+            return sum(shard.export(stream, at=at[name], prefix=prefix, raw=raw)
+                       for name, shard in zip(self._names(), self._shards)
+                       if at.get(name) is not None)
+        count = 0
+        for key, shard in self._merged_keys(prefix):
+            count += shard._export_entries(stream, shard._head_entries([key]),
+                                           raw)
+        return count
+
+    def export_history(self, stream, prefix=None, since=None):
+        """See :func:`Repository.export_history
+        <jsongit.models.Repository.export_history>`.  Keys are exported
+        shard by shard, and the watermarks of every shard are merged, so
+        they can be passed back as `since` as they are.
+        """
+        watermarks = {}
+        for result in self._each('export_history', stream, prefix=prefix,
+                                 since=since):
+            watermarks.update(result)
+        return watermarks
+
+    def find(self, index, value):
+        """See :func:`Repository.find <jsongit.models.Repository.find>`.
+        Indexes must be created with :func:`create_index`, which creates them
+        on every shard.
+        """
+        return list(heapq.merge(*self._each('find', index, value)))
+
+    def flush(self):
+        """See :func:`Repository.flush <jsongit.models.Repository.flush>`.
+        """
+        self._each('flush')
+
+    def gc(self, **kwargs):
+        """Run :func:`Repository.gc <jsongit.models.Repository.gc>` on every
+        shard.
+
+        :returns: the totals of the results from every shard.
+        :rtype: dict
+        """
+        totals = {}
+        for result in self._each('gc', **kwargs):
+            for k, v in result.iteritems():
+                totals[k] = totals.get(k, 0) + v
+        return totals
+
+    def head(self, key, back=0, at=None):
+        """See :func:`Repository.head <jsongit.models.Repository.head>`.
+        """
+        return self._on('head', key, back=back, at=at)
+
+    def head_many(self, keys):
+        """See :func:`Repository.head_many
+        <jsongit.models.Repository.head_many>`.
+        """
+        return self._on_many('head_many', keys)
+
+    def index(self, key):
+        """See :func:`Repository.index <jsongit.models.Repository.index>`.
+        """
+        return self._on('index', key)
+
+    def _names(self):
+        return [os.path.basename(shard._repo.path.rstrip('/'))
+                for shard in self._shards]
+
+    def _merged_keys(self, prefix=None):
+        """Yield `(key, shard)` for every key, in key order.
+        """
+        return heapq.merge(*[[(key, shard) for key in keys] for shard, keys
+                             in zip(self._shards, self._each('keys', prefix))])
+
+    def keys(self, prefix=None):
+        """See :func:`Repository.keys <jsongit.models.Repository.keys>`.
+        """
+        return [key for key, shard in self._merged_keys(prefix)]
+
+    def log(self, key=None, commit=None, **kwargs):
+        """See :func:`Repository.log <jsongit.models.Repository.log>`.
+        """
+        if commit is not None:
+            return commit.repo.log(commit=commit, **kwargs)
+        return self._on('log', key, **kwargs)
+
+    def merge(self, dest, key=None, commit=None, **kwargs):
+        """See :func:`Repository.merge <jsongit.models.Repository.merge>`.
+
+        :raises:
+            :class:`DifferentRepoError <jsongit.DifferentRepoError>` if the
+            source and dest are in different shards.
+        """
+        if key is None and commit is None:
+            raise ValueError('Either a key or a commit must be given')
+        dest_shard, lock = self._route(dest)
+        source_shard = commit.repo if commit is not None else self._route(key)[0]
+        if source_shard is not dest_shard:
+            raise DifferentRepoError("%s and its merge source are in "
+                                     "different shards" % dest)
+        with lock:
+            return dest_shard.merge(dest, key=key, commit=commit, **kwargs)
+
+    def _open_other(self, other):
+        """Open the repository to push to or pull from, which may be sharded,
+        given as an object or a path.
+        """
+        if not isinstance(other, basestring):
+            return other
+        opener = self._shards[0]._open_other
+        if os.path.isfile(os.path.join(other, MANIFEST)):
+            return ShardedRepository(other, [
+                opener(os.path.join(other, name))
+                for name in read_manifest(other)['shards']])
+        return opener(other)
+
+    def persist(self, path):
+        """See :func:`Repository.persist
+        <jsongit.models.Repository.persist>`.  The copy is a sharded
+        repository with the same shards, each persisted in turn.
+
+        :returns: the totals of the results from every shard.
+        :rtype: dict
+        :raises: ValueError if path exists
+        """
+        if os.path.exists(path):
+            raise ValueError("%s already exists" % path)
+        manifest = write_manifest(path, len(self._shards))
+        totals = {}
+        for name, shard, lock in zip(manifest['shards'], self._shards,
+                                     self._locks):
+            with lock:
+                result = shard.persist(os.path.join(path, name))
+            for k, v in result.iteritems():
+                totals[k] = totals.get(k, 0) + v
+        return totals
+
+    def pull(self, other, keys=None):
+        """See :func:`Repository.pull <jsongit.models.Repository.pull>`.
+        Each key is pulled into its shard.
+
+        :param other: the repository to pull from, sharded or not, or its path
+        :type other: :class:`Repository <jsongit.models.Repository>`,
+            :class:`ShardedRepository` or string
+        """
+        other = self._open_other(other)
+        if isinstance(other, ShardedRepository):
+            return other.push(self, keys)
+        results = {}
+        for shard, lock, shard_keys in self._route_many(
+                other.keys() if keys is None else keys):
+            with lock:
+                results.update(shard.pull(other, shard_keys))
+        return results
+
+    def push(self, other, keys=None):
+        """See :func:`Repository.push <jsongit.models.Repository.push>`.
+        Each shard pushes its own keys; into a sharded repository, each key
+        goes to its shard there, however many shards it has.
+
+        :param other: the repository to push to, sharded or not, or its path
+        :type other: :class:`Repository <jsongit.models.Repository>`,
+            :class:`ShardedRepository` or string
+        """
+        other = self._open_other(other)
+        if keys is None:
+            routed = zip(self._shards, self._each('keys'))
+        else:
+            routed = [(shard, shard_keys) for shard, lock, shard_keys
+                      in self._route_many(keys)]
+        results = {}
+        for shard, shard_keys in routed:
+            if not isinstance(other, ShardedRepository):
+                results.update(shard.push(other, shard_keys))
+                continue
+            for other_shard, lock, other_keys in other._route_many(shard_keys):
+                with lock:
+                    results.update(shard.push(other_shard, other_keys))
+        return results
+
+    def remove(self, key, force=False):
+        """See :func:`Repository.remove <jsongit.models.Repository.remove>`.
+        """
+        return self._on('remove', key, force=force)
+
+    def remove_many(self, keys, force=False):
+        """See :func:`Repository.remove_many
+        <jsongit.models.Repository.remove_many>`.  Shards remove their keys
+        in turn, so if one raises, the shards before it have already removed
+        theirs.
+        """
+        for shard, lock, shard_keys in self._route_many(keys):
+            with lock:
+                shard.remove_many(shard_keys, force=force)
+
+    def reset(self, key):
+        """See :func:`Repository.reset <jsongit.models.Repository.reset>`.
+        """
+        return self._on('reset', key)
+
+    def scan(self, predicate=None, projection=None, prefix=None, **kwargs):
+        """See :func:`Repository.scan <jsongit.models.Repository.scan>`.
+        Shards are scanned in turn, and their matches merged in key order
+        unless `ordered` is False.
+        """
+        scans = [shard.scan(predicate, projection, prefix, **kwargs)
+                 for shard in self._shards]
+        if kwargs.get('ordered', True):
+            return heapq.merge(*scans)
+        return itertools.chain(*scans)
+
+    def show(self, key, back=0, at=None):
+        """See :func:`Repository.show <jsongit.models.Repository.show>`.
+        """
+        return self._on('show', key, back=back, at=at)
+
+    def show_many(self, keys, **kwargs):
+        """See :func:`Repository.show_many
+        <jsongit.models.Repository.show_many>`.
+        """
+        return self._on_many('show_many', keys, **kwargs)
+
+    def signature(self, time=None):
+        """See :func:`Repository.signature
+        <jsongit.models.Repository.signature>`.  Every shard is configured
+        alike, so the first one's signature is used.
+        """
+        return self._shards[0].signature(time)
+
+    def snapshot(self):
+        """Record the current repo-level HEAD of every shard, for use with
+        :func:`export`.  Each shard's HEAD is read under its lock, so the
+        snapshot is consistent per shard.
+
+        :returns: a dict of shard names to repo-level commit hexes.
+        :rtype: dict
+        """
+        heads = [head.hex if head else None for head in self._each('_repo_head')]
+        return dict(zip(self._names(), heads))
+
+    def staged(self, key):
+        """See :func:`Repository.staged <jsongit.models.Repository.staged>`.
+        """
+        return self._on('staged', key)
+
+    def stats(self, reset=False):
+        """See :func:`Repository.stats <jsongit.models.Repository.stats>`.
+
+        :returns: a dict of shard names to the stats of each shard.
+        :rtype: dict
+        """
+        return dict(zip(self._names(), self._each('stats', reset=reset)))
+
+    def status(self):
+        """See :func:`Repository.status <jsongit.models.Repository.status>`.
+        """
+        status = {}
+        for shard_status in self._each('status'):
+            status.update(shard_status)
+        return status
+
+    def watch(self, since=None, interval=1.0, timeout=None):
+        """See :func:`Repository.watch <jsongit.models.Repository.watch>`.
+        Every shard's HEAD is polled, so a poll costs one reference lookup
+        per shard.
+
+        :param since:
+            (optional) A :func:`snapshot` to watch from.  Defaults to the
+            current one, so that only new changes are yielded.
+        :type since: dict
+        """
+        if since is None:
+            since = self.snapshot()
+        deadline = None if timeout is None else curtime() + timeout
+        while deadline is None or curtime() < deadline:
+            heads = self.snapshot()
+            if heads != since:
+                # up to the heads seen, as Repository.watch does
+                for change in self.changes(since=since, until=heads):
+                    yield change
+                since = heads
+            else:
+                sleep(interval if deadline is None else
+                      max(0, min(interval, deadline - curtime())))
+
+    def verify_heads(self, repair=True):
+        """See :func:`Repository.verify_heads
+        <jsongit.models.Repository.verify_heads>`.
+        """
+        return list(heapq.merge(*self._each('verify_heads', repair=repair)))
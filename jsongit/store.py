@@ -0,0 +1,813 @@
+# -*- coding: utf-8 -*-
+
+"""
+jsongit.store
+
+A pure-Python stand-in for the parts of :class:`pygit2.Repository` that
+jsongit uses, keeping its objects, references and index in a pluggable
+store instead of a git directory.  Objects are hashed and serialized exactly
+as git does, so oids and histories are the same as they would be on disk.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from binascii import hexlify, unhexlify
+from contextlib import contextmanager
+from time import time as curtime
+
+import pygit2
+
+from .exceptions import NoGlobalSettingError
+import constants
+import odb
+import utils
+
+#: The reference the repo-level HEAD points at.
+HEAD_TARGET = 'refs/heads/master'
+
+_BAD_REF = re.compile(r'(\.\.|@\{|//|/\.|\.lock(/|$)|[\x00-\x20\x7f~^:?*\[\\])')
+
+def check_ref_name(name):
+    """Apply git's rules for reference names.
+
+    :raises: :class:`pygit2.GitError` if name is not valid.
+    """
+    if _BAD_REF.search(name) or name.endswith('/') or name.endswith('.'):
+        raise pygit2.GitError("Failed to create reference '%s'" % name)
+
+def _parse_signature(line):
+    """Parse a signature from a commit header.
+    """
+    name, rest = line.split(' <', 1)
+    email, rest = rest.split('> ', 1)
+    time, offset = rest.split(' ')
+    minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+    return utils.signature(name.decode('utf-8'), email.decode('utf-8'),
+                           int(time), -minutes if offset[0] == '-' else minutes)
+
+def _namespace(name):
+    """The first two components of a reference name, such as `refs/heads/`.
+    """
+    return '/'.join(name.split('/', 2)[:2]) + '/'
+
+class MemoryStore(object):
+    """Keeps a :class:`StoreRepository`'s objects, references, index and
+    configuration in dicts, for repositories that need not outlive the
+    process.
+
+    Any object with the same methods can be used as a store.
+    """
+
+    path = None
+
+    def __init__(self):
+        self._objects = {}
+        self._times = {} # oid -> when it was last written, in UTC seconds
+        self._refs = {}
+        self._namespaces = {} # e.g. 'refs/heads/' -> names of refs in it
+        self._index = {}
+        self._config = {}
+        self._lock = threading.RLock()
+
+    def read(self, oid):
+        """The `(type, data)` of an object.
+
+        :raises: KeyError if there is no such object
+        """
+        return self._objects[oid]
+
+    def write(self, oid, type, data):
+        """Store an object under its oid.
+        """
+        self._objects[oid] = (type, data)
+        # an object written again is fresh, so gc must not prune it yet
+        self._times[oid] = curtime()
+
+    def prune(self, keep, before):
+        """Delete the objects whose oids are not in keep, and which were
+        last written before a time in UTC seconds.
+
+        :returns: the number of objects deleted, and their total size
+        :rtype: tuple
+        """
+        doomed = [oid for oid in self._objects
+                  if oid not in keep and self._times[oid] < before]
+        size = sum(len(self._objects[oid][1]) for oid in doomed)
+        for oid in doomed:
+            del self._objects[oid]
+            del self._times[oid]
+        return len(doomed), size
+
+    def __contains__(self, oid):
+        return oid in self._objects
+
+    def __len__(self):
+        return len(self._objects)
+
+    def get_ref(self, name):
+        """The value of a reference: a raw oid, or `'ref: <target>'` for a
+        symbolic reference.
+
+        :raises: KeyError if there is no such reference
+        """
+        return self._refs[name]
+
+    def set_ref(self, name, value):
+        self._refs[name] = value
+        self._namespaces.setdefault(_namespace(name), set()).add(name)
+
+    def delete_ref(self, name):
+        del self._refs[name]
+        self._namespaces[_namespace(name)].discard(name)
+
+    def ref_names(self, prefix=''):
+        # a prefix within one namespace lists only that namespace, so that
+        # listing indexes does not walk every key
+        if prefix.count('/') < 2:
+            names = self._refs
+        else:
+            names = self._namespaces.get(_namespace(prefix), ())
+        return [name for name in names if name.startswith(prefix)]
+
+    def load_index(self):
+        """The index, as a dict of paths to blob oids.
+        """
+        return dict(self._index)
+
+    def save_index(self, entries, changed=None):
+        """Save the index.
+
+        :param entries: a dict of paths to blob oids
+        :param changed:
+            (optional) The paths changed since the index was last loaded or
+            saved, if they are known, so that only they need be written.
+        """
+        if changed is None:
+            self._index = dict(entries)
+            return
+        for path in changed:
+            if path in entries:
+                self._index[path] = entries[path]
+            else:
+                self._index.pop(path, None)
+
+    def get_config(self, name):
+        """The value of a configuration setting.
+
+        :raises: KeyError if it is not set
+        """
+        return self._config[name]
+
+    def set_config(self, name, value):
+        self._config[name] = value
+
+    @contextmanager
+    def transaction(self):
+        """Group writes.  Nothing is rolled back, but, as with
+        :class:`SqliteStore`, writers sharing the store take turns.
+        """
+        with self._lock:
+            yield
+
+    def close(self):
+        pass
+
+    def destroy(self):
+        """Discard everything in the store.
+        """
+        self.__init__()
+
+class SqliteStore(object):
+    """Keeps a :class:`StoreRepository`'s objects, references, index and
+    configuration as rows of a SQLite database.  This avoids a file per
+    object, which suits many small values better than a git directory.
+    Writes made within :func:`transaction` are committed together.
+
+    >>> repo = jsongit.init(store=jsongit.SqliteStore('path/to/repo.db'))
+
+    :param path: the database file, which is created if it does not exist
+    :type path: string
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._db = sqlite3.connect(path, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.text_factory = str
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction():
+            self._db.execute('CREATE TABLE IF NOT EXISTS objects ('
+                             'oid BLOB PRIMARY KEY, type INTEGER NOT NULL, '
+                             'data BLOB NOT NULL, time INTEGER NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS refs ('
+                             'name TEXT PRIMARY KEY, value BLOB NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS idx ('
+                             'path TEXT PRIMARY KEY, oid BLOB NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS config ('
+                             'name TEXT PRIMARY KEY, value TEXT)')
+
+    def _one(self, sql, args):
+        with self._lock:
+            return self._db.execute(sql, args).fetchone()
+
+    def read(self, oid):
+        row = self._one('SELECT type, data FROM objects WHERE oid = ?',
+                        (sqlite3.Binary(oid),))
+        if row is None:
+            raise KeyError(oid)
+        return row[0], str(row[1])
+
+    def write(self, oid, type, data):
+        # an object written again is fresh, so gc must not prune it yet
+        now = int(curtime())
+        with self.transaction():
+            if not self._db.execute('UPDATE objects SET time = ? WHERE oid = ?',
+                                    (now, sqlite3.Binary(oid))).rowcount:
+                self._db.execute('INSERT INTO objects VALUES (?, ?, ?, ?)',
+                                 (sqlite3.Binary(oid), type,
+                                  sqlite3.Binary(data), now))
+
+    def prune(self, keep, before):
+        with self.transaction():
+            rows = self._db.execute('SELECT oid, length(data) FROM objects '
+                                    'WHERE time < ?', (before,)).fetchall()
+            doomed = [(row[0], row[1]) for row in rows if str(row[0]) not in keep]
+            self._db.executemany('DELETE FROM objects WHERE oid = ?',
+                                 ((oid,) for oid, size in doomed))
+        return len(doomed), sum(size for oid, size in doomed)
+
+    def __contains__(self, oid):
+        return self._one('SELECT 1 FROM objects WHERE oid = ?',
+                         (sqlite3.Binary(oid),)) is not None
+
+    def __len__(self):
+        return self._one('SELECT count(*) FROM objects', ())[0]
+
+    def get_ref(self, name):
+        row = self._one('SELECT value FROM refs WHERE name = ?', (name,))
+        if row is None:
+            raise KeyError(name)
+        return str(row[0])
+
+    def set_ref(self, name, value):
+        with self.transaction():
+            self._db.execute('INSERT OR REPLACE INTO refs VALUES (?, ?)',
+                             (name, sqlite3.Binary(value)))
+
+    def delete_ref(self, name):
+        with self.transaction():
+            if not self._db.execute('DELETE FROM refs WHERE name = ?',
+                                    (name,)).rowcount:
+                raise KeyError(name)
+
+    def ref_names(self, prefix=''):
+        if not prefix:
+            with self._lock:
+                return [row[0] for row in self._db.execute(
+                    'SELECT name FROM refs')]
+        # a range over the primary key, rather than a scan of every name
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                'SELECT name FROM refs WHERE name >= ? AND name < ?',
+                (prefix, end))]
+
+    def load_index(self):
+        with self._lock:
+            return dict((path, str(oid)) for path, oid in
+                        self._db.execute('SELECT path, oid FROM idx'))
+
+    def save_index(self, entries, changed=None):
+        with self.transaction():
+            if changed is None:
+                self._db.execute('DELETE FROM idx')
+                changed = entries
+            for path in changed:
+                if path in entries:
+                    self._db.execute('INSERT OR REPLACE INTO idx VALUES (?, ?)',
+                                     (path, sqlite3.Binary(entries[path])))
+                else:
+                    self._db.execute('DELETE FROM idx WHERE path = ?', (path,))
+
+    def get_config(self, name):
+        row = self._one('SELECT value FROM config WHERE name = ?', (name,))
+        if row is None:
+            raise KeyError(name)
+        return row[0]
+
+    def set_config(self, name, value):
+        with self.transaction():
+            self._db.execute('INSERT OR REPLACE INTO config VALUES (?, ?)',
+                             (name, value))
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth == 0:
+                self._db.execute('BEGIN IMMEDIATE')
+            self._depth += 1
+            try:
+                yield
+            except:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._db.execute('ROLLBACK')
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._db.execute('COMMIT')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def destroy(self):
+        """Close the store and delete its database.
+        """
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+class StoreObject(object):
+    """An object read from a :class:`StoreRepository`.
+    """
+
+    def __init__(self, repo, oid, type, data):
+        self._repo = repo
+        self.oid = oid
+        self.type = type
+        self._raw = data
+
+    @property
+    def hex(self):
+        return hexlify(self.oid)
+
+    def read_raw(self):
+        return self._raw
+
+class Blob(StoreObject):
+
+    @property
+    def data(self):
+        return self._raw
+
+class TreeEntry(object):
+
+    def __init__(self, repo, mode, name, oid):
+        self._repo = repo
+        self.attributes = int(mode, 8)
+        self.name = name
+        self.oid = oid
+
+    @property
+    def hex(self):
+        return hexlify(self.oid)
+
+    def to_object(self):
+        return self._repo[self.oid]
+
+class Tree(StoreObject):
+
+    def __init__(self, repo, oid, type, data):
+        super(Tree, self).__init__(repo, oid, type, data)
+        self._entries = [TreeEntry(repo, mode, name, entry_oid) for
+                         mode, name, entry_oid in odb.parse_tree(data)]
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, long)):
+            return self._entries[item]
+        for entry in self._entries:
+            if entry.name == item:
+                return entry
+        raise KeyError(item)
+
+    def __contains__(self, name):
+        return any(entry.name == name for entry in self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+class Commit(StoreObject):
+
+    def __init__(self, repo, oid, type, data):
+        super(Commit, self).__init__(repo, oid, type, data)
+        headers, message = data.split('\n\n', 1)
+        self.message = message.decode('utf-8')
+        self.parent_ids = []
+        for line in headers.split('\n'):
+            field, value = line.split(' ', 1)
+            if field == 'tree':
+                self.tree_id = unhexlify(value)
+            elif field == 'parent':
+                self.parent_ids.append(unhexlify(value))
+            elif field == 'author':
+                self.author = _parse_signature(value)
+            elif field == 'committer':
+                self.committer = _parse_signature(value)
+        self.commit_time = self.committer.time
+
+    @property
+    def tree(self):
+        return self._repo[self.tree_id]
+
+    @property
+    def parents(self):
+        return [self._repo[oid] for oid in self.parent_ids]
+
+_CLASSES = {
+    pygit2.GIT_OBJ_BLOB: Blob,
+    pygit2.GIT_OBJ_TREE: Tree,
+    pygit2.GIT_OBJ_COMMIT: Commit
+}
+
+class Reference(object):
+
+    def __init__(self, repo, name):
+        self._repo = repo
+        self.name = name
+
+    def _value(self):
+        return self._repo._store.get_ref(self.name)
+
+    @property
+    def oid(self):
+        return self.resolve()._value()
+
+    @oid.setter
+    def oid(self, oid):
+        self._repo._store.set_ref(self.name, oid)
+
+    @property
+    def hex(self):
+        return hexlify(self.oid)
+
+    @property
+    def target(self):
+        value = self._value()
+        return value[5:] if value.startswith('ref: ') else value
+
+    def resolve(self):
+        value = self._value()
+        if value.startswith('ref: '):
+            return self._repo.lookup_reference(value[5:]).resolve()
+        return self
+
+    def delete(self):
+        self._repo._store.delete_ref(self.name)
+
+class IndexEntry(object):
+
+    def __init__(self, path, oid):
+        self.path = path
+        self.oid = oid
+
+    @property
+    def hex(self):
+        return hexlify(self.oid)
+
+class Index(object):
+    """The staging area of a :class:`StoreRepository`, kept in memory and
+    saved to the store by :func:`write`.
+
+    The last tree written or read is remembered, so that :func:`write_tree`
+    only rewrites the trees above entries changed since.
+    """
+
+    def __init__(self, repo):
+        self._repo = repo
+        self._entries = None
+        self._tree = None
+        self._tree_changed = set()
+        self.read()
+
+    def read(self):
+        entries = self._repo._store.load_index()
+        if entries != self._entries:
+            self._tree = None
+            self._tree_changed = set()
+        self._entries = entries
+        self._changed = set()
+
+    def write(self):
+        self._repo._store.save_index(self._entries, self._changed)
+        self._changed = set()
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __getitem__(self, path):
+        return IndexEntry(path, self._entries[path])
+
+    def __delitem__(self, path):
+        del self._entries[path]
+        if self._changed is not None:
+            self._changed.add(path)
+        self._tree_changed.add(path)
+
+    def __iter__(self):
+        return (IndexEntry(path, self._entries[path])
+                for path in sorted(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, entry):
+        self._entries[entry.path] = entry.oid
+        if self._changed is not None:
+            self._changed.add(entry.path)
+        self._tree_changed.add(entry.path)
+
+    def read_tree(self, oid):
+        self._entries = {}
+        self._changed = None # everything
+        self._tree = oid
+        self._tree_changed = set()
+        def flatten(oid, prefix):
+            for mode, name, entry_oid in odb.parse_tree(self._repo[oid].read_raw()):
+                if mode == odb.TREE_MODE:
+                    flatten(entry_oid, prefix + name + '/')
+                else:
+                    self._entries[prefix + name] = entry_oid
+        flatten(oid, '')
+
+    def write_tree(self):
+        if self._tree is not None and self._tree_changed:
+            try:
+                self._tree = self._update_tree(self._tree, self._tree_changed)
+            except ValueError:
+                self._tree = None
+        if self._tree is None:
+            self._tree = self._build_tree()
+        self._tree_changed = set()
+        return self._tree
+
+    def _update_tree(self, oid, paths, prefix=''):
+        """Rewrite the tree at oid for changes to paths, which are relative
+        to prefix.
+
+        :raises:
+            ValueError if a path is both a file and a directory, which needs a
+            full rebuild.
+        """
+        entries = dict((name, (mode, entry_oid)) for mode, name, entry_oid
+                       in odb.parse_tree(self._repo[oid].read_raw())) if oid else {}
+        nested = {}
+        for path in paths:
+            name, sep, rest = path.partition('/')
+            mode = entries.get(name, (None,))[0]
+            if sep:
+                if mode == odb.BLOB_MODE:
+                    raise ValueError(prefix + path)
+                nested.setdefault(name, set()).add(rest)
+            elif mode == odb.TREE_MODE:
+                raise ValueError(prefix + path)
+            elif prefix + path in self._entries:
+                entries[name] = (odb.BLOB_MODE, self._entries[prefix + path])
+            else:
+                entries.pop(name, None)
+        for name, subpaths in nested.iteritems():
+            sub_oid = self._update_tree(entries.get(name, (None, None))[1],
+                                        subpaths, prefix + name + '/')
+            if sub_oid is None:
+                entries.pop(name, None)
+            else:
+                entries[name] = (odb.TREE_MODE, sub_oid)
+        if not entries and prefix:
+            return None
+        return self._repo.write(pygit2.GIT_OBJ_TREE, odb.tree_data(
+            (mode, name, entry_oid) for name, (mode, entry_oid)
+            in entries.iteritems()))
+
+    def _build_tree(self):
+        root = {}
+        # where a path is both a file and a directory, the file wins
+        for path in sorted(self._entries):
+            parts = path.split('/')
+            node = root
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+                if not isinstance(node, dict):
+                    break
+            else:
+                node.setdefault(parts[-1], self._entries[path])
+        def build(node):
+            return self._repo.write(pygit2.GIT_OBJ_TREE, odb.tree_data(
+                (odb.TREE_MODE, name, build(child)) if isinstance(child, dict)
+                else (odb.BLOB_MODE, name, child)
+                for name, child in node.iteritems()))
+        return build(root)
+
+class Config(object):
+    """A repository's configuration, falling back on the global, XDG and
+    system configurations.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, name):
+        try:
+            return self._store.get_config(name)
+        except KeyError:
+            pass
+        try:
+            return utils.global_config(name)
+        except NoGlobalSettingError:
+            raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        self._store.set_config(name, value)
+
+class Walker(object):
+
+    def __init__(self, repo, oid, order):
+        self._repo = repo
+        self._start = oid
+        self._order = order
+        self._hidden = set()
+
+    def hide(self, oid):
+        stack = [oid]
+        while stack:
+            oid = stack.pop()
+            if oid not in self._hidden:
+                self._hidden.add(oid)
+                stack.extend(self._repo[oid].parent_ids)
+
+    def __iter__(self):
+        commits = {}
+        stack = [self._start]
+        while stack:
+            oid = stack.pop()
+            if oid in commits or oid in self._hidden:
+                continue
+            commits[oid] = self._repo[oid]
+            stack.extend(commits[oid].parent_ids)
+
+        # newest first, with every commit before its parents
+        children = dict((oid, 0) for oid in commits)
+        for commit in commits.itervalues():
+            for parent in commit.parent_ids:
+                if parent in children:
+                    children[parent] += 1
+        ready = [oid for oid, count in children.iteritems() if count == 0]
+        ordered = []
+        while ready:
+            ready.sort(key=lambda oid: commits[oid].commit_time)
+            oid = ready.pop()
+            ordered.append(commits[oid])
+            for parent in commits[oid].parent_ids:
+                if parent in children:
+                    children[parent] -= 1
+                    if children[parent] == 0:
+                        ready.append(parent)
+        if self._order & constants.GIT_SORT_REVERSE:
+            ordered.reverse()
+        return iter(ordered)
+
+class StoreRepository(object):
+    """Provides the subset of :class:`pygit2.Repository` that jsongit uses,
+    over a store such as :class:`MemoryStore` or :class:`SqliteStore`.  Use
+    :func:`init <jsongit.init>` with `store` or `memory=True` to obtain a
+    :class:`Repository <jsongit.models.Repository>` backed by one.
+
+    :param store: where to keep everything
+    :type store: :class:`MemoryStore` or :class:`SqliteStore`
+    """
+
+    def __init__(self, store):
+        self._store = store
+        try:
+            store.get_ref('HEAD')
+        except KeyError:
+            store.set_ref('HEAD', 'ref: ' + HEAD_TARGET)
+        self.index = Index(self)
+        self.config = Config(store)
+
+    @property
+    def path(self):
+        """The path of the store, or None if it is in memory.
+        """
+        return self._store.path
+
+    def write(self, type, data):
+        oid = odb.hash_object(type, data)
+        self._store.write(oid, type, data)
+        return oid
+
+    def transaction(self):
+        """A context manager grouping writes to the store.
+        """
+        return self._store.transaction()
+
+    def writer(self):
+        """Obtain something to write many objects with, having the same
+        interface as :class:`PackWriter <jsongit.odb.PackWriter>`.
+        """
+        return StoreWriter(self)
+
+    def __getitem__(self, oid):
+        if len(oid) == 40:
+            oid = unhexlify(oid)
+        type, data = self._store.read(oid)
+        return _CLASSES[type](self, oid, type, data)
+
+    def __contains__(self, oid):
+        return oid in self._store
+
+    def lookup_reference(self, name):
+        self._store.get_ref(name) # throw KeyError
+        return Reference(self, name)
+
+    def create_reference(self, name, oid):
+        check_ref_name(name)
+        # as in git, a reference cannot be where another's directory would be
+        parts = name.split('/')
+        for i in xrange(2, len(parts)):
+            try:
+                self._store.get_ref('/'.join(parts[:i]))
+            except KeyError:
+                continue
+            raise pygit2.GitError("Failed to create reference '%s'" % name)
+        self._store.set_ref(name, oid)
+        return Reference(self, name)
+
+    def listall_references(self):
+        return self.ref_names('refs/')
+
+    def ref_names(self, prefix):
+        """The sorted names of the references under a prefix, without
+        listing any others.
+        """
+        return sorted(self._store.ref_names(prefix))
+
+    def create_commit(self, ref_name, author, committer, message, tree, parents):
+        oid = self.write(pygit2.GIT_OBJ_COMMIT, odb.commit_data(
+            tree, parents, author, committer, message))
+        if ref_name is not None:
+            self.create_reference(ref_name, oid)
+        return oid
+
+    def walk(self, oid, order):
+        return Walker(self, oid, order)
+
+    def prune(self, keep, older_than):
+        """Delete every object whose oid is not in keep and which is at
+        least older_than seconds old.  The index forgets the last tree it
+        wrote, which nothing references, so it may be among them.
+
+        :returns: the number of objects deleted, and their total size
+        :rtype: tuple
+        """
+        self.index._tree = None
+        self.index._tree_changed = set()
+        return self._store.prune(keep, curtime() - older_than)
+
+    def destroy(self):
+        """Discard the store, and everything in it.
+        """
+        self._store.destroy()
+
+class StoreWriter(object):
+    """Writes objects to a :class:`StoreRepository` in one transaction.
+    """
+
+    def __init__(self, repo):
+        self._repo = repo
+        self._oids = set()
+        self._transaction = repo.transaction()
+        self._transaction.__enter__()
+        self.size = 0
+
+    def __contains__(self, oid):
+        return oid in self._oids
+
+    def __len__(self):
+        return len(self._oids)
+
+    def add(self, type, data):
+        oid = self._repo.write(type, data)
+        if oid not in self._oids:
+            self._oids.add(oid)
+            self.size += len(data)
+        return oid
+
+    def abort(self):
+        """Roll back the objects written, in a store that supports
+        transactions.
+        """
+        error = RuntimeError("Write aborted")
+        self._transaction.__exit__(RuntimeError, error, None)
+
+    def close(self):
+        self._transaction.__exit__(None, None, None)
+        return None
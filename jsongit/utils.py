@@ -4,15 +4,56 @@
 jsongit.author
 """
 
-from time import altzone, daylight, timezone
+import calendar
+import datetime
+import os
+import pickle
+from time import altzone, daylight, mktime, timezone
 from time import time as curtime
 from pygit2 import Signature
-import subprocess
+import pygit2
 
 from .exceptions import NoGlobalSettingError
 
-def global_config(name):
-    """Find the value of a `git --global` setting.
+_config_cache = {} # name, or (git path, name) -> value, or (stamp, value)
+
+#: The system time offset in minutes, evaluated once at import.
+LOCAL_OFFSET = altzone / 60 if daylight else timezone / 60
+
+def _default_configs():
+    """Yield the libgit2 configuration files that apply outside of any
+    repository, most specific first.
+    """
+    for getter in ('get_global_config', 'get_xdg_config', 'get_system_config'):
+        try:
+            yield getattr(pygit2.Config, getter)()
+        except (AttributeError, IOError, KeyError, pygit2.GitError):
+            # this level is unsupported by pygit2 or has no file
+            continue
+
+def _config_stamp(git_path):
+    """The identity of every file a git directory's settings may come from,
+    which changes whenever one of its settings may have.  git replaces a
+    configuration file by renaming, so a change gives a new inode even
+    within the resolution of mtime.
+    """
+    xdg = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    stamp = []
+    for path in (os.path.join(git_path, 'config'),
+                 os.path.expanduser('~/.gitconfig'),
+                 os.path.join(xdg, 'git', 'config'), '/etc/gitconfig'):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_ino, st.st_mtime, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+def global_config(name, repo=None):
+    """Find the value of a git configuration setting.  This is resolved
+    in-process through libgit2.  Settings outside of a repository are cached
+    for the lifetime of the process, and those of a git directory until one
+    of its configuration files changes.
 
     >>> jsongit.global_config('user.name')
     'Jon Q. User'
@@ -21,22 +62,46 @@ def global_config(name):
 
     :param name: the name of the setting
     :type name: string
+    :param repo:
+        (optional) A repository whose own configuration should be consulted
+        before the global, XDG and system configurations.
+    :type repo: :class:`pygit2.Repository`
     :return: the value of the setting
     :rtype: string
     :raises: :exc:`NoGlobalSettingError <jsongit.NoGlobalSettingError>`
     """
-    # TODO libgit2 provides an interface for this, but pygit2 does not.  Should
-    # patch pygit2 to provide it.  In the interim, we must use subprocess.
-    popen = subprocess.Popen(['git', 'config', '--global', name],
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-
-    out, err = popen.communicate()
-    if popen.returncode == 0:
-        return out.rstrip()
+    if repo is not None:
+        # a store's settings are read as cheaply as a stamp would be
+        stamp = repo.path and _config_stamp(repo.path)
+        cached = _config_cache.get((repo.path, name))
+        if stamp and cached is not None and cached[0] == stamp:
+            return cached[1]
+        # a repository's config already layers global, XDG and system files
+        try:
+            value = repo.config[name]
+        except KeyError:
+            raise NoGlobalSettingError(name)
+        if stamp:
+            _config_cache[repo.path, name] = stamp, value
+        return value
+
+    try:
+        return _config_cache[name]
+    except KeyError:
+        pass
+
+    for config in _default_configs():
+        try:
+            value = config[name]
+            break
+        except KeyError:
+            continue
     else:
         raise NoGlobalSettingError(name)
 
+    _config_cache[name] = value
+    return value
+
 def signature(name, email, time=None, offset=None):
     """Convenience method to generate pygit2 signatures.
 
@@ -55,10 +120,63 @@ def signature(name, email, time=None, offset=None):
     :returns: a signature
     :rtype: pygit2.Signature
     """
-    offset = offset or (altzone / 60 if daylight else timezone / 60)
-    time = time or int(curtime())
+    offset = LOCAL_OFFSET if offset is None else offset
+    time = int(curtime()) if time is None else time
     return Signature(name, email, time, offset)
 
+def to_epoch(when):
+    """Convert a time to UTC seconds.
+
+    :param when:
+        A :class:`datetime.datetime`, which is taken to be local time if it
+        has no tzinfo, or a number of UTC seconds.
+    :type when: datetime or number
+
+    :returns: UTC seconds
+    :rtype: number
+    """
+    if isinstance(when, datetime.datetime):
+        if when.tzinfo is None:
+            return mktime(when.timetuple()) + when.microsecond / 1e6
+        return calendar.timegm(when.utctimetuple()) + when.microsecond / 1e6
+    return when
+
+#: Stands in for a value that does not exist, since None is a valid value.
+MISSING = object()
+
+def get_path(value, path):
+    """Follow a dotted path into nested dicts and lists.
+
+    >>> get_path({'result': {'errors': ['disk full']}}, 'result.errors.0')
+    'disk full'
+
+    :param value: the value to look into, or :const:`MISSING`
+    :param path: steps separated by dots
+    :type path: string
+
+    :returns: the value at path, or :const:`MISSING` if there is none.
+    """
+    for step in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(step, MISSING)
+        elif isinstance(value, list):
+            try:
+                value = value[int(step)]
+            except (ValueError, IndexError):
+                return MISSING
+        else:
+            return MISSING
+    return value
+
+def picklable(obj):
+    """Whether obj can be pickled, and so passed to another process.
+    """
+    try:
+        pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return False
+    return True
+
 def import_json():
     try:
         import simplejson
@@ -12,14 +12,16 @@ import copy
 
 class Commit(object):
     """A wrapper around :class:`pygit2.Commit` linking to a single key in the
-    repo.
+    repo.  If a blob_id is given instead of data, the data is only loaded
+    from the repo when it is first needed.
     """
 
-    def __init__(self, repo, key, data, pygit2_commit):
+    def __init__(self, repo, key, data, pygit2_commit, blob_id=None):
         self._commit = pygit2_commit
         self._repo = repo
         self._key = key
         self._data = data
+        self._blob_id = blob_id
 
     def __eq__(self, other):
         return self.oid == other.oid
@@ -38,6 +40,9 @@ class Commit(object):
         :returns: the data associated with this commit.
         :rtype: Boolean, Number, None, String, Dict, or List
         """
+        if self._blob_id is not None:
+            self._data = self._repo._decode(self._repo._repo[self._blob_id].data)
+            self._blob_id = None
         return self._data
 
     @property
@@ -159,6 +164,29 @@ class DiffWrapper(object):
         """
         return self._replace
 
+    def to_json_diff(self):
+        """A plain representation of this diff that can be serialized and
+        later wrapped again.
+
+        >>> diff = Diff({'roses': 'red'}, {'roses': 'red', 'violets': 'blue'})
+        >>> plain = diff.to_json_diff()
+        >>> plain
+        {'_append': {u'violets': u'blue'}}
+        >>> DiffWrapper(plain).apply({'roses': 'red'})
+        {'roses': 'red', u'violets': u'blue'}
+
+        :returns:
+            the :mod:`json_diff` dict, or the replacement value if the diff
+            simply replaces.
+        """
+        if not Diff.is_json_diff(self._diff):
+            return self._replace
+        plain = dict(self._diff)
+        if Diff.UPDATE in plain:
+            plain[Diff.UPDATE] = dict((k, v.to_json_diff())
+                                      for k, v in plain[Diff.UPDATE].iteritems())
+        return plain
+
     def apply(self, original):
         """Return an object modified with the changes in this diff.
 
@@ -338,3 +366,53 @@ class Merge(object):
         """The message associated with this merge.
         """
         return self._message
+
+
+class Change(object):
+    """A class wrapper for a change to one key in a repo-level commit, as
+    yielded by :func:`Repository.changes <jsongit.models.Repository.changes>`.
+    """
+
+    def __init__(self, key, old, new, commit):
+        self._key = key
+        self._old = old
+        self._new = new
+        self._commit = commit
+
+    def __iter__(self):
+        return iter((self.key, self.old, self.new, self.commit))
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __str__(self):
+        return "'%s' %s..%s@%s" % (self.key, (self.old or '0' * 10)[0:10],
+                                   (self.new or '0' * 10)[0:10],
+                                   self.commit[0:10])
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, self.__str__())
+
+    @property
+    def key(self):
+        """The key that changed.
+        """
+        return self._key
+
+    @property
+    def old(self):
+        """The hex of the blob the key had before, or None if it was added.
+        """
+        return self._old
+
+    @property
+    def new(self):
+        """The hex of the blob the key has now, or None if it was removed.
+        """
+        return self._new
+
+    @property
+    def commit(self):
+        """The hex of the repo-level commit with the change.
+        """
+        return self._commit
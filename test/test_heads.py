@@ -0,0 +1,78 @@
+import os
+
+from helpers import unittest
+import jsongit
+
+PATH = 'test_jsongit_heads'
+
+class TestHeadTable(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.lexists(PATH):
+            self.fail("Can't use %s for test repo, something is there." % PATH)
+        self.repo = jsongit.init(PATH, head_table=True)
+
+    def tearDown(self):
+        self.repo.destroy()
+
+    def test_follows_commits(self):
+        """Commits and removes keep the table current.
+        """
+        self.repo.commit('foo', 'step 1')
+        self.repo.commit('foo', 'step 2')
+        self.repo.commit('bar', 'baz')
+        self.repo.remove('bar')
+        self.assertEqual('step 2', self.repo.show('foo'))
+        self.assertEqual('step 1', self.repo.show('foo', back=1))
+        self.assertTrue(self.repo.committed('foo'))
+        self.assertFalse(self.repo.committed('bar'))
+        self.assertEqual([], self.repo.verify_heads(repair=False))
+
+    def test_verify_repairs(self):
+        """A wrong table is found and rebuilt from the references.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo._head_table.update({}, ['foo'], self.repo._repo_head().hex)
+        self.assertFalse(self.repo.committed('foo'))
+        self.assertEqual(['foo'], self.repo.verify_heads())
+        self.assertEqual('bar', self.repo.show('foo'))
+
+    def test_reopen_rebuilds_stale(self):
+        """Opening a repository whose HEAD moved without the table rebuilds
+        the table.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo._head_table.update({}, ['foo'], repo_head='stale')
+        self.repo = jsongit.init(PATH)
+        self.assertEqual('bar', self.repo.show('foo'))
+
+    def test_reads_rebuild_stale(self):
+        """Reading through a handle rebuilds the table when another writer
+        has moved the repo-level HEAD without keeping the table.
+        """
+        self.repo.commit('foo', 'bar')
+        self.assertEqual('bar', self.repo.show('foo'))
+        other = jsongit.init(PATH)
+        other._head_table = None
+        other.commit('foo', 'baz')
+        other.commit('new', 'key')
+        self.assertEqual('baz', self.repo.show('foo'))
+        self.assertTrue(self.repo.committed('new'))
+        self.assertEqual([], self.repo.verify_heads(repair=False))
+
+    def test_bulk_import(self):
+        """Imports are recorded in the table.
+        """
+        jsongit.bulk_import(self.repo, [('foo', 1), ('bar', 2)])
+        self.assertEqual(2, self.repo.show('bar'))
+        self.assertEqual([], self.repo.verify_heads(repair=False))
+
+    def test_no_table(self):
+        """Repositories without a table cannot verify it.
+        """
+        repo = jsongit.init('test_jsongit_no_heads')
+        try:
+            with self.assertRaises(ValueError):
+                repo.verify_heads()
+        finally:
+            repo.destroy()
@@ -0,0 +1,79 @@
+from helpers import RepoTestCase
+
+import jsongit
+
+class TestBulkImport(RepoTestCase):
+
+    def test_import_lines(self):
+        """Can import JSON lines.
+        """
+        jsongit.bulk_import(self.repo, ['{"key": "foo", "value": {"roses": "red"}}',
+                                        '["bar", [1, 2, 3]]'])
+        self.assertEqual({'roses': 'red'}, self.repo.show('foo'))
+        self.assertEqual([1, 2, 3], self.repo.show('bar'))
+        self.assertFalse(self.repo.staged('foo'))
+
+    def test_import_history(self):
+        """Several records for one key become its history, with their times.
+        """
+        result = jsongit.bulk_import(self.repo, [('foo', 'step 1', 1332438935),
+                                                 ('foo', 'step 2', 1332439935)])
+        self.assertEqual({'records': 2, 'keys': 1}, dict(
+            (k, result[k]) for k in ('records', 'keys')))
+        self.assertEqual('step 2', self.repo.show('foo'))
+        self.assertEqual('step 1', self.repo.show('foo', back=1))
+        self.assertEqual(1332438935, self.repo.head('foo', back=1).time)
+
+    def test_import_onto_existing(self):
+        """Imported values continue an existing key's history.
+        """
+        self.repo.commit('foo', 'committed')
+        self.repo.add('staged', 'value')
+        jsongit.bulk_import(self.repo, [('foo', 'imported')])
+        self.assertEqual('imported', self.repo.show('foo'))
+        self.assertEqual('committed', self.repo.show('foo', back=1))
+        self.assertTrue(self.repo.staged('staged'))
+        self.repo.commit('foo', 'after')
+        self.assertEqual('imported', self.repo.show('foo', back=1))
+
+    def test_show_many_packed(self):
+        """Imported keys are found in packed references, and later commits
+        in loose ones.
+        """
+        jsongit.bulk_import(self.repo, [('foo', 'imported'), ('bar', 'imported')])
+        self.repo.commit('foo', 'committed')
+        self.assertEqual({'foo': 'committed', 'bar': 'imported'},
+                         self.repo.show_many(['foo', 'bar', 'baz']))
+
+    def test_import_author(self):
+        """Can give each record an author.
+        """
+        jsongit.bulk_import(self.repo, [
+            {'key': 'foo', 'value': 1,
+             'author': {'name': 'sally', 'email': 's@s.com'}}])
+        self.assertEqual('sally', self.repo.head('foo').author.name)
+
+    def test_import_signature_time(self):
+        """A record's time applies to a signature given as its author.
+        """
+        sally = jsongit.utils.signature('sally', 's@s.com', 1000)
+        jsongit.bulk_import(self.repo, [('foo', 1, 1332438935, sally)])
+        author = self.repo.head('foo').author
+        self.assertEqual('sally', author.name)
+        self.assertEqual(1332438935, author.time)
+
+    def test_import_invalid_key(self):
+        """Bad keys raise InvalidKeyError.
+        """
+        with self.assertRaises(jsongit.InvalidKeyError):
+            jsongit.bulk_import(self.repo, [('/foo', 'bar')])
+
+    def test_import_failure_imports_nothing(self):
+        """A bad record leaves the repository as it was.
+        """
+        self.repo.commit('foo', 'committed')
+        with self.assertRaises(jsongit.InvalidKeyError):
+            jsongit.bulk_import(self.repo, [('foo', 'imported'),
+                                            ('/bar', 'imported')])
+        self.assertEqual('committed', self.repo.show('foo'))
+        self.assertEqual(['foo'], self.repo.keys())
@@ -0,0 +1,129 @@
+import json
+
+from helpers import RepoTestCase
+
+import jsongit
+
+class TestIndexes(RepoTestCase):
+
+    def test_index_existing(self):
+        """Creating an index covers values already committed.
+        """
+        self.repo.commit('job1', {'status': 'failed'})
+        self.repo.commit('job2', {'status': 'ok'})
+        self.repo.commit('job3', {'status': 'failed'})
+        self.repo.create_index('status', path='status')
+        self.assertEqual(['job1', 'job3'], self.repo.find('status', 'failed'))
+        self.assertEqual(['job2'], self.repo.find('status', 'ok'))
+        self.assertEqual([], self.repo.find('status', 'pending'))
+
+    def test_index_follows_commits(self):
+        """Commits move keys between values.
+        """
+        self.repo.create_index('status', path='status')
+        self.repo.commit('job1', {'status': 'pending'})
+        self.repo.commit('job1', {'status': 'failed'})
+        self.assertEqual([], self.repo.find('status', 'pending'))
+        self.assertEqual(['job1'], self.repo.find('status', 'failed'))
+
+    def test_index_nested_path(self):
+        """Paths can reach into nested dicts and lists.
+        """
+        self.repo.create_index('first_error', path='result.errors.0')
+        self.repo.commit('job1', {'result': {'errors': ['disk full']}})
+        self.repo.commit('job2', {'result': {'errors': []}})
+        self.repo.commit('job3', 'not a dict')
+        self.assertEqual(['job1'], self.repo.find('first_error', 'disk full'))
+
+    def test_index_follows_remove(self):
+        """Removed keys leave the index.
+        """
+        self.repo.create_index('status', path='status')
+        self.repo.commit('job1', {'status': 'failed'})
+        self.repo.remove('job1')
+        self.assertEqual([], self.repo.find('status', 'failed'))
+
+    def test_index_is_not_a_key(self):
+        """Indexes do not show up as keys, and persist in the repo.
+        """
+        self.repo.create_index('status', path='status')
+        self.repo.commit('job1', {'status': 'failed'})
+        self.assertEqual(['job1'], self.repo.keys())
+        reopened = jsongit.init(self.repo._repo.path)
+        self.assertEqual(['job1'], reopened.find('status', 'failed'))
+
+    def test_duplicate_index(self):
+        """Cannot create two indexes with one name.
+        """
+        self.repo.create_index('status', path='status')
+        with self.assertRaises(ValueError):
+            self.repo.create_index('status', path='other')
+
+    def test_drop_index(self):
+        """Dropped indexes can no longer be used.
+        """
+        self.repo.create_index('status', path='status')
+        self.repo.drop_index('status')
+        with self.assertRaises(KeyError):
+            self.repo.find('status', 'failed')
+
+    def test_index_bool_and_number(self):
+        """Values that compare equal but encode differently, like 1 and
+        True, are indexed apart.
+        """
+        self.repo.create_index('flag', path='flag')
+        self.repo.commit('job1', {'flag': 1})
+        self.repo.commit('job1', {'flag': True})
+        self.assertEqual([], self.repo.find('flag', 1))
+        self.assertEqual(['job1'], self.repo.find('flag', True))
+
+    def test_index_shards_keys(self):
+        """Keys sharing a value are split into shards by key, so committing
+        one key does not rewrite the list of every other.
+        """
+        self.repo.create_index('status', path='status')
+        for i in range(50):
+            self.repo.commit('job%d' % i, {'status': 'pending'})
+        index = self.repo._repo.lookup_reference(
+            'refs/jsongit-indexes/status').oid
+        shard = self.repo._navigate_tree(self.repo._repo[index].tree.oid,
+                                         self.repo._bucket('pending', 'job0'))
+        self.assertIn('job0', json.loads(self.repo._repo[shard].data)['keys'])
+        self.assertLess(len(json.loads(self.repo._repo[shard].data)['keys']),
+                        50)
+        self.assertEqual(sorted('job%d' % i for i in range(50)),
+                         self.repo.find('status', 'pending'))
+
+    def test_index_from_other_handle(self):
+        """Indexes created or dropped through another handle are kept up to
+        date.
+        """
+        other = jsongit.init(repo=self.repo._repo)
+        self.repo.commit('job1', {'status': 'pending'})
+        other.create_index('status', path='status')
+        self.repo.commit('job1', {'status': 'failed'})
+        self.assertEqual(['job1'], other.find('status', 'failed'))
+        other.drop_index('status')
+        self.repo.commit('job1', {'status': 'ok'})
+        with self.assertRaises(KeyError):
+            self.repo.find('status', 'ok')
+
+    def test_index_from_other_process(self):
+        """Indexes created or dropped through a separately opened repository
+        are seen once they have been listed, even after bulk imports.
+        """
+        self.repo.commit('job1', {'status': 'pending'})
+        self.repo.commit('job2', {'status': 'pending'})
+        other = jsongit.init(path='test_jsongit_repo')
+        other.create_index('status', path='status')
+        self.repo.commit('job1', {'status': 'failed'})
+        self.assertEqual(['job1'], other.find('status', 'failed'))
+        jsongit.bulk_import(
+            self.repo, ['{"key": "job3", "value": {"status": "failed"}}'])
+        self.repo.commit('job2', {'status': 'failed'})
+        self.assertEqual(['job1', 'job2', 'job3'],
+                         sorted(other.find('status', 'failed')))
+        other.drop_index('status')
+        self.repo.commit('job1', {'status': 'ok'})
+        with self.assertRaises(KeyError):
+            self.repo.find('status', 'ok')
@@ -1,5 +1,7 @@
 from helpers import RepoTestCase
 
+import datetime
+
 import jsongit
 
 class TestLog(RepoTestCase):
@@ -101,3 +103,32 @@ class TestLog(RepoTestCase):
         with self.assertRaises(StopIteration):
             gen.next()
 
+
+    def test_show_at_time(self):
+        """Can show the value as of a time.
+        """
+        self.repo.commit('foo', 'step 1', time=1000)
+        self.repo.commit('foo', 'step 2', time=2000)
+        self.repo.commit('foo', 'step 3', time=3000)
+        self.assertEquals('step 1', self.repo.show('foo', at=1500))
+        self.assertEquals('step 2', self.repo.show('foo', at=2000))
+        self.assertEquals('step 3', self.repo.show('foo', at=9999))
+        with self.assertRaises(IndexError):
+            self.repo.show('foo', at=999)
+
+    def test_show_at_after_commit(self):
+        """The time index follows new commits.
+        """
+        self.repo.commit('foo', 'step 1', time=1000)
+        self.assertEquals('step 1', self.repo.show('foo', at=5000))
+        self.repo.commit('foo', 'step 2', time=2000)
+        self.assertEquals('step 2', self.repo.show('foo', at=5000))
+        self.assertEquals(2000, self.repo.head('foo', at=5000).time)
+
+    def test_show_at_datetime(self):
+        """Can use datetimes for time.
+        """
+        when = datetime.datetime(2012, 3, 22, 14, 0)
+        self.repo.commit('foo', 'then', time=int(jsongit.utils.to_epoch(when)))
+        self.repo.commit('foo', 'later', time=int(jsongit.utils.to_epoch(when)) + 60)
+        self.assertEquals('then', self.repo.show('foo', at=when))
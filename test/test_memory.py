@@ -0,0 +1,97 @@
+from helpers import RepoTestCase, unittest
+import jsongit
+
+PERSISTED = 'test_jsongit_persisted'
+
+class TestMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.repo = jsongit.init(memory=True)
+
+    def tearDown(self):
+        self.repo.destroy()
+
+    def test_commit_and_show(self):
+        """A repository in memory keeps values and their history.
+        """
+        self.repo.commit('foo', 'step 1')
+        self.repo.commit('foo', 'step 2')
+        self.repo.add('bar', 'staged')
+        self.assertEqual('step 2', self.repo.show('foo'))
+        self.assertEqual('step 1', self.repo.show('foo', back=1))
+        self.assertTrue(self.repo.staged('bar'))
+        self.assertEqual(['foo'], self.repo.keys())
+
+    def test_memory_with_path(self):
+        """Memory and a path are exclusive.
+        """
+        with self.assertRaises(TypeError):
+            jsongit.init('test_jsongit_memory', memory=True)
+
+    def test_separate(self):
+        """Repositories in memory are distinct.
+        """
+        other = jsongit.init(memory=True)
+        other.commit('foo', 'bar')
+        self.assertFalse(self.repo.committed('foo'))
+        self.assertNotEqual(self.repo, other)
+
+    def test_index_tree(self):
+        """The index rewrites only changed trees, matching a full rebuild.
+        """
+        for i in xrange(20):
+            self.repo.add('key%d' % i, i)
+        self.repo.commit()
+        self.repo.add('key3', 'changed')
+        self.repo.add('path/to/key', 'added')
+        self.repo.remove('key5', force=True)
+        index = self.repo._repo.index
+        self.assertEqual(index._build_tree(), index.write_tree())
+        self.repo.commit()
+        self.assertEqual('changed', self.repo.show('key3'))
+        self.assertEqual('added', self.repo.show('path/to/key'))
+        self.assertFalse(self.repo.committed('key5'))
+
+    def test_gc(self):
+        """Removed keys are pruned once old enough, and the index can still
+        write trees afterwards.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.commit('removed', 'baz')
+        self.repo.remove('removed')
+        self.repo.add('staged', 'value')
+        self.repo._repo.index.write_tree()
+        self.assertEqual(0, self.repo.gc()['pruned'])
+        self.assertTrue(self.repo.gc(prune_older_than=0)['pruned'] > 0)
+        self.repo.add('more', 'value')
+        self.repo.commit()
+        self.assertEqual('bar', self.repo.show('foo'))
+        self.assertEqual('value', self.repo.show('staged'))
+        self.assertEqual(['foo', 'more', 'staged'], sorted(self.repo.keys()))
+
+    def test_persist(self):
+        """Persisting writes a repository on disk with the same history.
+        """
+        self.repo.commit('foo', 'step 1')
+        self.repo.commit('foo', 'step 2')
+        self.repo.add('bar', 'staged')
+        self.repo.persist(PERSISTED)
+        persisted = jsongit.init(PERSISTED)
+        try:
+            self.assertEqual('step 1', persisted.show('foo', back=1))
+            self.assertEqual(self.repo.head('foo'), persisted.head('foo'))
+            self.assertEqual('staged', persisted.index('bar'))
+        finally:
+            persisted.destroy()
+
+class TestSameOids(RepoTestCase):
+
+    def test_same_oids(self):
+        """Commits in memory have the oids they would have on disk.
+        """
+        memory = jsongit.init(memory=True)
+        author = jsongit.signature('sally', 's@s.com', time=1332438935, offset=0)
+        for repo in (self.repo, memory):
+            repo.commit('foo', {'roses': 'red'}, author=author)
+            repo.commit('foo', {'roses': 'pink'}, author=author)
+        self.assertEqual(self.repo.head('foo').hex, memory.head('foo').hex)
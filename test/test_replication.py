@@ -0,0 +1,69 @@
+import os
+
+from helpers import RepoTestCase
+import jsongit
+
+REPLICA = 'test_jsongit_replica'
+
+class TestReplication(RepoTestCase):
+
+    def setUp(self):
+        super(TestReplication, self).setUp()
+        if os.path.lexists(REPLICA):
+            self.fail("Can't use %s for test repo, something is there." % REPLICA)
+        self.replica = jsongit.init(REPLICA)
+
+    def tearDown(self):
+        self.replica.destroy()
+        super(TestReplication, self).tearDown()
+
+    def test_push_creates(self):
+        """Pushing copies keys and their history.
+        """
+        self.repo.commit('foo', 'step 1')
+        self.repo.commit('foo', 'step 2')
+        self.assertEqual({'foo': 'created'}, self.repo.push(REPLICA))
+        self.replica = jsongit.init(REPLICA)
+        self.assertEqual('step 2', self.replica.show('foo'))
+        self.assertEqual('step 1', self.replica.show('foo', back=1))
+        self.assertEqual(self.repo.head('foo'), self.replica.head('foo'))
+        self.assertFalse(self.replica.staged('foo'))
+
+    def test_pull_fast_forward(self):
+        """Pulling moves heads forward and leaves others alone.
+        """
+        self.repo.commit('foo', 'step 1')
+        self.repo.commit('bar', 'baz')
+        self.replica.pull(self.repo)
+        self.repo.commit('foo', 'step 2')
+        self.assertEqual({'foo': 'fast-forward', 'bar': 'up-to-date'},
+                         self.replica.pull(self.repo))
+        self.assertEqual('step 2', self.replica.show('foo'))
+
+    def test_pull_ahead(self):
+        """Pulling an older head does nothing.
+        """
+        self.repo.commit('foo', 'step 1')
+        self.replica.pull(self.repo)
+        self.replica.commit('foo', 'step 2')
+        self.assertEqual({'foo': 'ahead'}, self.replica.pull(self.repo))
+        self.assertEqual('step 2', self.replica.show('foo'))
+
+    def test_pull_diverged(self):
+        """Diverged histories are merged.
+        """
+        self.repo.commit('foo', {'roses': 'red'})
+        self.replica.pull(self.repo)
+        self.repo.commit('foo', {'roses': 'red', 'violets': 'blue'})
+        self.replica.commit('foo', {'roses': 'red', 'lilacs': 'purple'})
+        self.assertEqual({'foo': 'merged'}, self.replica.pull(self.repo))
+        self.assertEqual({'roses': 'red', 'violets': 'blue', 'lilacs': 'purple'},
+                         self.replica.show('foo'))
+
+    def test_pull_some_keys(self):
+        """Can replicate only some keys.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.commit('baz', 'qux')
+        self.replica.pull(self.repo, keys=['foo'])
+        self.assertEqual(['foo'], self.replica.keys())
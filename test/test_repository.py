@@ -1,7 +1,10 @@
 import jsongit
 import helpers
 import os
+import threading
 import json
+from StringIO import StringIO
+from binascii import unhexlify
 # import pygit2
 # import shutil
 
@@ -52,6 +55,64 @@ class TestJsonGitRepository(helpers.RepoTestCase):
         self.assertFalse(self.repo.staged('foo'))
         self.assertFalse(self.repo.committed('foo'))
 
+    def test_staged_same_value_other_encoding(self):
+        """A value encoded differently but equal is not staged.
+        """
+        self.repo.commit('foo', {'roses': 'red'})
+        indented = jsongit.init(repo=self.repo._repo,
+                                dumps=lambda v: json.dumps(v, indent=2))
+        indented.add('foo', {'roses': 'red'})
+        self.assertFalse(self.repo.staged('foo'))
+        indented.add('foo', {'roses': 'pink'})
+        self.assertTrue(self.repo.staged('foo'))
+
+    def test_status(self):
+        """Status lists the staged keys.
+        """
+        self.assertEqual({}, self.repo.status())
+        self.repo.commit('huey', 'short')
+        self.repo.commit('louie', 'same')
+        self.repo.add('huey', 'long')
+        self.repo.add('dewey', 'short')
+        self.repo.add('louie', 'same')
+        self.assertEqual({'huey': 'modified', 'dewey': 'added'},
+                         self.repo.status())
+        self.repo.commit()
+        self.assertEqual({}, self.repo.status())
+
+    def test_show_many(self):
+        """Many keys can be shown at once, leaving out missing keys.
+        """
+        self.repo.commit('president', 'washington')
+        self.repo.commit('president', 'madison')
+        self.repo.commit('vice', 'clinton')
+        self.assertEqual({'president': 'madison', 'vice': 'clinton'},
+                         self.repo.show_many(['president', 'vice', 'treasurer']))
+        self.assertEqual({}, self.repo.show_many([]))
+        heads = self.repo.head_many(['vice', 'treasurer'])
+        self.assertEqual(['vice'], heads.keys())
+        self.assertEqual(self.repo.head('vice'), heads['vice'])
+
+    def test_show_many_workers(self):
+        """Values can be decoded in worker processes.
+        """
+        keys = ['key%02d' % i for i in range(10)]
+        for i, key in enumerate(keys):
+            self.repo.commit(key, {'i': i})
+        self.assertEqual(dict((key, {'i': i}) for i, key in enumerate(keys)),
+                         self.repo.show_many(keys + ['missing'], workers=2,
+                                             chunk_size=3))
+
+    def test_show_many_workers_unpicklable(self):
+        """Values are decoded in this process when loads cannot be sent to
+        workers.
+        """
+        self.repo.commit('foo', {'roses': 'red'})
+        repo = jsongit.init(repo=self.repo._repo,
+                            loads=lambda raw: json.loads(raw)['roses'])
+        self.assertEqual({'foo': 'red'},
+                         repo.show_many(['foo', 'missing'], workers=2))
+
     def test_show_nonexistent(self):
         """
         Arbitrary path should cause KeyError
@@ -141,6 +202,109 @@ class TestJsonGitRepository(helpers.RepoTestCase):
         self.assertEquals('sally', commit.author.name)
         self.assertEquals('s@s.com', commit.author.email)
 
+    def test_commit_fixed_time(self):
+        """Can commit with a fixed time for the default author.
+        """
+        self.repo.commit('foo', 'bar', time=1332438935)
+        self.assertEquals(1332438935, self.repo.head('foo').author.time)
+
+    def test_commit_direct(self):
+        """A direct commit replaces an existing index entry and leaves the
+        rest of the index alone.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.add('staged', 'value')
+        self.repo.commit('foo', 'baz', direct=True)
+        self.repo.commit('new', 'key', direct=True)
+        self.assertEqual('baz', self.repo.show('foo'))
+        self.assertEqual('bar', self.repo.show('foo', back=1))
+        self.assertEqual('key', self.repo.show('new'))
+        self.assertEqual('baz', self.repo.index('foo'))
+        self.assertTrue(self.repo.staged('staged'))
+        self.assertEqual(['foo', 'foo', 'new'],
+                         [change.key for change in self.repo.changes()])
+
+    def test_commit_direct_concurrently(self):
+        """Direct writers through different handles keep each other's keys
+        in the repo-level tree.
+        """
+        self.repo.commit('first', 'value')
+        def write(repo, name):
+            for i in range(20):
+                repo.commit('%s%d' % (name, i), i, direct=True)
+        writers = [threading.Thread(target=write,
+                                    args=(jsongit.init(helpers.PATH), name))
+                   for name in ('a', 'b')]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        expected = ['first'] + ['%s%d' % (name, i) for name in ('a', 'b')
+                                for i in range(20)]
+        self.assertEqual(sorted(expected),
+                         sorted(change.key for change in self.repo.changes()))
+
+    def test_commit_direct_then_indexed(self):
+        """Direct and indexed commits can be mixed without either undoing
+        the other.
+        """
+        self.repo.commit('foo', 'step 1')
+        self.repo.commit('foo', 'step 2', direct=True)
+        self.repo.commit('new', 'direct', direct=True)
+        self.assertFalse(self.repo.staged('foo'))
+        self.assertFalse(self.repo.staged('new'))
+        self.repo.commit('other', 'indexed')
+        self.repo.commit()
+        self.assertEqual('step 2', self.repo.show('foo'))
+        self.assertEqual('direct', self.repo.show('new'))
+        self.assertEqual('indexed', self.repo.show('other'))
+        changes = list(self.repo.changes())
+        self.assertEqual(['foo', 'foo', 'new', 'other'],
+                         sorted(change.key for change in changes))
+        self.assertEqual([], list(self.repo.changes(changes[-1].commit)))
+        self.repo.remove('foo')
+        self.assertEqual(['new', 'other'], self.repo.keys())
+
+    def test_commit_skip_unchanged(self):
+        """An unchanged value can be committed without writing anything.
+        Direct commits skip unchanged values by default.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.commit('foo', 'bar', skip_unchanged=True)
+        self.repo.commit('foo', 'bar', direct=True)
+        self.assertEqual(1, len(list(self.repo.log('foo'))))
+        self.assertEqual(2, self.repo.stats()['counters']['commits.suppressed'])
+        self.repo.commit('foo', 'bar')
+        self.assertEqual(2, len(list(self.repo.log('foo'))))
+
+    def test_deferred_index(self):
+        """A deferred index is written only on flush or commit.
+        """
+        deferred = jsongit.init(repo=self.repo._repo, defer_index=True)
+        reader = jsongit.init(helpers.PATH)
+        deferred.add('foo', 'bar')
+        deferred.add('baz', 'qux')
+        self.assertEqual('bar', deferred.index('foo'))
+        with self.assertRaises(KeyError):
+            reader.index('foo')
+        deferred.flush()
+        self.assertEqual('bar', reader.index('foo'))
+        deferred.add('foo', 'changed')
+        deferred.commit()
+        self.assertEqual('changed', reader.index('foo'))
+        self.assertEqual('qux', reader.show('baz'))
+
+    def test_commit_multiple_keys_own_parents(self):
+        """Each key in a multi-key commit is parented on its own history.
+        """
+        self.repo.commit('roses', 'red')
+        self.repo.commit('violets', 'blue')
+        self.repo.add('roses', 'pink')
+        self.repo.add('violets', 'purple')
+        self.repo.commit()
+        self.assertEquals('red', self.repo.show('roses', back=1))
+        self.assertEquals('blue', self.repo.show('violets', back=1))
+
     def test_show_old(self):
         """Show old data.
         """
@@ -194,6 +358,16 @@ class TestJsonGitRepository(helpers.RepoTestCase):
         self.repo.commit('foo', {'roses': 'red'})
         with self.assertRaises(ValueError):
             self.repo.merge('foo', 'foo')
+        self.repo.commit('foo', {'violets': 'blue'})
+        with self.assertRaises(ValueError):
+            self.repo.merge('foo', commit=self.repo.head('foo', back=1))
+
+    def test_merge_nothing(self):
+        """Merging needs a key or a commit.
+        """
+        self.repo.commit('foo', {'roses': 'red'})
+        with self.assertRaises(ValueError):
+            self.repo.merge('foo')
 
     def test_commit_updating(self):
         """
@@ -237,10 +411,50 @@ class TestJsonGitRepository(helpers.RepoTestCase):
         head_ref = pygit2_repo.lookup_reference('HEAD').resolve()
         head_commit = pygit2_repo[head_ref.oid]
         tree = head_commit.tree
-        self.assertIn('roses', tree)
-        self.assertIn('violets', tree)
-        self.assertEquals(json.dumps('red'), tree['roses'].to_object().data)
-        self.assertEquals(json.dumps('blue'), tree['violets'].to_object().data)
+        roses = self.repo._navigate_tree(tree.oid, self.repo._key2path('roses'))
+        violets = self.repo._navigate_tree(tree.oid, self.repo._key2path('violets'))
+        self.assertEquals(json.dumps('red'), pygit2_repo[roses].data)
+        self.assertEquals(json.dumps('blue'), pygit2_repo[violets].data)
+
+    def test_keys_fanned_out(self):
+        """Keys are put under two levels of hash prefix directories, so the
+        root tree stays small.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.add('path/to/key', 'baz')
+        self.assertEqual('0b/ee/foo', self.repo._key2path('foo'))
+        root = self.repo._repo[self.repo._repo_head().tree.oid]
+        self.assertEqual(['0b'], [entry.name for entry in root])
+        self.assertEqual('baz', self.repo.index('path/to/key'))
+        self.repo.commit()
+        self.assertEqual(['foo', 'path/to/key'], self.repo.keys())
+        self.assertEqual('baz', self.repo.show('path/to/key'))
+
+    def test_flat_layout(self):
+        """A repository that keeps keys at the root of its tree still works.
+        """
+        self.repo._repo.config[jsongit.models.LAYOUT_SETTING] = 'flat'
+        flat = jsongit.init(repo=self.repo._repo)
+        flat.commit('foo', 'bar')
+        flat.commit('roses', 'red')
+        root = flat._repo[flat._repo_head().tree.oid]
+        self.assertEqual(['foo', 'roses'], [entry.name for entry in root])
+        self.assertEqual('red', flat.show('roses'))
+
+    def test_layout_written_on_first_write(self):
+        """Reading an empty repository does not record its layout, and
+        writing the first key does.
+        """
+        config = self.repo._repo.config
+        self.assertEqual([], self.repo.keys())
+        self.assertFalse(self.repo.staged('foo'))
+        with self.assertRaises(KeyError):
+            self.repo.show('foo')
+        with self.assertRaises(KeyError):
+            config[jsongit.models.LAYOUT_SETTING]
+        self.repo.add('foo', 'bar')
+        self.assertEqual(jsongit.models.FANOUT,
+                         config[jsongit.models.LAYOUT_SETTING])
 
     def test_overlapping_paths(self):
         """Should throw error if key overlaps with directory.
@@ -296,6 +510,30 @@ class TestJsonGitRepository(helpers.RepoTestCase):
         with self.assertRaises(KeyError):
             self.repo.show('foo')
 
+    def test_remove_many(self):
+        """Many keys are removed together, or not at all, and the removal is
+        recorded in the repo-level history.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.commit('baz', 'qux')
+        self.repo.commit('kept', 'value')
+        self.repo.add('baz', 'staged')
+        with self.assertRaises(jsongit.StagedDataError):
+            self.repo.remove_many(['foo', 'baz'])
+        with self.assertRaises(KeyError):
+            self.repo.remove_many(['foo', 'missing'])
+        self.assertTrue(self.repo.committed('foo'))
+        self.repo.remove_many(['foo', 'baz'], force=True)
+        self.assertEqual(['kept'], self.repo.keys())
+        self.assertFalse(self.repo.staged('baz'))
+        self.assertEqual({}, self.repo.status())
+        removal = self.repo._repo_head().hex
+        self.assertEqual(set([('foo', None), ('baz', None)]),
+                         set((change.key, change.new) for change in self.repo.changes()
+                             if change.commit == removal))
+        self.repo.commit()
+        self.assertEqual(['kept'], self.repo.keys())
+
     def test_removed_commit(self):
         """If we have a reference to a removed commit, should still be able to
         work with it.
@@ -324,16 +562,153 @@ class TestJsonGitRepository(helpers.RepoTestCase):
         self.assertFalse(self.repo.staged('foo'))
         self.assertFalse(self.repo.committed('foo'))
 
-    # not sure of a compelling use for this.
-    # def xtest_keys(self):
-    #     """Should provide a generator that can yield all the keys in a repo.
-    #     """
-    #     self.repo.commit('a', 'foo')
-    #     self.repo.commit('b', 'bar')
-    #     self.repo.commit('c', 'baz')
-    #     keys = self.repo.keys()
-    #     self.assertNotIn('len', keys)
-    #     self.assertItemsEqual(['a', 'b', 'c'], [key for key in keys])
+    def test_keys(self):
+        """Should list all the committed keys in a repo.
+        """
+        self.repo.commit('a', 'foo')
+        self.repo.commit('b', 'bar')
+        self.repo.commit('c', 'baz')
+        self.repo.add('d', 'staged')
+        keys = self.repo.keys()
+        self.assertNotIn('len', keys)
+        self.assertEqual(['a', 'b', 'c'], keys)
+
+    def test_export(self):
+        """Export writes one line of JSON per key.
+        """
+        self.repo.commit('a', {'roses': 'red'})
+        self.repo.commit('b', 'bar')
+        out = StringIO()
+        self.assertEqual(2, self.repo.export(out))
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(['a', 'b'], [line['key'] for line in lines])
+        self.assertEqual({'roses': 'red'}, lines[0]['value'])
+        self.assertEqual(self.repo.head('a').hex, lines[0]['commit'])
+
+    def test_export_history(self):
+        """History exports the first value in full, then diffs.
+        """
+        self.repo.commit('foo', {'roses': 'red'})
+        self.repo.commit('foo', {'roses': 'red', 'violets': 'blue'})
+        self.repo.commit('foo', {'roses': 'red', 'violets': 'blue'})
+        out = StringIO()
+        watermarks = self.repo.export_history(out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual({'roses': 'red'}, lines[0]['value'])
+        self.assertEqual({'roses': 'red', 'violets': 'blue'},
+                         jsongit.wrappers.DiffWrapper(lines[1]['diff']).apply(
+                             lines[0]['value']))
+        self.assertEqual({}, lines[2]['diff'])
+        self.assertEqual({'foo': self.repo.head('foo').hex}, watermarks)
+
+    def test_export_history_resume(self):
+        """History exports resume after their watermarks.
+        """
+        self.repo.commit('foo', 'step 1')
+        watermarks = self.repo.export_history(StringIO())
+        self.repo.commit('foo', 'step 2')
+        out = StringIO()
+        self.repo.export_history(out, since=watermarks)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(1, len(lines))
+        self.assertEqual('step 2', lines[0]['value'])
+
+    def test_export_at(self):
+        """Export can read from a past repo-level commit, raw.
+        """
+        self.repo.commit('a', 'foo')
+        at = self.repo._repo_head().hex
+        self.repo.commit('a', 'bar')
+        self.repo.commit('b', 'baz')
+        out = StringIO()
+        self.repo.export(out, at=at, raw=True)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([('a', 'foo')],
+                         [(line['key'], line['value']) for line in lines])
+
+    def test_changes(self):
+        """Changes list every key change in repo-level history, in order.
+        """
+        self.repo.commit('a', 'foo')
+        self.repo.commit('b', 'bar')
+        since = self.repo._repo_head().hex
+        self.repo.commit('a', 'baz')
+        changes = list(self.repo.changes())
+        self.assertEqual(['a', 'b', 'a'], [c.key for c in changes])
+        self.assertIsNone(changes[0].old)
+        self.assertEqual(changes[0].new, changes[2].old)
+        key, old, new, commit = list(self.repo.changes(since=since))[0]
+        self.assertEqual('a', key)
+        self.assertEqual(self.repo._repo_head().hex, commit)
+        self.assertEqual('baz', self.repo._blob_value(unhexlify(new)))
+
+    def test_watch_timeout(self):
+        """Watch yields nothing when nothing is committed.
+        """
+        self.repo.commit('a', 'foo')
+        self.assertEqual([], list(self.repo.watch(interval=0.01, timeout=0.05)))
+
+    def test_watch_other_handle(self):
+        """Watch yields changes committed through another handle.
+        """
+        self.repo.commit('a', 'foo')
+        since = self.repo._repo_head().hex
+        other = jsongit.init(helpers.PATH)
+        other.commit('a', 'bar')
+        changes = list(self.repo.watch(since=since, interval=0.01,
+                                       timeout=0.05))
+        self.assertEqual(['a'], [change.key for change in changes])
+        self.assertEqual(other._repo_head().hex, changes[0].commit)
+        self.assertEqual('bar', self.repo._blob_value(unhexlify(changes[0].new)))
+
+    def test_watch_commit_during_poll(self):
+        """A commit landing between a poll and listing its changes is yielded
+        once.
+        """
+        self.repo.commit('a', 'foo')
+        since = self.repo._repo_head().hex
+        self.repo.commit('b', 'foo')
+        repo_head = self.repo._repo_head
+        def racing_repo_head():
+            head = repo_head()
+            if self.repo._repo_head is racing_repo_head:
+                self.repo._repo_head = repo_head
+                self.repo.commit('c', 'foo')
+            return head
+        self.repo._repo_head = racing_repo_head
+        changes = list(self.repo.watch(since=since, interval=0.01,
+                                       timeout=0.1))
+        self.assertEqual(['b', 'c'], [change.key for change in changes])
+
+    def test_changes_until(self):
+        """Changes stop at until.
+        """
+        self.repo.commit('a', 'foo')
+        until = self.repo._repo_head().hex
+        self.repo.commit('b', 'foo')
+        self.assertEqual(['a'], [change.key for change in
+                                 self.repo.changes(until=until)])
+
+    def test_gc_keeps_values(self):
+        """Values and history survive packing.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.commit('foo', 'baz')
+        self.repo.add('staged', 'only')
+        self.repo.gc()
+        self.assertEqual('baz', self.repo.show('foo'))
+        self.assertEqual('bar', self.repo.show('foo', back=1))
+        self.assertEqual('only', self.repo.index('staged'))
+
+    def test_gc_prunes_removed(self):
+        """Removed keys are pruned when old enough.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.commit('keep', 'me')
+        self.repo.remove('foo')
+        result = self.repo.gc(prune_older_than=0)
+        self.assertTrue(result['pruned'] > 0)
+        self.assertEqual('me', self.repo.show('keep'))
 
     def test_log(self):
         """Should provide a generator that tracks through commits.
@@ -354,6 +729,43 @@ class TestJsonGitRepository(helpers.RepoTestCase):
         log = self.repo.log('foo')
         self.assertEqual('bar', log.next().data)
 
+    def test_stats(self):
+        """Public methods and internal phases are timed.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.show('foo')
+        timers = self.repo.stats()['timers']
+        self.assertEqual(1, timers['method.commit']['count'])
+        self.assertEqual(1, timers['method.show']['count'])
+        self.assertIn('phase.serialize', timers)
+        self.assertIn('phase.odb_write', timers)
+        self.assertIn('phase.ref_update', timers)
+        self.assertIn('phase.decode', timers)
+
+    def test_stats_reset(self):
+        """Reading and resetting the stats leaves no observation behind.
+        """
+        self.repo.commit('foo', 'bar')
+        timers = self.repo.stats(reset=True)['timers']
+        self.assertEqual(1, timers['method.commit']['count'])
+        self.assertEqual({'counters': {}, 'timers': {}}, self.repo.stats())
+        self.repo.show('foo')
+        timers = self.repo.stats()['timers']
+        self.assertIn('method.show', timers)
+        self.assertNotIn('method.commit', timers)
+
+    def test_stats_callback(self):
+        """The on_metric hook sees every observation.
+        """
+        seen = []
+        repo = jsongit.init('test_stats_repo',
+                            on_metric=lambda *args: seen.append(args))
+        try:
+            repo.commit('foo', 'bar')
+            self.assertIn('method.commit', [name for kind, name, v in seen])
+        finally:
+            repo.destroy()
+
     def test_reset(self):
         """Reset should eliminate added changes since the last commit.
         """
@@ -361,3 +773,42 @@ class TestJsonGitRepository(helpers.RepoTestCase):
         self.repo.add('foo', 'added')
         self.repo.reset('foo')
         self.assertEquals('committed', self.repo.index('foo'))
+
+def failed(value):
+    return value.get('status') == 'failed'
+
+class TestScan(helpers.RepoTestCase):
+
+    def setUp(self):
+        super(TestScan, self).setUp()
+        self.repo.commit('job1', {'status': 'failed', 'owner': 'sally'})
+        self.repo.commit('job2', {'status': 'ok', 'owner': 'bob'})
+        self.repo.commit('job3', {'status': 'failed', 'owner': 'dan'})
+
+    def test_scan_in_process(self):
+        """Scans filter and project values.
+        """
+        self.assertEqual([('job1', {'owner': 'sally'}), ('job3', {'owner': 'dan'})],
+                         list(self.repo.scan(failed, projection=['owner'])))
+
+    def test_scan_workers(self):
+        """Scans can run in worker processes, in key order.
+        """
+        self.assertEqual(['job1', 'job3'],
+                         [key for key, value in self.repo.scan(
+                             failed, workers=2, chunk_size=1)])
+
+    def test_scan_workers_unpicklable(self):
+        """Scans with a predicate that cannot be sent to workers run in this
+        process.
+        """
+        self.assertEqual(['job2'],
+                         [key for key, value in self.repo.scan(
+                             lambda value: value['owner'] == 'bob', workers=2)])
+
+    def test_scan_unordered(self):
+        """Scans can yield as workers finish.
+        """
+        self.assertItemsEqual(['job1', 'job2', 'job3'],
+                              [key for key, value in self.repo.scan(
+                                  workers=2, ordered=False, chunk_size=1)])
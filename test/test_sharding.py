@@ -0,0 +1,172 @@
+import os
+import threading
+import shutil
+from StringIO import StringIO
+import json
+
+from helpers import unittest
+import jsongit
+
+PATH = 'test_jsongit_sharded'
+
+class TestShardedRepository(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.lexists(PATH):
+            self.fail("Can't use %s for test repo, something is there." % PATH)
+        self.repo = jsongit.init(PATH, shards=4)
+
+    def tearDown(self):
+        if os.path.lexists(PATH):
+            shutil.rmtree(PATH)
+
+    def test_round_trip(self):
+        """Values go to and come back from their shard.
+        """
+        for i in range(20):
+            self.repo.commit('key%s' % i, {'i': i})
+        for i in range(20):
+            self.assertEqual({'i': i}, self.repo.show('key%s' % i))
+
+    def test_keys_span_shards(self):
+        """Keys from every shard are listed in order.
+        """
+        keys = ['key%02d' % i for i in range(20)]
+        for key in keys:
+            self.repo.commit(key, 'value')
+        self.assertEqual(keys, self.repo.keys())
+        used = [shard for shard in self.repo.shards if shard.keys()]
+        self.assertTrue(len(used) > 1)
+
+    def test_reopen(self):
+        """Reopening uses the manifest and the same routing.
+        """
+        self.repo.commit('foo', 'bar')
+        reopened = jsongit.init(PATH)
+        self.assertEqual('bar', reopened.show('foo'))
+        with self.assertRaises(ValueError):
+            jsongit.init(PATH, shards=3)
+
+    def test_export(self):
+        """Exports cover every shard in key order.
+        """
+        keys = ['key%02d' % i for i in range(10)]
+        for key in keys:
+            self.repo.commit(key, key)
+        out = StringIO()
+        self.assertEqual(10, self.repo.export(out))
+        self.assertEqual(keys, [json.loads(line)['key']
+                                for line in out.getvalue().splitlines()])
+
+    def test_export_snapshot(self):
+        """Exports can be taken from a snapshot.
+        """
+        self.repo.commit('foo', 'before')
+        snapshot = self.repo.snapshot()
+        self.repo.commit('foo', 'after')
+        self.repo.commit('bar', 'after')
+        out = StringIO()
+        self.repo.export(out, at=snapshot)
+        self.assertEqual([{'foo': 'before'}], [
+            {line['key']: line['value']} for line in
+            map(json.loads, out.getvalue().splitlines())])
+
+    def test_history_and_changes(self):
+        """History exports, changes and indexes cover every shard.
+        """
+        keys = ['key%02d' % i for i in range(10)]
+        for key in keys:
+            self.repo.commit(key, {'n': 1})
+        since = self.repo.snapshot()
+        self.repo.commit('key03', {'n': 2})
+        self.assertEqual(keys, sorted(change.key
+                                      for change in self.repo.changes()
+                                      if change.old is None))
+        self.assertEqual(['key03'], [change.key for change in
+                                     self.repo.changes(since=since)])
+        out = StringIO()
+        watermarks = self.repo.export_history(out)
+        self.assertEqual(keys, sorted(watermarks))
+        self.assertEqual(11, len(out.getvalue().splitlines()))
+        self.repo.create_index('n', path='n')
+        self.repo.drop_index('n')
+        with self.assertRaises(KeyError):
+            self.repo.find('n', 1)
+        signature = self.repo.signature(1332438935)
+        self.assertEqual(self.repo.shards[0].signature().name, signature.name)
+        self.assertEqual(1332438935, signature.time)
+
+    def test_watch(self):
+        """Watching yields new changes from every shard.
+        """
+        self.repo.commit('key00', 1)
+        since = self.repo.snapshot()
+        keys = ['key%02d' % i for i in range(10)]
+        for key in keys:
+            self.repo.commit(key, 2)
+        self.assertEqual(keys, sorted(change.key for change in self.repo.watch(
+            since=since, interval=0.01, timeout=0.05)))
+
+    def test_push_and_pull(self):
+        """Keys replicate between sharded repositories, whatever their
+        number of shards, and unsharded ones.
+        """
+        keys = ['key%02d' % i for i in range(10)]
+        for key in keys:
+            self.repo.commit(key, {'n': 1})
+        other = jsongit.init(PATH + '_other', shards=3)
+        plain = jsongit.init(PATH + '_plain')
+        try:
+            self.assertEqual(dict((key, 'created') for key in keys),
+                             self.repo.push(PATH + '_other'))
+            self.assertEqual(keys, other.keys())
+            other.commit('key03', {'n': 2})
+            self.assertEqual({'key03': 'fast-forward'},
+                             self.repo.pull(other, ['key03']))
+            self.assertEqual({'n': 2}, self.repo.show('key03'))
+            self.repo.push(plain)
+            plain.commit('new', {'n': 3})
+            self.assertEqual('created', self.repo.pull(PATH + '_plain')['new'])
+            self.assertEqual({'n': 3}, self.repo.show('new'))
+        finally:
+            other.destroy()
+            plain.destroy()
+
+    def test_persist(self):
+        """Persisting copies every shard.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.commit('baz', 'qux')
+        try:
+            self.assertTrue(self.repo.persist(PATH + '_copy')['objects'] > 0)
+            copy = jsongit.init(PATH + '_copy')
+            self.assertEqual(['baz', 'foo'], copy.keys())
+            with self.assertRaises(ValueError):
+                self.repo.persist(PATH + '_copy')
+        finally:
+            shutil.rmtree(PATH + '_copy', ignore_errors=True)
+
+    def test_merge_nothing(self):
+        """Merging needs a key or a commit.
+        """
+        with self.assertRaises(ValueError):
+            self.repo.merge('foo')
+
+    def test_parallel_writers(self):
+        """Threads can write to the shards at once.
+        """
+        def write(n):
+            for i in range(10):
+                self.repo.commit('thread%s-%s' % (n, i), i)
+        pool = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        self.assertEqual(40, len(self.repo.keys()))
+
+    def test_destroy(self):
+        """Destroy removes every shard.
+        """
+        self.repo.destroy()
+        self.assertFalse(os.path.exists(PATH))
@@ -0,0 +1,52 @@
+import os
+
+from helpers import unittest
+import jsongit
+
+PATH = 'test_jsongit_store.db'
+
+class TestSqliteStore(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.lexists(PATH):
+            self.fail("Can't use %s for test repo, something is there." % PATH)
+        self.repo = jsongit.init(store=jsongit.SqliteStore(PATH))
+
+    def tearDown(self):
+        self.repo.destroy()
+
+    def test_reopen(self):
+        """Keys, history and the index survive reopening the store.
+        """
+        self.repo.commit('foo', 'step 1')
+        self.repo.commit('foo', 'step 2')
+        self.repo.add('bar', 'staged')
+        reopened = jsongit.init(store=jsongit.SqliteStore(PATH))
+        self.assertEqual(self.repo, reopened)
+        self.assertEqual('step 1', reopened.show('foo', back=1))
+        self.assertEqual('staged', reopened.index('bar'))
+
+    def test_same_oids(self):
+        """Commits have the same oids in any store.
+        """
+        memory = jsongit.init(memory=True)
+        author = jsongit.signature('sally', 's@s.com', time=1332438935, offset=0)
+        for repo in (self.repo, memory):
+            repo.commit('foo', {'roses': 'red'}, author=author)
+        self.assertEqual(self.repo.head('foo').hex, memory.head('foo').hex)
+
+    def test_gc(self):
+        """Removed keys are pruned, without losing the rest.
+        """
+        self.repo.commit('foo', 'bar')
+        self.repo.commit('removed', 'baz')
+        self.repo.remove('removed')
+        self.assertTrue(self.repo.gc(prune_older_than=0)['pruned'] > 0)
+        self.assertEqual('bar', self.repo.show('foo'))
+
+    def test_destroy(self):
+        """Destroying the repository deletes the database.
+        """
+        self.repo.destroy()
+        self.assertFalse(os.path.exists(PATH))
+        self.repo = jsongit.init(store=jsongit.SqliteStore(PATH))
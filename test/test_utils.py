@@ -0,0 +1,35 @@
+from helpers import RepoTestCase
+
+import jsongit
+
+class TestGlobalConfig(RepoTestCase):
+
+    def test_missing_setting(self):
+        """Unknown settings raise NoGlobalSettingError.
+        """
+        with self.assertRaises(jsongit.NoGlobalSettingError):
+            jsongit.global_config('jsongit.nonexistent', self.repo._repo)
+
+    def test_repo_setting(self):
+        """Settings in the repository's own config are found.
+        """
+        self.repo._repo.config['user.name'] = 'Repo User'
+        self.assertEqual('Repo User',
+                         jsongit.global_config('user.name', self.repo._repo))
+
+    def test_repo_setting_changed(self):
+        """A changed setting is found, even though settings are cached.
+        """
+        self.repo._repo.config['user.name'] = 'Repo User'
+        self.assertEqual('Repo User',
+                         jsongit.global_config('user.name', self.repo._repo))
+        self.repo._repo.config['user.name'] = 'Some User'
+        other = jsongit.init(self.repo._repo.path)
+        self.assertEqual('Some User', other.signature().name)
+
+    def test_init_does_not_read_config(self):
+        """The default author is only resolved when a commit needs it.
+        """
+        self.assertIsNone(self.repo._identity)
+        self.repo.add('foo', 'bar')
+        self.assertIsNone(self.repo._identity)